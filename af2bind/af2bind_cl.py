@@ -6,14 +6,16 @@ import numpy as np
 import pandas as pd
 import jax
 import jax.numpy as jnp
-import pickle
 import copy
 import matplotlib.pyplot as plt
 import plotly.express as px
-from scipy.special import expit as sigmoid
 from colabdesign import mk_afdesign_model, clear_mem
 from colabdesign.af.alphafold.common import residue_constants, protein
 import py3Dmol
+from af2bind.head import af2bind_head, load_params, pair_features
+from af2bind.result_store import ResultStore
+from structure.assembly import resolve_target_chains
+from structure.selection import residue_selection
 
 # Define aa_order dictionary
 aa_order = {v: k for k, v in residue_constants.restype_order.items()}
@@ -33,36 +35,15 @@ def get_pdb(pdb_code=""):
         return f"AF-{pdb_code}-F1-model_v4.pdb"
 
 def af2bind(outputs, mask_sidechains=True, seed=0):
-    pair_A = outputs["representations"]["pair"][:-20, -20:]
-    pair_B = outputs["representations"]["pair"][-20:, :-20].swapaxes(0, 1)
-    pair_A = pair_A.reshape(pair_A.shape[0], -1)
-    pair_B = pair_B.reshape(pair_B.shape[0], -1)
-    x = np.concatenate([pair_A, pair_B], -1)
-
-    # Get params
-    if mask_sidechains:
-        model_type = f"split_nosc_pair_A_split_nosc_pair_B_{seed}"
-    else:
-        model_type = f"split_pair_A_split_pair_B_{seed}"
-    with open(f"af2bind_params/attempt_7_2k_lam0-03/{model_type}.pickle", "rb") as handle:
-        params_ = pickle.load(handle)
-    params_ = dict(**params_["~"], **params_["linear"])
-    p = jax.tree_map(lambda x: np.asarray(x), params_)
-
-    # Get predictions
-    x = (x - p["mean"]) / p["std"]
-    x = (x * p["w"][:, 0]) + (p["b"] / x.shape[-1])
-    p_bind_aa = x.reshape(x.shape[0], 2, 20, -1).sum((1, 3))
-    p_bind = sigmoid(p_bind_aa.sum(-1))
-    return {"p_bind": p_bind, "p_bind_aa": p_bind_aa}
-
-def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=False):
+    # Linear head on the pair representation, with the parameters read once per process
+    return af2bind_head(pair_features(outputs["representations"]["pair"]),
+                        load_params(mask_sidechains=mask_sidechains, seed=seed))
+
+def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=False, store_path=None):
     target_pdb = target_pdb.replace(" ", "")
-    target_chain = target_chain.replace(" ", "")
-    if target_chain == "":
-        target_chain = "A"
 
-    pdb_filename = get_pdb(target_pdb)
+    # Chains scored in one prediction: "A" (default), "A,B", "all" or the biological "assembly"
+    pdb_filename, target_chain = resolve_target_chains(get_pdb(target_pdb), target_chain)
 
     clear_mem()
     af_model = mk_afdesign_model(protocol="binder", debug=True)
@@ -97,19 +78,17 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
     df = pd.DataFrame(data, columns=labels)
     df.to_csv(f'results_{target_pdb}.csv')
 
+    # Add the target to the result store shared by the runs
+    if store_path:
+        with ResultStore(store_path) as store:
+            store.insert(target_pdb, df, source=pdb_filename)
+
     df_sorted = df.sort_values("p(bind)", ascending=False, ignore_index=True).rename_axis('rank').reset_index()
     print(df_sorted.head(15))
 
     top_n = 15
-    top_n_idx = pred_bind.argsort()[::-1][:15]
-    pymol_cmd = "select ch" + str(target_chain) + ","
-    for n, i in enumerate(top_n_idx):
-        p = pred_bind[i]
-        c = af_model._pdb["idx"]["chain"][i]
-        r = af_model._pdb["idx"]["residue"][i]
-        pymol_cmd += f" resi {r}"
-        if n < top_n - 1:
-            pymol_cmd += " +"
+    top_n_idx = pred_bind.argsort()[::-1][:top_n]
+    pymol_cmd = f"select ch{target_chain.replace(',', '')}, " + residue_selection([(af_model._pdb["idx"]["chain"][i], af_model._pdb["idx"]["residue"][i]) for i in top_n_idx])
 
     print("\n🧪 Pymol Selection Cmd:")
     print(pymol_cmd)
@@ -117,12 +96,13 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
 def main():
     parser = argparse.ArgumentParser(description="Run AlphaFold2 and Binding Analysis")
     parser.add_argument("target", metavar="TARGET", type=str, help="Protein structure file or PDB code")
-    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain (default: A)")
+    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain(s): A, A,B, all or assembly (default: A)")
     parser.add_argument("-s", "--mask_sidechains", action="store_true", help="Mask sidechains (default: False)")
     parser.add_argument("-m", "--mask_sequence", action="store_true", help="Mask sequence (default: False)")
+    parser.add_argument("--store", type=str, default=None, help="SQLite result store to add the predictions to, e.g. af2bind_results.db")
     args = parser.parse_args()
 
-    run_af2bind(target_pdb=args.target, target_chain=args.chain, mask_sidechains=args.mask_sidechains, mask_sequence=args.mask_sequence)
+    run_af2bind(target_pdb=args.target, target_chain=args.chain, mask_sidechains=args.mask_sidechains, mask_sequence=args.mask_sequence, store_path=args.store)
 
 if __name__ == "__main__":
     main()
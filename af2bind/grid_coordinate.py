@@ -12,8 +12,11 @@ from scipy.special import expit as sigmoid
 from colabdesign import mk_afdesign_model, clear_mem
 from colabdesign.af.alphafold.common import residue_constants, protein
 import py3Dmol
-import pymol 
-import __main__
+from grid_box.vina_config import config_record, write_configs
+from structure.assembly import resolve_target_chains
+from structure.geometry import center_of_mass
+from structure.pdb_arrays import read_pdb_arrays
+from structure.selection import residue_selection
 
 # Define aa_order dictionary
 aa_order = {v: k for k, v in residue_constants.restype_order.items()}
@@ -88,21 +91,20 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
 
     **Args:**
     - `target_pdb (string)`: PDB code (according to RCSB or AlphaFold database), or the path to the PDB file.
-    - `target_chain (string)`: Chain identifier in the PDB file.
+    - `target_chain (string)`: Chain identifier in the PDB file, several chains ("A,B"), "all" protein
+                               chains or the biological "assembly", scored in one prediction.
     - `mask_sidechains (bool, optional)`: Whether to mask sidechains in the calculation. Default is `True`.
     - `mask_sequence (bool, optional)`: Whether to mask the sequence in the calculation. Default is `False`.
 
     **Returns:**
-    - `string`: PyMOL selection command for the top 15 binding residues.
+    - `string`: chain-aware PyMOL selection command for the top 15 binding residues.
     - `results_{target_pdb}.csv`: CSV file containing the binding probabilities for each residue.
 
     """
     target_pdb = target_pdb.replace(" ", "")
-    target_chain = target_chain.replace(" ", "")
-    if target_chain == "":
-        target_chain = "A"
 
-    pdb_filename = get_pdb(target_pdb)
+    # Chains scored in one prediction: "A" (default), "A,B", "all" or the biological "assembly"
+    pdb_filename, target_chain = resolve_target_chains(get_pdb(target_pdb), target_chain)
 
     clear_mem()
     af_model = mk_afdesign_model(protocol="binder", debug=True)
@@ -143,15 +145,8 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
 
     #Generate the pymol selection command for top 15 bind-res
     top_n = 15
-    top_n_idx = pred_bind.argsort()[::-1][:15]
-    pymol_cmd = ""
-    for n, i in enumerate(top_n_idx):
-        p = pred_bind[i]
-        c = af_model._pdb["idx"]["chain"][i]
-        r = af_model._pdb["idx"]["residue"][i]
-        pymol_cmd += f" resi {r}"
-        if n < top_n - 1:
-            pymol_cmd += " +"
+    top_n_idx = pred_bind.argsort()[::-1][:top_n]
+    pymol_cmd = residue_selection([(af_model._pdb["idx"]["chain"][i], af_model._pdb["idx"]["residue"][i]) for i in top_n_idx])
 
     print("\n🧪 Pymol Selection Cmd:")
     print(pymol_cmd)
@@ -170,22 +165,16 @@ def grid_coordinate(target_pdb, pymol_cmd, size=34):
 
     **Returns:**
         `summary (string)`: summary of the calculate the grid coordinate according to the selected list of binding residues
-        `config_{target_pdb} in text file`: config file with all the calculated value 
+        `{target}_config.txt`: Vina config file with all the calculated value 
     """
 
     protein_structure = get_pdb(target_pdb)
-    
-    __main__.pymol_argv = ['pymol', '-qc']  # Quiet and no GUI
-    pymol.finish_launching()
 
     # Load protein structure
-    pymol.cmd.load(protein_structure, 'protein')
+    structure = read_pdb_arrays(protein_structure)
 
-    # Initialize list to store binding residues
-    binding_res = set()
     # Compute the overall center of mass
-    #binding_res_coords = pymol.centerofmass('resi ' + '+'.join(map(str, pymol_cmd)))
-    binding_res_coords = pymol.cmd.centerofmass(pymol_cmd)
+    binding_res_coords = center_of_mass(structure, pymol_cmd)
     
     # Print the overall center of mass
     print("Overall center of mass of binding residues:", binding_res_coords)
@@ -203,26 +192,16 @@ def grid_coordinate(target_pdb, pymol_cmd, size=34):
 
     protein_name= target_pdb.split("/")[-1].split(".")[0]
 
-    # Save the coordinates of the binding residues' center of mass to a text file
-    output_config_path = os.path.join(os.getcwd(), f"config_{target_pdb}.txt")
-    with open(output_config_path, "w") as config_file:
-        config_file.write(f"The grid coordinates of '{target_pdb}' protein by top 15 amino acids:\n")
-        config_file.write("center_x = {:.2f}\n".format(binding_res_coords[0]))
-        config_file.write("center_y = {:.2f}\n".format(binding_res_coords[1]))
-        config_file.write("center_z = {:.2f}\n".format(binding_res_coords[2]))
-        config_file.write("/n")
-        # size
-        config_file.write("size = {:.2f}\n".format(size))
+    # Save the grid box as a Vina config file
+    record = config_record({"center": binding_res_coords, "size": size}, target=protein_name)
+    output_config_path = write_configs([record], os.getcwd())[0]
 
     print(f"Output saved to {output_config_path}")
 
-    # Quit PyMOL
-    pymol.cmd.quit()
-
 def main():
     parser = argparse.ArgumentParser(description="Run AlphaFold2 and Binding Analysis")
     parser.add_argument("target", metavar="TARGET", type=str, help="Protein structure file or PDB code")
-    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain (default: A)")
+    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain(s): A, A,B, all or assembly (default: A)")
     parser.add_argument("-s", "--mask_sidechains", action="store_true", help="Mask sidechains (default: False)")
     parser.add_argument("-m", "--mask_sequence", action="store_true", help="Mask sequence (default: False)")
     args = parser.parse_args()
@@ -1,7 +1,7 @@
 import os
 import numpy as np
-import pymol
-import __main__
+from structure.geometry import center_of_mass, geometry
+from structure.pdb_arrays import read_pdb_arrays
 
 def get_pdb(pdb_code=""):
     """
@@ -42,16 +42,13 @@ def grid_size(target_pdb, pymol_cmd, size=34):
 
     """
     protein_structure = get_pdb(target_pdb)
-    
-    __main__.pymol_argv = ['pymol', '-qc']  # Quiet and no GUI
-    pymol.finish_launching()
 
-    # Load protein structure
-    pymol.cmd.load(protein_structure, 'target_protein')
+    # Load protein structure, the selection and geometry results are cached on it
+    structure = read_pdb_arrays(protein_structure)
 
     # Compute the overall center of mass
-    binding_res_coords = pymol.cmd.centerofmass(pymol_cmd)
-    protein_coords = pymol.cmd.centerofmass('target_protein')
+    binding_res_coords = center_of_mass(structure, pymol_cmd)
+    protein_coords = center_of_mass(structure)
     
     # Print the overall center of mass
     print("Overall center of mass of binding residues:", binding_res_coords)
@@ -65,29 +62,16 @@ def grid_size(target_pdb, pymol_cmd, size=34):
 
 
     #get diameter of protein
-    # Get coordinates of all atoms in the protein
-    atom_coords = pymol.cmd.get_coords("target_protein")
-    distances = np.linalg.norm(atom_coords[:, None] - atom_coords, axis=-1)
-    np.fill_diagonal(distances, 0)    # Set the diagonal elements to 0 to avoid self-distances
-    diameter = np.max(distances)
+    diameter = geometry(structure).diameter()
     print("The diameter of the protein is:", diameter)
 
     #get diameter of binding residues
-    pymol.cmd.select('binding_res', pymol_cmd)
-    # Get coordinates of all atoms in the protein
-    atom_coords_bres = pymol.cmd.get_coords("binding_res")
-    # Calculate the pairwise distances between all atoms
-    distances_bres = np.linalg.norm(atom_coords_bres[:, None] - atom_coords_bres, axis=-1)
-    np.fill_diagonal(distances_bres, 0)# Set the diagonal elements to 0 to avoid self-distances
-    diameter_bres = np.max(distances_bres)
+    diameter_bres = geometry(structure).diameter(pymol_cmd)
     # Print the diameter
     print("The diameter of the binding residues is:", diameter_bres)
 
     size = round(diameter_bres + euc_distance)
 
-    # Quit PyMOL
-    pymol.cmd.quit()
-
     return size
 
 
@@ -29,8 +29,14 @@ import plotly.express as px
 from scipy.special import expit as sigmoid
 from colabdesign import mk_afdesign_model, clear_mem
 from colabdesign.af.alphafold.common import residue_constants, protein
-import pymol 
-import __main__
+from grid_box.box_fit import fit_box
+from grid_box.grid_engine import grid_boxes
+from grid_box.site_clusters import af2bind_anchor_coords, cluster_sites
+from grid_box.vina_config import config_record, write_configs
+from structure.assembly import resolve_target_chains
+from structure.geometry import center_of_mass, geometry
+from structure.pdb_arrays import read_pdb_arrays
+from structure.selection import residue_selection, select
 
 # Define aa_order dictionary
 aa_order = {v: k for k, v in residue_constants.restype_order.items()}
@@ -105,21 +111,22 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
 
     **Args:**
     - `target_pdb (string)`: PDB code (according to RCSB or AlphaFold database), or the path to the PDB file.
-    - `target_chain (string)`: Chain identifier in the PDB file.
+    - `target_chain (string)`: Chain identifier in the PDB file, several chains ("A,B"), "all" protein
+                               chains or the biological "assembly", scored in one prediction.
     - `mask_sidechains (bool, optional)`: Whether to mask sidechains in the calculation. Default is `True`.
     - `mask_sequence (bool, optional)`: Whether to mask the sequence in the calculation. Default is `False`.
 
     **Returns:**
-    - `string`: PyMOL selection command for the top 15 binding residues.
+    - `tuple (string, string)`: `(pymol_cmd, pdb_filename)`, the chain-aware PyMOL selection command
+                                for the top 15 binding residues and the PDB file that was scored
+                                (the assembly file written for "assembly").
     - `results_{target_pdb}.csv`: CSV file containing the binding probabilities for each residue.
 
     """
     target_pdb = target_pdb.replace(" ", "")
-    target_chain = target_chain.replace(" ", "")
-    if target_chain == "":
-        target_chain = "A"
 
-    pdb_filename = get_pdb(target_pdb)
+    # Chains scored in one prediction: "A" (default), "A,B", "all" or the biological "assembly"
+    pdb_filename, target_chain = resolve_target_chains(get_pdb(target_pdb), target_chain)
 
     clear_mem()
     af_model = mk_afdesign_model(protocol="binder", debug=True)
@@ -160,22 +167,21 @@ def run_af2bind(target_pdb, target_chain, mask_sidechains=True, mask_sequence=Fa
 
     #Generate the pymol selection command for top 15 bind-res
     top_n = 15
-    top_n_idx = pred_bind.argsort()[::-1][:15]
-    pymol_cmd = ""
-    for n, i in enumerate(top_n_idx):
-        p = pred_bind[i]
-        c = af_model._pdb["idx"]["chain"][i]
-        r = af_model._pdb["idx"]["residue"][i]
-        pymol_cmd += f" resi {r}"
-        if n < top_n - 1:
-            pymol_cmd += " +"
+    top_n_idx = pred_bind.argsort()[::-1][:top_n]
+    pymol_cmd = residue_selection([(af_model._pdb["idx"]["chain"][i], af_model._pdb["idx"]["residue"][i]) for i in top_n_idx])
 
     print("\n🧪 Pymol Selection Cmd:")
     print(pymol_cmd)
-    return pymol_cmd
+
+    #Group the residues above p(bind) 0.5 into spatial sites on their CB (CA for Gly) coordinates
+    sites = cluster_sites(af2bind_anchor_coords(af_model._pdb["batch"])[:af_model._target_len], pred_bind)
+    for site in sites:
+        residues = [f'{af_model._pdb["idx"]["chain"][i]}{af_model._pdb["idx"]["residue"][i]}' for i in site["residues"]]
+        print(f"Site {site['site']}: score {site['score']:.2f}, {site['n_residues']} residues: {' '.join(residues)}")
+    return pymol_cmd, pdb_filename
 
     
-def grid_coordinate(target_pdb, pymol_cmd):
+def grid_coordinate(target_pdb, pymol_cmd, tight=False, margin=4.0):
     """
     Calculate the grid coordinate (center of mass) from the list of selected residues
 
@@ -184,31 +190,31 @@ def grid_coordinate(target_pdb, pymol_cmd):
                                          according to the Alphafold database), 
                                or as an empty string first, and provides path for to the pdb-file
         `pymol_cmd (string)`: selected list of binding residues e.g. "resi 112 + resi 137 + resi 149 + resi 115"
+        `tight (bool, optional)`: fit an anisotropic box to the binding residues instead of the
+                                  diameter + distance heuristic. Default is `False`.
+        `margin (float, optional)`: padding of the tight box in Angstrom. Default is `4.0`.
 
     **Returns:**
         `summary (string)`: summary of the calculate the grid coordinate according to the selected list of binding residues
-        `config_{target_pdb} in text file`: config file with all the calculated value
+        `{target}_config.txt`: Vina config file with all the calculated value
 
         - Grid coordinate: Center of mass of the top 15 predicted binding residues
-        - Grid size:   
+                           (box center of the binding residues if `tight`)
+        - Grid size: diameter of the binding residues + distance to the protein center of mass,
+                     or the fitted size_x/size_y/size_z if `tight`
     """
 
     protein_structure = get_pdb(target_pdb)
-    
-    __main__.pymol_argv = ['pymol', '-qc']  # Quiet and no GUI
-    pymol.finish_launching()
 
-    # Load protein structure
-    pymol.cmd.load(protein_structure, 'target_protein')
+    # Load protein structure, the selection and geometry results are cached on it
+    structure = read_pdb_arrays(protein_structure)
 
-    # Initialize list to store binding residues
-    binding_res = set()
-    binding_res_coords = pymol.cmd.centerofmass(pymol_cmd)
+    binding_res_coords = center_of_mass(structure, pymol_cmd)
 
     # Define grid coordinates based on center of mass and size
     center_x, center_y, center_z = binding_res_coords
 
-    protein_coords = pymol.cmd.centerofmass('target_protein')
+    protein_coords = center_of_mass(structure)
     
     # Print the overall center of mass
     print("Overall center of mass of binding residues:", binding_res_coords)
@@ -221,23 +227,25 @@ def grid_coordinate(target_pdb, pymol_cmd):
     print(f"Distance between the binding residues and protein = {euc_distance} nm")
 
     #get diameter of protein
-    atom_coords = pymol.cmd.get_coords("target_protein")
-    distances = np.linalg.norm(atom_coords[:, None] - atom_coords, axis=-1)
-    np.fill_diagonal(distances, 0)    # Set the diagonal elements to 0 to avoid self-distances
-    diameter = np.max(distances)
+    diameter = geometry(structure).diameter()
     print("The diameter of the protein is:", diameter)
 
     #get diameter of binding residues
-    pymol.cmd.select('binding_res', pymol_cmd)
-    atom_coords_bres = pymol.cmd.get_coords("binding_res")
-    # Calculate the pairwise distances between all atoms
-    distances_bres = np.linalg.norm(atom_coords_bres[:, None] - atom_coords_bres, axis=-1)
-    np.fill_diagonal(distances_bres, 0)# Set the diagonal elements to 0 to avoid self-distances
-    diameter_bres = np.max(distances_bres)
+    atom_coords_bres = structure.coords[select(structure, pymol_cmd)]
+    diameter_bres = geometry(structure).diameter(pymol_cmd)
     # Print the diameter
     print("The diameter of the binding residues is:", diameter_bres)
 
     size = round(diameter_bres + euc_distance)
+    size_x = size_y = size_z = size
+
+    if tight:
+        # Tight anisotropic box around the binding residues
+        box = fit_box(atom_coords_bres, margin=margin)
+        binding_res_coords = box["center"]
+        center_x, center_y, center_z = binding_res_coords
+        size_x, size_y, size_z = box["size"]
+        print(f"Fitted box {size_x:.2f} x {size_y:.2f} x {size_z:.2f} A, {box['volume'] / size ** 3:.0%} of the heuristic volume")
 
     
     print(f"center_x: {center_x}")
@@ -249,36 +257,65 @@ def grid_coordinate(target_pdb, pymol_cmd):
 
     protein_name= target_pdb.split("/")[-1].split(".")[0]
 
-    # Save the coordinates of the binding residues' center of mass to a text file
-    output_config_path = os.path.join(os.getcwd(), f"config_{target_pdb}.txt")
-    with open(output_config_path, "w") as config_file:
-        config_file.write(f"The grid coordinates of '{target_pdb}' protein by top 15 amino acids predicted by AF2bind:\n")
-        config_file.write("center_x = {:.2f}\n".format(binding_res_coords[0]))
-        config_file.write("center_y = {:.2f}\n".format(binding_res_coords[1]))
-        config_file.write("center_z = {:.2f}\n".format(binding_res_coords[2]))
-        config_file.write("\n")
-        # size
-        config_file.write("size_x = {:.2f}\n".format(size))
-        config_file.write("size_y = {:.2f}\n".format(size))
-        config_file.write("size_z = {:.2f}\n".format(size))
+    # Save the grid box as a Vina config file
+    record = config_record({"center": binding_res_coords, "size": (size_x, size_y, size_z)}, target=protein_name)
+    output_config_path = write_configs([record], os.getcwd())[0]
 
     print(f"Output saved to {output_config_path}")
 
-    # Quit PyMOL
-    pymol.cmd.quit()
+def grid_sites(target_pdb, pbind=0.5, linkage=8.0, max_sites=None, tight=False, margin=4.0, csv_path=None):
+    """
+    Write one grid box per binding site: the af2bind residues above `pbind` are
+    clustered spatially (single linkage on their CB coordinates) and the sites are
+    ranked by summed p(bind), so two pockets get two boxes instead of one box
+    centered between them.
+
+    **Args:**
+        `target_pdb (string)`: PDB code or path, with its `results_{target_pdb}.csv` from run_af2bind.
+        `pbind (float, optional)`: p(bind) threshold of the clustered residues. Default is `0.5`.
+        `linkage (float, optional)`: single-linkage distance in Angstrom. Default is `8.0`.
+        `max_sites (int, optional)`: keep only the best ranked sites. Default is all of them.
+        `tight (bool, optional)`: fit anisotropic boxes to the site residues. Default is `False`.
+        `margin (float, optional)`: padding of the tight boxes in Angstrom. Default is `4.0`.
+        `csv_path (string, optional)`: af2bind results. Default is `results_{target_pdb}.csv`.
+
+    **Returns:**
+        `boxes (list)`: one grid box per site, also saved as `{target}_site{rank}_config.txt`
+    """
+    protein_structure = get_pdb(target_pdb)
+    structure = read_pdb_arrays(protein_structure)
+    source = {"type": "clusters", "pbind": pbind, "linkage": linkage, "max_sites": max_sites}
+    boxes = grid_boxes(structure, [source], predictions=csv_path or f'results_{target_pdb}.csv', tight=tight, margin=margin)
+    if not boxes:
+        print(f"No binding site with p(bind) > {pbind} found for {target_pdb}")
+        return boxes
+
+    protein_name= target_pdb.split("/")[-1].split(".")[0]
+    records = [config_record(box, target=protein_name) for box in boxes]
+    for box, output_config_path in zip(boxes, write_configs(records, os.getcwd())):
+        print(f"{box['box_id']} (score {box['score']:.2f}, {len(box['residues'])} residues): center {box['center']}, saved to {output_config_path}")
+    return boxes
 
 def main():
     parser = argparse.ArgumentParser(description="Run AlphaFold2 and Binding Analysis")
     parser.add_argument("target", metavar="TARGET", type=str, help="Protein structure file or PDB code")
-    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain (default: A)")
+    parser.add_argument("-c", "--chain", type=str, default="", help="Target chain(s): A, A,B, all or assembly (default: A)")
     parser.add_argument("-s", "--mask_sidechains", action="store_true", help="Mask sidechains (default: False)")
     parser.add_argument("-m", "--mask_sequence", action="store_true", help="Mask sequence (default: False)")
+    parser.add_argument("-t", "--tight", action="store_true", help="Fit a tight anisotropic grid box (default: False)")
+    parser.add_argument("--sites", action="store_true", help="One grid box per clustered binding site instead of the top 15 (default: False)")
     args = parser.parse_args()
 
-    binding_res_coords = run_af2bind(target_pdb=args.target, target_chain=args.chain, mask_sidechains=args.mask_sidechains, mask_sequence=args.mask_sequence)
-    
-    pymol_cmd = "resi 415 + resi 556 + resi 603 + resi 509 + resi 364 + resi 462 + resi 334 + resi 572 + resi 525 + resi 555 + resi 508 + resi 602 + resi 363 + resi 414 + resi 559"
-    grid_coordinate(args.target, binding_res_coords)
+    pymol_cmd, pdb_filename = run_af2bind(target_pdb=args.target, target_chain=args.chain, mask_sidechains=args.mask_sidechains, mask_sequence=args.mask_sequence)
+
+    # The chains of a biological assembly only exist in the assembly file scored by run_af2bind
+    target = args.target
+    if args.chain.replace(" ", "").lower().startswith("assembly"):
+        target = pdb_filename
+    if args.sites:
+        grid_sites(target, tight=args.tight, csv_path=f'results_{args.target.replace(" ", "")}.csv')
+    else:
+        grid_coordinate(target, pymol_cmd, tight=args.tight)
 
 
 
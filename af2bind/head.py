@@ -0,0 +1,66 @@
+import functools
+import os
+import pickle
+
+import numpy as np
+from scipy.special import expit as sigmoid
+
+# Length of the peptide binder: one residue per amino acid type, see run_af2bind
+BINDER_LEN = 20
+
+# Downloaded af2bind parameters, see the README
+PARAMS_DIRECTORY = os.path.join("af2bind_params", "attempt_7_2k_lam0-03")
+
+
+@functools.lru_cache(maxsize=None)
+def load_params(mask_sidechains=True, seed=0, params_directory=PARAMS_DIRECTORY):
+    """
+    Linear af2bind head on the AF2 pair representation, read once per process.
+
+    Returns:
+    - dict: NumPy arrays mean, std, w and b.
+    """
+    if mask_sidechains:
+        model_type = f"split_nosc_pair_A_split_nosc_pair_B_{seed}"
+    else:
+        model_type = f"split_pair_A_split_pair_B_{seed}"
+    with open(os.path.join(params_directory, f"{model_type}.pickle"), "rb") as handle:
+        params_ = pickle.load(handle)
+    params_ = dict(**params_["~"], **params_["linear"])
+    return {key: np.asarray(value) for key, value in params_.items()}
+
+
+def pair_features(pair):
+    """
+    Features of the target residues: their pair representation with the 20 binder residues, both ways.
+
+    Args:
+    - pair (np.ndarray): AF2 pair representation of target + binder, (L + 20, L + 20, C).
+
+    Returns:
+    - np.ndarray: (L, 2 * 20 * C).
+    """
+    pair = np.asarray(pair)
+    pair_A = pair[:-BINDER_LEN, -BINDER_LEN:]
+    pair_B = pair[-BINDER_LEN:, :-BINDER_LEN].swapaxes(0, 1)
+    pair_A = pair_A.reshape(pair_A.shape[0], -1)
+    pair_B = pair_B.reshape(pair_B.shape[0], -1)
+    return np.concatenate([pair_A, pair_B], -1)
+
+
+def af2bind_head(x, p):
+    """
+    Binding probability of every target residue, and its contribution per binder amino acid.
+
+    Args:
+    - x (np.ndarray): pair features of one or several stacked targets, see pair_features.
+    - p (dict): head parameters, see load_params.
+
+    Returns:
+    - dict: p_bind (L,) and p_bind_aa (L, 20).
+    """
+    x = (x - p["mean"]) / p["std"]
+    x = (x * p["w"][:, 0]) + (p["b"] / x.shape[-1])
+    p_bind_aa = x.reshape(x.shape[0], 2, BINDER_LEN, -1).sum((1, 3))
+    p_bind = sigmoid(p_bind_aa.sum(-1))
+    return {"p_bind": p_bind, "p_bind_aa": p_bind_aa}
@@ -0,0 +1,220 @@
+import glob
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+# Residue-level af2bind results of many targets in one SQLite file.
+# - targets: one row per scored target (PDB code, UniProt accession of an AlphaFold-DB model, file name)
+# - residues: one row per residue with its rank by decreasing p(bind) inside the target, keyed by
+#   (target, rank) so "top-N per target" is an index range instead of a sort per target, and
+#   indexed by (target, chain, resi) for residue lookups, by p(bind) for threshold queries and by
+#   rank with every column, so the top-N of all targets is read from that index alone.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (
+    target_id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL UNIQUE,
+    n_residues INTEGER NOT NULL,
+    source TEXT,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS residues (
+    target_id INTEGER NOT NULL REFERENCES targets(target_id) ON DELETE CASCADE,
+    chain TEXT NOT NULL,
+    resi INTEGER NOT NULL,
+    resn TEXT,
+    p_bind REAL NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (target_id, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS residues_key ON residues (target_id, chain, resi);
+CREATE INDEX IF NOT EXISTS residues_p_bind ON residues (p_bind);
+CREATE INDEX IF NOT EXISTS residues_rank ON residues (rank, target_id, chain, resi, resn, p_bind);
+"""
+
+# Columns of the query results, named like the af2bind CSV files
+COLUMNS = ["target", "chain", "resi", "resn", "p(bind)", "rank"]
+
+_SELECT = """
+SELECT t.target, r.chain, r.resi, r.resn, r.p_bind, r.rank
+FROM residues r JOIN targets t USING (target_id)
+"""
+
+
+class ResultStore:
+    """
+    Persistent store of the per-residue af2bind predictions.
+
+    Each target is inserted in one transaction, so new targets can be added while
+    other processes read the file (the database runs in WAL mode), and a target
+    that is scored again replaces its previous rows.
+    """
+
+    def __init__(self, db_path="af2bind_results.db"):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def targets(self):
+        """
+        Names of the stored targets.
+        """
+        return [row[0] for row in self.connection.execute("SELECT target FROM targets ORDER BY target")]
+
+    def __contains__(self, target):
+        return self.connection.execute("SELECT 1 FROM targets WHERE target = ?", (target,)).fetchone() is not None
+
+    def _insert(self, target, predictions, source=None):
+        # Rows of one target, inside the caller's transaction
+        p_bind = predictions["p(bind)"].to_numpy(dtype=float)
+        rank = np.empty(len(p_bind), dtype=int)
+        rank[np.argsort(-p_bind, kind="stable")] = np.arange(len(p_bind))
+        chains = predictions["chain"].fillna("").astype(str).tolist()
+        resn = predictions["resn"].astype(str).tolist() if "resn" in predictions else [None] * len(p_bind)
+        self.connection.execute("DELETE FROM targets WHERE target = ?", (target,))
+        target_id = self.connection.execute(
+            "INSERT INTO targets (target, n_residues, source, added) VALUES (?, ?, ?, ?)",
+            (target, len(p_bind), source, time.time())).lastrowid
+        self.connection.executemany(
+            "INSERT INTO residues VALUES (?, ?, ?, ?, ?, ?)",
+            zip([target_id] * len(p_bind), chains, predictions["resi"].astype(int).tolist(), resn,
+                p_bind.tolist(), rank.tolist()))
+        return len(p_bind)
+
+    def insert(self, target, predictions, source=None):
+        """
+        Store the predictions of one target, replacing the stored ones if any.
+
+        Args:
+        - target (str): target name, e.g. "6o0k" or the UniProt accession of an AlphaFold-DB model.
+        - predictions (pd.DataFrame): af2bind results with the columns chain, resi, resn and p(bind).
+        - source (str, optional): where the predictions come from, e.g. the CSV path.
+
+        Returns:
+        - int: number of residues stored.
+        """
+        with self.connection:
+            return self._insert(target, predictions, source)
+
+    def import_csvs(self, csv_directory=".", replace=False, batch_size=100):
+        """
+        Insert the `results_{target}.csv` files of a directory, skipping the targets
+        already stored unless `replace`, so it can be rerun as new targets finish.
+        The files are committed `batch_size` targets at a time.
+
+        Returns:
+        - int: number of targets inserted.
+        """
+        csv_paths = []
+        for csv_path in sorted(glob.glob(os.path.join(csv_directory, "results_*.csv"))):
+            target = os.path.basename(csv_path)[len("results_"):-len(".csv")]
+            if replace or target not in self:
+                csv_paths.append((target, csv_path))
+
+        inserted = 0
+        for start in range(0, len(csv_paths), batch_size):
+            with self.connection:
+                for target, csv_path in csv_paths[start:start + batch_size]:
+                    try:
+                        self._insert(target, pd.read_csv(csv_path, index_col=0), source=csv_path)
+                        inserted += 1
+                    except Exception as e:
+                        print(f"Error importing {csv_path}: {e}")
+        print(f"Imported {inserted} target(s) into {self.db_path}")
+        return inserted
+
+    def _query(self, where, params):
+        rows = self.connection.execute(_SELECT + where, params).fetchall()
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+    def _targets_clause(self, targets):
+        # Optional restriction of a query to some targets, by their ids so the residue indexes are used
+        if targets is None:
+            return "", ()
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        return (f" AND r.target_id IN (SELECT target_id FROM targets WHERE target IN ({','.join('?' * len(targets))}))",
+                tuple(targets))
+
+    def predictions(self, target):
+        """
+        Predictions of one target sorted by decreasing p(bind), like grid_engine.read_af2bind_csv.
+        """
+        return self._query("WHERE t.target = ? ORDER BY r.rank", (target,)).drop(columns=["target", "rank"])
+
+    def above(self, pbind=0.8, targets=None):
+        """
+        Residues with p(bind) above a threshold, in every target or in the given ones.
+        """
+        clause, params = self._targets_clause(targets)
+        return self._query(f"WHERE r.p_bind > ?{clause} ORDER BY r.p_bind DESC", (pbind,) + params)
+
+    def count_above(self, pbind=0.8):
+        """
+        Number of residues with p(bind) above a threshold, answered from the p(bind) index alone.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM residues WHERE p_bind > ?", (pbind,)).fetchone()[0]
+
+    def top_n(self, n=15, targets=None):
+        """
+        The n residues with the highest p(bind) of every target (or of the given ones).
+        """
+        clause, params = self._targets_clause(targets)
+        if targets is not None:
+            return self._query(f"WHERE r.rank < ?{clause} ORDER BY r.target_id, r.rank", (n,) + params)
+        # Read in the order of the covering rank index, then grouped by target
+        top = self._query("WHERE r.rank < ?", (n,))
+        return top.sort_values(["target", "rank"], kind="stable", ignore_index=True)
+
+
+def benchmark_store(db_path, n_targets=2000, n_residues=400, seed=0):
+    """
+    Fill a store with random predictions and time the threshold and top-N queries.
+
+    Args:
+    - db_path (str): path of the SQLite file to create.
+    - n_targets (int): number of synthetic targets.
+    - n_residues (int): residues per target.
+    - seed (int): random seed.
+
+    Returns:
+    - dict: insert rate in targets per second and the query timings in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    with ResultStore(db_path) as store:
+        start = time.perf_counter()
+        for k in range(n_targets):
+            store.insert(f"T{k:05d}", pd.DataFrame({"chain": "A", "resi": np.arange(1, n_residues + 1),
+                                                    "resn": "ALA", "p(bind)": rng.beta(0.5, 5, n_residues)}))
+        insert_rate = n_targets / (time.perf_counter() - start)
+
+        timings = {}
+        for name, query in [("count_above_0.8", lambda: store.count_above(0.8)),
+                            ("above_0.8", lambda: store.above(0.8)),
+                            ("top_15", lambda: store.top_n(15)),
+                            ("top_15_one_target", lambda: store.top_n(15, targets="T00042"))]:
+            start = time.perf_counter()
+            result = query()
+            timings[name] = (time.perf_counter() - start) * 1e3
+            print(f"{name}: {result if np.isscalar(result) else len(result)} row(s) in {timings[name]:.1f} ms")
+    print(f"{n_targets} targets x {n_residues} residues inserted at {insert_rate:.0f} targets/s")
+    return {"insert_rate": insert_rate, **timings}
+
+
+if __name__ == "__main__":
+    with ResultStore() as store:
+        store.import_csvs(os.getcwd())
+        print(store.top_n(15).to_string(index=False))
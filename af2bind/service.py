@@ -0,0 +1,523 @@
+import argparse
+import collections
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from af2bind.head import BINDER_LEN, af2bind_head, load_params, pair_features
+from af2bind.result_store import ResultStore
+from structure.assembly import resolve_target_chains
+from structure.filters import chain_mask, protein_mask
+from structure.pdb_arrays import read_pdb_arrays, residue_index
+
+# Binder sequence of run_af2bind, one residue per amino acid type: the order of p_bind_aa
+BINDER_SEQUENCE = "ACDEFGHIKLMNPQRSTVWY"
+
+RCSB_URL = "https://files.rcsb.org/view/{target}.pdb"
+ALPHAFOLD_URL = "https://alphafold.ebi.ac.uk/files/AF-{target}-F1-model_v4.pdb"
+
+# Structures fetched or uploaded, shared by the requests
+STRUCTURE_DIRECTORY = os.path.join(os.getcwd(), "af2bind_structures")
+
+# Requests arriving within BATCH_WINDOW seconds of each other are run as one batch of at most
+# MAX_BATCH targets whose lengths round up to the same multiple of LENGTH_BUCKET residues
+MAX_BATCH = 8
+BATCH_WINDOW = 0.05
+LENGTH_BUCKET = 32
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def fetch_structure(target, directory=STRUCTURE_DIRECTORY):
+    """
+    Local PDB file of a target, downloaded once: a PDB code from RCSB, anything
+    else as the UniProt accession of an AlphaFold-DB model (like get_pdb of af2bind_cl).
+
+    Returns:
+    - str: path of the PDB file.
+    """
+    if len(target) == 4:
+        url, filename = RCSB_URL.format(target=target), f"{target}.pdb"
+    else:
+        url, filename = ALPHAFOLD_URL.format(target=target), f"AF-{target}-F1-model_v4.pdb"
+    pdb_path = os.path.join(directory, filename)
+    if not os.path.isfile(pdb_path):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                pdb_bytes = response.read()
+        except Exception as e:
+            raise ValueError(f"Could not fetch {target} from {url}: {e}")
+        # Write then rename, so a concurrent request never reads a partial file
+        tmp_path = f"{pdb_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as pdb_file:
+            pdb_file.write(pdb_bytes)
+        os.replace(tmp_path, pdb_path)
+    return pdb_path
+
+
+def save_upload(pdb_bytes, directory=STRUCTURE_DIRECTORY):
+    """
+    Store an uploaded PDB file under the hash of its content.
+
+    Returns:
+    - str: path of the PDB file.
+    """
+    pdb_path = os.path.join(directory, f"upload_{hashlib.sha1(pdb_bytes).hexdigest()[:16]}.pdb")
+    if not os.path.isfile(pdb_path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{pdb_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as pdb_file:
+            pdb_file.write(pdb_bytes)
+        os.replace(tmp_path, pdb_path)
+    return pdb_path
+
+
+def target_length(pdb_path, chains):
+    """
+    Number of protein residues with a CA atom in the scored chains, the length AF2 runs on.
+    """
+    structure = read_pdb_arrays(pdb_path)
+    atoms = protein_mask(structure) & chain_mask(structure, chains.split(",")) & (structure.atom_name == "CA")
+    return len(np.unique(residue_index(structure)[atoms]))
+
+
+class AF2Forward:
+    """
+    Warm colabdesign binder model: built once, then every prep_inputs/predict of a
+    length compiled before reuses its XLA program, instead of rebuilding the model
+    and clearing the JAX caches for every target as run_af2bind does.
+
+    Called with a batch of requests of similar length, it runs them one after the other
+    and yields for each one, as soon as it is predicted, the pair representation of
+    target + binder and the (chain, resi, resn) of the residues.
+    """
+
+    def __init__(self):
+        from colabdesign import mk_afdesign_model
+        from colabdesign.af.alphafold.common import residue_constants
+        self.model = mk_afdesign_model(protocol="binder", debug=True)
+        self.aa_order = {v: k for k, v in residue_constants.restype_order.items()}
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            for item in items:
+                self.model.prep_inputs(pdb_filename=item["pdb_path"], chain=item["chains"], binder_len=BINDER_LEN,
+                                       rm_target_sc=item["mask_sidechains"], rm_target_seq=item["mask_sequence"])
+                # Split the binder residues apart, one per amino acid type
+                r_idx = self.model._inputs["residue_index"][-BINDER_LEN] + (1 + np.arange(BINDER_LEN)) * 50
+                self.model._inputs["residue_index"][-BINDER_LEN:] = r_idx.flatten()
+                self.model.set_seq(BINDER_SEQUENCE)
+                self.model.predict(verbose=False)
+                idx = self.model._pdb["idx"]
+                aatype = self.model._pdb["batch"]["aatype"]
+                residues = [(idx["chain"][i], int(idx["residue"][i]), self.aa_order.get(aatype[i], "X"))
+                            for i in range(self.model._target_len)]
+                yield {"pair": np.asarray(self.model.aux["debug"]["outputs"]["representations"]["pair"]),
+                       "residues": residues}
+
+
+class PredictionService:
+    """
+    af2bind predictions shared by concurrent callers.
+
+    Requests are queued and coalesced by a dispatcher thread: after the first one
+    arrives it waits BATCH_WINDOW seconds for more, then runs the oldest request
+    together with the queued ones of the same length bucket and masks, shortest first.
+    Identical requests (same structure, chains and masks) are predicted once, and the
+    recent results are kept in memory for repeated queries.
+
+    The AF2 forward pass runs the targets of a batch one after the other (the batch
+    shares the warm model and its compiled length, it is not one stacked pass), so
+    every result is released as soon as its target is predicted: a request never waits
+    for the other targets of its batch.
+
+    Args:
+    - forward (callable, optional): AF2 forward pass, list of request dicts -> iterable of
+      {"pair", "residues"} in the same order, one per target as it is predicted;
+      defaults to AF2Forward. Pass a stub to run without AF2.
+    - params (callable): head parameters of a mask_sidechains flag, see head.load_params.
+    - max_batch (int): requests per batch at most.
+    - window (float): seconds to wait for more requests once one is queued.
+    - cache_size (int): results kept in memory.
+    - store_path (str, optional): SQLite ResultStore to add every prediction to.
+    """
+
+    def __init__(self, forward=None, params=None, max_batch=MAX_BATCH, window=BATCH_WINDOW, cache_size=256,
+                 store_path=None):
+        self.forward = forward if forward is not None else AF2Forward()
+        self.params = params if params is not None else (lambda mask_sidechains: load_params(mask_sidechains))
+        self.max_batch = max_batch
+        self.window = window
+        self.cache_size = cache_size
+        self.store_path = store_path
+        self.results = collections.OrderedDict()
+        self.pending = []
+        self.condition = threading.Condition()
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self.forward_times = collections.deque(maxlen=1000)
+        self.batch_sizes = collections.deque(maxlen=1000)
+        self.in_flight = 0
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, pdb_path, chains, mask_sidechains=True, mask_sequence=False, target=None, timeout=600):
+        """
+        Predict the binding residues of a structure, blocking until its batch is done.
+
+        Args:
+        - pdb_path (str): local PDB file, see fetch_structure and save_upload.
+        - chains (str): comma-separated chains scored together, e.g. "A,B".
+        - mask_sidechains (bool): mask the target side chains, as the -s option of af2bind_cl.
+        - mask_sequence (bool): mask the target sequence, as the -m option of af2bind_cl.
+        - target (str, optional): name of the target in the result and the store.
+        - timeout (float): seconds to wait for the prediction.
+
+        Returns:
+        - dict: target, chains, residues (DataFrame chain, resi, resn, p(bind)), p_bind_aa (L, 20),
+          batch_size and latency_ms.
+        """
+        submitted = time.perf_counter()
+        with open(pdb_path, "rb") as pdb_file:
+            digest = hashlib.sha1(pdb_file.read()).hexdigest()
+        key = (digest, chains, bool(mask_sidechains), bool(mask_sequence))
+        target = target or os.path.splitext(os.path.basename(pdb_path))[0]
+
+        with self.condition:
+            self.counters["requests"] += 1
+            cached = self.results.get(key)
+            if cached is not None:
+                self.results.move_to_end(key)
+                self.counters["cache_hits"] += 1
+        if cached is None:
+            item = {"key": key, "pdb_path": pdb_path, "chains": chains, "mask_sidechains": bool(mask_sidechains),
+                    "mask_sequence": bool(mask_sequence), "length": target_length(pdb_path, chains),
+                    "target": target, "submitted": submitted, "done": threading.Event(), "result": None, "error": None}
+            with self.condition:
+                self.pending.append(item)
+                self.condition.notify()
+            if not item["done"].wait(timeout):
+                raise TimeoutError(f"No prediction for {target} after {timeout} s")
+            if item["error"] is not None:
+                raise item["error"]
+            cached = item["result"]
+
+        latency_ms = (time.perf_counter() - submitted) * 1e3
+        with self.condition:
+            self.latencies.append(latency_ms)
+        return {**cached, "target": target, "latency_ms": latency_ms}
+
+    def _bucket(self, item):
+        return (-(-item["length"] // LENGTH_BUCKET), item["mask_sidechains"], item["mask_sequence"])
+
+    def _next_batch(self):
+        # Wait for a request, then for the window, and take the oldest request's bucket
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+        time.sleep(self.window)
+        with self.condition:
+            bucket = self._bucket(self.pending[0])
+            batch = [item for item in self.pending if self._bucket(item) == bucket][:self.max_batch]
+            taken = {id(item) for item in batch}
+            self.pending = [item for item in self.pending if id(item) not in taken]
+            self.in_flight = len(batch)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item["done"].is_set():
+                        item["error"] = e
+                        item["done"].set()
+            finally:
+                with self.condition:
+                    self.in_flight = 0
+
+    def _run_batch(self, batch):
+        # Identical requests of the batch are predicted once
+        unique = {}
+        for item in batch:
+            unique.setdefault(item["key"], []).append(item)
+        order = sorted(unique, key=lambda key: unique[key][0]["length"])
+        params = self.params(batch[0]["mask_sidechains"])
+        with self.condition:
+            self.counters["batches"] += 1
+            self.batch_sizes.append(len(batch))
+
+        start = time.perf_counter()
+        for key, output in zip(order, self.forward([unique[key][0] for key in order])):
+            forward_ms = (time.perf_counter() - start) * 1e3
+            item = unique[key][0]
+            head = af2bind_head(pair_features(output["pair"]), params)
+            chain, resi, resn = zip(*output["residues"]) if output["residues"] else ((), (), ())
+            residues = pd.DataFrame({"chain": chain, "resi": resi, "resn": resn, "p(bind)": head["p_bind"]})
+            result = {"chains": item["chains"], "residues": residues, "p_bind_aa": head["p_bind_aa"],
+                      "batch_size": len(batch)}
+            if self.store_path:
+                with ResultStore(self.store_path) as store:
+                    store.insert(item["target"], residues, source=item["pdb_path"])
+
+            with self.condition:
+                self.counters["predicted"] += 1
+                self.forward_times.append(forward_ms)
+                self.results[key] = result
+                while len(self.results) > self.cache_size:
+                    self.results.popitem(last=False)
+            # Release the requests of this target now, not at the end of the batch
+            for waiting in unique[key]:
+                waiting["result"] = result
+                waiting["done"].set()
+            start = time.perf_counter()
+
+    def metrics(self):
+        """
+        Queue depth, request counts and latency percentiles (over the last 1000 requests and batches).
+
+        Returns:
+        - dict: JSON-serializable metrics.
+        """
+        def percentiles(values):
+            if not values:
+                return {"p50": None, "p95": None, "max": None}
+            values = np.asarray(values)
+            return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                    "max": float(values.max())}
+
+        with self.condition:
+            return {
+                "queue_depth": len(self.pending),
+                "in_flight": self.in_flight,
+                "requests": self.counters["requests"],
+                "cache_hits": self.counters["cache_hits"],
+                "predicted": self.counters["predicted"],
+                "batches": self.counters["batches"],
+                "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+                "latency_ms": percentiles(list(self.latencies)),
+                "forward_ms": percentiles(list(self.forward_times)),  # per target
+                "uptime_s": time.time() - self.started,
+            }
+
+
+def prediction_json(result):
+    """
+    JSON body of a prediction: residue columns, p_bind and p_bind_aa per residue.
+    """
+    residues = result["residues"]
+    return json.dumps({
+        "target": result["target"],
+        "chains": result["chains"],
+        "chain": residues["chain"].tolist(),
+        "resi": residues["resi"].tolist(),
+        "resn": residues["resn"].tolist(),
+        "p_bind": residues["p(bind)"].tolist(),
+        "p_bind_aa": np.asarray(result["p_bind_aa"]).tolist(),
+        "binder": BINDER_SEQUENCE,
+        "batch_size": result["batch_size"],
+        "latency_ms": result["latency_ms"],
+    }).encode()
+
+
+def prediction_arrow(result):
+    """
+    Arrow IPC stream of a prediction: one row per residue with chain, resi, resn,
+    p_bind and one p_bind_aa column per binder amino acid (needs pyarrow).
+    """
+    import pyarrow as pa
+    table = pa.Table.from_pandas(result["residues"].rename(columns={"p(bind)": "p_bind"}), preserve_index=False)
+    p_bind_aa = np.asarray(result["p_bind_aa"])
+    for k, aa in enumerate(BINDER_SEQUENCE):
+        table = table.append_column(f"p_bind_aa_{aa}", pa.array(p_bind_aa[:, k]))
+    table = table.replace_schema_metadata({"target": result["target"], "chains": result["chains"]})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def make_handler(service, structure_directory=STRUCTURE_DIRECTORY):
+    """
+    HTTP handler of a PredictionService:
+    - GET /predict?target=6o0k&chain=A: predict a PDB code or AlphaFold-DB accession;
+    - POST /predict?chain=A: predict the PDB file sent as the body, or a JSON body
+      {"target": ..., "pdb": <PDB text, optional>, "chain": ..., "mask_sidechains": ..., "mask_sequence": ...};
+    - GET /metrics: queue depth and latencies, GET /health.
+    Predictions are returned as JSON, or as an Arrow stream with ?format=arrow or Accept: ARROW_TYPE.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"error": message}).encode())
+
+        def log_message(self, format, *args):
+            pass
+
+        def _predict(self, options, pdb_bytes=None):
+            target = options.get("target") or None
+            if pdb_bytes:
+                pdb_path = save_upload(pdb_bytes, structure_directory)
+            elif target:
+                pdb_path = fetch_structure(target.replace(" ", ""), structure_directory)
+            else:
+                raise ValueError("Send a PDB file or a target (PDB code or UniProt accession)")
+            pdb_path, chains = resolve_target_chains(pdb_path, str(options.get("chain", "")))
+            flag = lambda value: str(value).lower() in ("1", "true", "yes")
+            result = service.submit(pdb_path, chains, mask_sidechains=flag(options.get("mask_sidechains", True)),
+                                    mask_sequence=flag(options.get("mask_sequence", False)), target=target)
+            if options.get("format") == "arrow" or ARROW_TYPE in self.headers.get("Accept", ""):
+                self._send(200, prediction_arrow(result), ARROW_TYPE)
+            else:
+                self._send(200, prediction_json(result))
+
+        def _handle(self, options, pdb_bytes=None):
+            try:
+                self._predict(options, pdb_bytes)
+            except ImportError as e:
+                self._error(406, f"Arrow output needs pyarrow: {e}")
+            except (ValueError, KeyError) as e:
+                self._error(400, str(e))
+            except TimeoutError as e:
+                self._error(504, str(e))
+            except Exception as e:
+                self._error(500, f"{type(e).__name__}: {e}")
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            options = dict(urllib.parse.parse_qsl(url.query))
+            if url.path == "/metrics":
+                self._send(200, json.dumps(service.metrics()).encode())
+            elif url.path == "/health":
+                self._send(200, b'{"status": "ok"}')
+            elif url.path == "/predict":
+                self._handle(options)
+            else:
+                self._error(404, f"Unknown path {url.path}")
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != "/predict":
+                return self._error(404, f"Unknown path {url.path}")
+            options = dict(urllib.parse.parse_qsl(url.query))
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            pdb_bytes = body
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                try:
+                    options.update(json.loads(body))
+                except ValueError as e:
+                    return self._error(400, f"Invalid JSON body: {e}")
+                pdb_bytes = options.pop("pdb", "").encode()
+            self._handle(options, pdb_bytes)
+
+    return Handler
+
+
+def serve(service, host="127.0.0.1", port=8000, structure_directory=STRUCTURE_DIRECTORY):
+    """
+    Run the HTTP service until interrupted, one thread per connection.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service, structure_directory))
+    print(f"af2bind service listening on http://{host}:{port} (batches of up to {service.max_batch}, "
+          f"{service.window * 1e3:.0f} ms window)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def synthetic_forward(channels=8, delay=0.5, per_residue=0.001, seed=0):
+    """
+    Stand-in for the AF2 forward pass with random pair representations and a cost of
+    `delay` seconds plus `per_residue` seconds per residue for every target, run one
+    after the other as AF2Forward does, to load-test the service without AF2
+    (see benchmark_service).
+
+    Returns:
+    - (callable, callable): forward and params arguments of PredictionService.
+    """
+    rng = np.random.default_rng(seed)
+    features = 2 * BINDER_LEN * channels
+    params = {"mean": np.zeros(features), "std": np.ones(features),
+              "w": rng.normal(0, 0.1, (features, 1)), "b": np.zeros(1)}
+
+    def forward(items):
+        for item in items:
+            time.sleep(delay + per_residue * item["length"])
+            n = item["length"] + BINDER_LEN
+            residues = [("A", i + 1, "A") for i in range(item["length"])]
+            yield {"pair": rng.normal(size=(n, n, channels)), "residues": residues}
+
+    return forward, lambda mask_sidechains: params
+
+
+def benchmark_service(pdb_paths, n_requests=64, concurrency=16, max_batch=MAX_BATCH, window=BATCH_WINDOW,
+                      forward=None, params=None):
+    """
+    Throughput and latency of concurrent clients, without HTTP, with the synthetic
+    forward pass unless one is given. A max_batch of 1 gives the one-at-a-time baseline.
+    The clients cycle over pdb_paths: with few files most of the gain is identical
+    requests of a batch predicted once, distinct targets still run one after the other.
+
+    Args:
+    - pdb_paths (list of str): PDB files the clients pick from (scored on chain A).
+    - n_requests (int): requests sent in total.
+    - concurrency (int): clients sending at the same time.
+
+    Returns:
+    - dict: requests per second and the service metrics.
+    """
+    if forward is None:
+        forward, params = synthetic_forward()
+    service = PredictionService(forward, params, max_batch=max_batch, window=window, cache_size=0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda k: service.submit(pdb_paths[k % len(pdb_paths)], "A"), range(n_requests)))
+    rate = n_requests / (time.perf_counter() - start)
+    metrics = service.metrics()
+    print(f"max_batch {max_batch}: {rate:.1f} requests/s, mean batch {metrics['mean_batch_size']:.1f}, "
+          f"latency p50 {metrics['latency_ms']['p50']:.0f} ms, p95 {metrics['latency_ms']['p95']:.0f} ms")
+    return {"requests_per_s": rate, **metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve af2bind predictions over HTTP with warm models")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help=f"Requests per batch (default: {MAX_BATCH})")
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW * 1e3,
+                        help=f"Milliseconds to wait for more requests (default: {BATCH_WINDOW * 1e3:.0f})")
+    parser.add_argument("--store", type=str, default=None, help="SQLite result store to add the predictions to")
+    parser.add_argument("--directory", type=str, default=STRUCTURE_DIRECTORY, help="Fetched and uploaded structures")
+    args = parser.parse_args()
+
+    service = PredictionService(max_batch=args.max_batch, window=args.window_ms / 1e3, store_path=args.store)
+    serve(service, args.host, args.port, args.directory)
+
+
+if __name__ == "__main__":
+    main()
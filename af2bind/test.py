@@ -1,6 +1,7 @@
 import pymol 
 import os
 import __main__
+from grid_box.vina_config import config_record, write_configs
 
 
 
@@ -33,13 +34,9 @@ def grid_coordinate(target_pdb, selected_resi, size=34):
 
     protein_name= target_pdb.split("/")[-1].split(".")[0]
 
-    # Save the coordinates of the binding residues' center of mass to a text file
-    output_config_path = os.path.join(os.getcwd(), "config.txt")
-    with open(output_config_path, "w") as config_file:
-        config_file.write(f"The grid coordinates of '{target_pdb}' protein by top 15 amino acids:\n")
-        config_file.write("center_x = {:.2f}\n".format(binding_res_coords[0]))
-        config_file.write("center_y: {:.2f}\n".format(binding_res_coords[1]))
-        config_file.write("center_z: {:.2f}\n".format(binding_res_coords[2]))
+    # Save the grid box as a Vina config file
+    record = config_record({"center": binding_res_coords, "size": size}, target=protein_name)
+    output_config_path = write_configs([record], os.getcwd())[0]
 
     print(f"Output saved to {output_config_path}")
 
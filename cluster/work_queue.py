@@ -0,0 +1,490 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from grid_box.grid_engine import DEFAULT_SOURCES, find_af2bind_csv, grid_boxes
+from grid_box.vina_config import config_record, write_config_table, write_configs
+from protein_preprocessing.ligand_prep import DEFAULT_CACHE
+from protein_preprocessing.pdb_processed import prepare_structure
+from structure.structure_cache import load_structure
+from structure.triage import MAX_ATOMS, routed_files, triage_directory
+
+# Targets of the preparation and grid stages, queued in one SQLite file on the shared file system.
+# - tasks: one row per (stage, target); `key` hashes the stage, the input file content and the
+#   parameters, so a target already done with the same input is never queued again.
+# - workers: one row per worker process with its host and last heartbeat.
+# The file uses the rollback journal (WAL needs shared memory, which NFS does not provide) and
+# every claim is one short BEGIN IMMEDIATE transaction, so the workers of all nodes serialize on it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    stage TEXT NOT NULL,
+    target TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    output_directory TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    started REAL,
+    heartbeat REAL,
+    finished REAL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, task_id);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Task states, in order
+TASK_STATES = ("queued", "running", "done", "failed")
+
+# Seconds between two heartbeats of a worker, and without heartbeat before its targets are re-queued
+HEARTBEAT_SECONDS = 10
+LEASE_SECONDS = 60
+
+# Runs of a target before it is marked failed (a worker that died counts as a run)
+MAX_ATTEMPTS = 3
+
+
+def prepare_stage(pdb_path, output_directory, pH=7.4, cache_directory=DEFAULT_CACHE):
+    """
+    Preparation stage of one target: pocket configs, ligand files and receptor PDBQT,
+    see pdb_processed.prepare_structure. The ligand cache is shared by the nodes.
+
+    Returns:
+    - dict: names of the prepared files.
+    """
+    paths = prepare_structure(pdb_path, output_directory, pH, cache_directory=cache_directory)
+    return {"files": [os.path.basename(path) for path in paths]}
+
+
+def grid_stage(pdb_path, output_directory, sources=DEFAULT_SOURCES, csv_directory=None, size=34, tight=False,
+               margin=4.0, structure_cache=None):
+    """
+    Grid stage of one target: its candidate boxes and their config files, see grid_engine.define_grids.
+
+    Returns:
+    - dict: config records of the boxes.
+    """
+    structure = load_structure(pdb_path, structure_cache)
+    csv_path = find_af2bind_csv(csv_directory or os.path.dirname(pdb_path), structure.name)
+    boxes = grid_boxes(structure, sources, predictions=csv_path, size=size, tight=tight, margin=margin)
+    if not boxes:
+        raise ValueError(f"No grid box found for {structure.name}")
+    records = [config_record(box, target=structure.name) for box in boxes]
+    write_configs(records, output_directory)
+    return {"configs": records}
+
+
+def wait_stage(pdb_path, output_directory, seconds=1.0):
+    """
+    Stage that only waits, to measure the overhead and scaling of the queue (see benchmark_scaling).
+    """
+    time.sleep(seconds)
+    return {"seconds": seconds}
+
+
+# Stages a worker can run: name -> function(input_path, output_directory, **params) returning a JSON result
+STAGES = {"prepare": prepare_stage, "grid": grid_stage, "wait": wait_stage}
+
+
+class WorkQueue:
+    """
+    Targets shared by worker processes on any node through an SQLite file on the shared file system.
+
+    A worker claims queued targets in a transaction and sends a heartbeat while it
+    runs them. Targets whose worker stopped sending heartbeats for LEASE_SECONDS
+    (the node died, the job was killed) are re-queued at the next claim, up to
+    MAX_ATTEMPTS runs. A worker only records the outcome of a target it still
+    owns, so a target re-queued meanwhile is not overwritten by a late worker.
+    """
+
+    def __init__(self, db_path="work_queue.db", lease=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(db_path, timeout=120, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute("PRAGMA busy_timeout=120000")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, statements):
+        # Run the statements as one write transaction, taken before any read
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements()
+            self.connection.execute("COMMIT")
+            return result
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def submit(self, stage, input_paths, output_directory, replace=False, **params):
+        """
+        Queue the targets of a stage, skipping the ones already queued, running or done
+        with the same input file and parameters unless `replace`.
+
+        Args:
+        - stage (str): stage name, see STAGES.
+        - input_paths (list of str): PDB files of the targets, on the shared file system.
+        - output_directory (str): shared directory of the stage outputs.
+        - replace (bool): queue the targets again even if they were done.
+        - params: keyword arguments of the stage function, e.g. pH=7.4.
+
+        Returns:
+        - int: number of these targets waiting in the queue.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage}, expected one of {', '.join(STAGES)}")
+        params_json = json.dumps(params, sort_keys=True)
+        rows = []
+        for input_path in input_paths:
+            with open(input_path, "rb") as input_file:
+                digest = hashlib.sha1(input_file.read()).hexdigest()
+            key = hashlib.sha1(f"{stage}\n{digest}\n{params_json}\n{output_directory}".encode()).hexdigest()
+            target = os.path.splitext(os.path.basename(input_path))[0]
+            rows.append((key, stage, target, os.path.abspath(input_path), os.path.abspath(output_directory),
+                         params_json, time.time()))
+
+        def insert():
+            if replace:
+                self.connection.executemany("DELETE FROM tasks WHERE key = ? AND status != 'running'",
+                                            [row[:1] for row in rows])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tasks (key, stage, target, input_path, output_directory, params, submitted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            # Failed targets are queued again with fresh attempts
+            self.connection.executemany(
+                "UPDATE tasks SET status = 'queued', attempts = 0, worker = NULL, error = NULL "
+                "WHERE key = ? AND status = 'failed'", [row[:1] for row in rows])
+
+        self._transaction(insert)
+        queued = self.connection.execute(
+            f"SELECT COUNT(*) FROM tasks WHERE status = 'queued' AND key IN ({','.join('?' * len(rows))})",
+            [row[0] for row in rows]).fetchone()[0] if rows else 0
+        print(f"{queued}/{len(rows)} target(s) of the {stage} stage waiting in the queue")
+        return queued
+
+    def requeue_stale(self):
+        """
+        Re-queue the running targets without heartbeat for the lease time, or mark them
+        failed after MAX_ATTEMPTS runs. Runs inside claim, can also be called alone.
+
+        Returns:
+        - int: number of targets re-queued or failed.
+        """
+        expired = time.time() - self.lease
+        changed = self.connection.total_changes
+        self.connection.execute(
+            "UPDATE tasks SET status = 'failed', finished = ?, error = 'worker lost: ' || worker "
+            "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?", (time.time(), expired, self.max_attempts))
+        self.connection.execute(
+            "UPDATE tasks SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?", (expired,))
+        return self.connection.total_changes - changed
+
+    def claim(self, worker, n=1):
+        """
+        Take up to n queued targets for a worker, oldest first.
+
+        Returns:
+        - list of dict: task_id, stage, target, input_path, output_directory and params of every claimed target.
+        """
+        def take():
+            self.requeue_stale()
+            now = time.time()
+            rows = self.connection.execute(
+                "SELECT task_id, stage, target, input_path, output_directory, params FROM tasks "
+                "WHERE status = 'queued' ORDER BY task_id LIMIT ?", (n,)).fetchall()
+            self.connection.executemany(
+                "UPDATE tasks SET status = 'running', worker = ?, attempts = attempts + 1, started = ?, heartbeat = ? "
+                "WHERE task_id = ?", [(worker, now, now, row[0]) for row in rows])
+            return rows
+
+        return [{"task_id": task_id, "stage": stage, "target": target, "input_path": input_path,
+                 "output_directory": output_directory, "params": json.loads(params)}
+                for task_id, stage, target, input_path, output_directory, params in self._transaction(take)]
+
+    def register(self, worker):
+        now = time.time()
+        self._transaction(lambda: self.connection.execute(
+            "INSERT OR REPLACE INTO workers (worker, host, pid, started, heartbeat) VALUES (?, ?, ?, ?, ?)",
+            (worker, socket.gethostname(), os.getpid(), now, now)))
+
+    def heartbeat(self, worker, task_ids=()):
+        """
+        Extend the lease of a worker's running targets.
+        """
+        now = time.time()
+
+        def beat():
+            self.connection.execute("UPDATE workers SET heartbeat = ? WHERE worker = ?", (now, worker))
+            self.connection.executemany("UPDATE tasks SET heartbeat = ? WHERE task_id = ? AND worker = ? "
+                                        "AND status = 'running'", [(now, task_id, worker) for task_id in task_ids])
+        self._transaction(beat)
+
+    def finish(self, worker, task_id, result=None, error=None):
+        """
+        Record the result (or the error) of a target, if the worker still owns it.
+
+        Returns:
+        - bool: whether the outcome was recorded.
+        """
+        status = "failed" if error is not None else "done"
+
+        def record():
+            updated = self.connection.execute(
+                "UPDATE tasks SET status = ?, finished = ?, result = ?, error = ? "
+                "WHERE task_id = ? AND worker = ? AND status = 'running'",
+                (status, time.time(), json.dumps(result, default=float) if result is not None else None, error,
+                 task_id, worker)).rowcount
+            self.connection.execute(f"UPDATE workers SET {status} = {status} + ? WHERE worker = ?", (updated, worker))
+            return updated == 1
+        return self._transaction(record)
+
+    def status(self):
+        """
+        Number of targets per stage and state.
+
+        Returns:
+        - pd.DataFrame: one row per stage, one column per state in TASK_STATES.
+        """
+        rows = self.connection.execute("SELECT stage, status, COUNT(*) FROM tasks GROUP BY stage, status").fetchall()
+        table = pd.DataFrame(rows, columns=["stage", "status", "n"])
+        table = table.pivot(index="stage", columns="status", values="n") if len(table) else pd.DataFrame()
+        return table.reindex(columns=list(TASK_STATES)).fillna(0).astype(int)
+
+    def workers(self):
+        """
+        Workers with their host, last heartbeat and number of targets done and failed.
+        """
+        return pd.read_sql_query("SELECT worker, host, pid, heartbeat, done, failed FROM workers ORDER BY started",
+                                 self.connection)
+
+    def results(self, stage):
+        """
+        Results of the done targets of a stage, and the errors of the failed ones.
+
+        Returns:
+        - pd.DataFrame: target, status, worker, attempts, seconds, error and result (parsed JSON).
+        """
+        rows = self.connection.execute(
+            "SELECT target, status, worker, attempts, finished - started, error, result FROM tasks "
+            "WHERE stage = ? AND status IN ('done', 'failed') ORDER BY target", (stage,)).fetchall()
+        table = pd.DataFrame(rows, columns=["target", "status", "worker", "attempts", "seconds", "error", "result"])
+        table["result"] = [json.loads(result) if result else None for result in table["result"]]
+        return table
+
+    def pending(self):
+        """
+        Number of targets queued or running.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('queued', 'running')").fetchone()[0]
+
+
+def _heartbeats(db_path, worker, running, stop, interval):
+    # Own connection, so a long target never delays the heartbeat
+    with WorkQueue(db_path) as queue:
+        while not stop.wait(interval):
+            try:
+                queue.heartbeat(worker, list(running))
+            except Exception as e:
+                print(f"Heartbeat of {worker} failed: {e}")
+
+
+def run_worker(db_path, worker=None, batch=1, heartbeat=HEARTBEAT_SECONDS, lease=LEASE_SECONDS, poll=None,
+               max_tasks=None):
+    """
+    Claim and run targets until the queue is empty, e.g. one worker per core of every node:
+    `python -m cluster.work_queue worker --db /shared/work_queue.db`.
+
+    Args:
+    - db_path (str): queue file on the shared file system.
+    - worker (str, optional): worker name, host:pid:random by default.
+    - batch (int): targets claimed per transaction, more for short stages.
+    - heartbeat (float): seconds between two heartbeats.
+    - lease (float): seconds without heartbeat before the targets of a worker are re-queued.
+    - poll (float, optional): keep waiting for new targets every `poll` seconds instead of exiting.
+    - max_tasks (int, optional): exit after this many targets.
+
+    Returns:
+    - int: number of targets run.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    running, stop = set(), threading.Event()
+    n_tasks = 0
+    with WorkQueue(db_path, lease=lease) as queue:
+        queue.register(worker)
+        beats = threading.Thread(target=_heartbeats, args=(db_path, worker, running, stop, heartbeat), daemon=True)
+        beats.start()
+        try:
+            while max_tasks is None or n_tasks < max_tasks:
+                tasks = queue.claim(worker, batch if max_tasks is None else min(batch, max_tasks - n_tasks))
+                if not tasks:
+                    # Targets still running elsewhere may be re-queued if their worker dies
+                    if poll is None and queue.pending() == 0:
+                        break
+                    time.sleep(poll or heartbeat)
+                    continue
+                # The whole batch is owned from now on: heartbeat the targets still waiting too
+                running.update(task["task_id"] for task in tasks)
+                for task in tasks:
+                    try:
+                        os.makedirs(task["output_directory"], exist_ok=True)
+                        result = STAGES[task["stage"]](task["input_path"], task["output_directory"], **task["params"])
+                        queue.finish(worker, task["task_id"], result=result)
+                    except Exception as e:
+                        print(f"Error processing {task['target']} ({task['stage']}): {e}")
+                        queue.finish(worker, task["task_id"], error=f"{type(e).__name__}: {e}")
+                    running.discard(task["task_id"])
+                    n_tasks += 1
+        finally:
+            stop.set()
+            beats.join()
+    print(f"Worker {worker} ran {n_tasks} target(s)")
+    return n_tasks
+
+
+def run_local(db_path, n_workers=4, **worker_options):
+    """
+    Run n worker processes on this machine until the queue is empty, standing in
+    for the nodes of a cluster.
+
+    Returns:
+    - float: wall time in seconds.
+    """
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=run_worker, args=(db_path,), kwargs=worker_options)
+                 for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return time.perf_counter() - start
+
+
+def write_grid_table(db_path, output_path):
+    """
+    Consolidated config table of the grid stage, one row per box of every done target.
+
+    Returns:
+    - str: output_path
+    """
+    with WorkQueue(db_path) as queue:
+        results = queue.results("grid")
+    records = [record for result in results["result"] if result for record in result["configs"]]
+    return write_config_table(records, output_path)
+
+
+def benchmark_scaling(input_paths, work_directory, n_workers=(1, 2, 4, 8), seconds=0.5):
+    """
+    Wall time of the same batch run by 1..N local worker processes with the "wait"
+    stage, which isolates the queue overhead (claims, heartbeats, results) from the
+    cores of this machine. Linear scaling is n_workers times the rate of one worker.
+
+    Args:
+    - input_paths (list of str): files queued as targets.
+    - work_directory (str): directory of the queue files.
+    - n_workers (tuple): worker counts to compare.
+    - seconds (float): duration of every target.
+
+    Returns:
+    - list of dict: workers, seconds, targets per second and efficiency relative to one worker.
+    """
+    os.makedirs(work_directory, exist_ok=True)
+    results = []
+    for n in n_workers:
+        db_path = os.path.join(work_directory, f"scaling_{n}.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        with WorkQueue(db_path) as queue:
+            queue.submit("wait", input_paths, work_directory, seconds=seconds)
+        wall = run_local(db_path, n, heartbeat=1)
+        rate = len(input_paths) / wall
+        results.append({"workers": n, "seconds": wall, "targets_per_s": rate,
+                        "efficiency": rate / (n * results[0]["targets_per_s"] / results[0]["workers"]) if results else 1.0})
+        print(f"{n} worker(s): {len(input_paths)} targets in {wall:.1f} s, {rate:.2f} targets/s, "
+              f"efficiency {results[-1]['efficiency']:.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the preparation and grid stages on many nodes through a shared queue")
+    parser.add_argument("--db", type=str, default="work_queue.db", help="Queue file on the shared file system")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue the PDB files of a directory")
+    submit.add_argument("stage", choices=sorted(STAGES), help="Stage to run")
+    submit.add_argument("input_path", help="Directory of the PDB files")
+    submit.add_argument("output_directory", help="Shared directory of the outputs")
+    submit.add_argument("--pH", type=float, default=7.4, help="Protonation pH of the prepare stage (default: 7.4)")
+    submit.add_argument("--csv-directory", type=str, default=None, help="af2bind results of the grid stage")
+    submit.add_argument("--replace", action="store_true", help="Queue the targets again even if done")
+    submit.add_argument("--structure-cache", type=str, default=None,
+                        help="Binary structure files of the grid stage, parsed once across runs")
+    submit.add_argument("--max-atoms", type=int, default=MAX_ATOMS, help=f"Skip larger structures (default: {MAX_ATOMS})")
+
+    worker = commands.add_parser("worker", help="Claim and run targets until the queue is empty")
+    worker.add_argument("--batch", type=int, default=1, help="Targets claimed at a time (default: 1)")
+    worker.add_argument("--processes", type=int, default=1, help="Worker processes on this node (default: 1)")
+    worker.add_argument("--poll", type=float, default=None, help="Wait for new targets every POLL seconds")
+
+    commands.add_parser("status", help="Targets per stage and state, and the workers")
+    table = commands.add_parser("table", help="Write the consolidated config table of the grid stage")
+    table.add_argument("output_path", help="CSV file")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        # Only queue the targets the stage can use: holo structures for the preparation, any protein for the grids
+        report = triage_directory(args.input_path, max_atoms=args.max_atoms)
+        input_paths = routed_files(report, args.input_path, ("holo",) if args.stage == "prepare" else ("holo", "apo"))
+        params = {"pH": args.pH} if args.stage == "prepare" else {}
+        if args.stage == "grid" and args.csv_directory:
+            params["csv_directory"] = os.path.abspath(args.csv_directory)
+        if args.stage == "grid" and args.structure_cache:
+            params["structure_cache"] = os.path.abspath(args.structure_cache)
+        with WorkQueue(args.db) as queue:
+            queue.submit(args.stage, input_paths, args.output_directory, replace=args.replace, **params)
+    elif args.command == "worker":
+        if args.processes > 1:
+            run_local(args.db, args.processes, batch=args.batch, poll=args.poll)
+        else:
+            run_worker(args.db, batch=args.batch, poll=args.poll)
+    elif args.command == "status":
+        with WorkQueue(args.db) as queue:
+            print(queue.status().to_string())
+            print(queue.workers().to_string(index=False))
+    elif args.command == "table":
+        print(f"Config table saved to {write_grid_table(args.db, args.output_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import time
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from frontend.jobs import JobQueue, fetch_pdb
+from frontend.view_payload import payload_html, view_payload
+from grid_box.ligand_sites import ligand_grid_boxes
+from structure.pdb_arrays import parse_pdb_arrays
+
+# Seconds between two status polls of the running jobs
+POLL_SECONDS = 2
+
+
+@st.cache_data(show_spinner="Fetching the structure from RCSB...", max_entries=256)
+def fetch_pdb_text(pdb_id):
+    """
+    PDB text of an entry, downloaded once per server (see jobs.fetch_pdb).
+    """
+    with open(fetch_pdb(pdb_id)) as f:
+        return f.read()
+
+
+@st.cache_resource(max_entries=64)
+def parsed_structure(pdb_id):
+    """
+    Parsed arrays of an entry, shared by the sessions (read only).
+    """
+    return parse_pdb_arrays(fetch_pdb_text(pdb_id).encode(), name=pdb_id)
+
+
+@st.cache_data(max_entries=64)
+def view_html(pdb_id, mode="auto", width=800, height=500):
+    """
+    Viewer HTML of an entry, built once per entry and view mode (see view_payload).
+    """
+    return payload_html(view_payload(parsed_structure(pdb_id), mode), width, height)
+
+
+def render_structure(pdb_id, mode="auto", width=800, height=500):
+    """
+    Show an entry in the 3D viewer: whole below view_payload.FULL_ATOM_LIMIT atoms,
+    pocket and CA trace above, unless `mode` forces "full" or "pocket".
+    """
+    components.html(view_html(pdb_id, mode, width, height), width=width, height=height)
+
+
+@st.cache_data(max_entries=256)
+def ligand_table(pdb_id):
+    """
+    One row per ligand instance of an entry with its grid box.
+    """
+    return [{"ligand": box["ligand_id"], "atoms": box["n_atoms"], "size": box["size"],
+             "center": ", ".join(f"{c:.2f}" for c in box["center"])}
+            for box in ligand_grid_boxes(parsed_structure(pdb_id))]
+
+
+@st.cache_resource
+def job_queue():
+    """
+    The background worker pool of the server, shared by all the sessions.
+    """
+    return JobQueue(workers=min(8, os.cpu_count() or 1))
+
+
+def show_jobs(job_ids):
+    """
+    Status of the session's jobs, with a download button for the finished ones.
+
+    Returns:
+    - bool: whether a job is still queued or running.
+    """
+    queue = job_queue()
+    for job_id in job_ids:
+        job = queue.status(job_id)
+        if job["status"] == "done":
+            st.success(f"{job['pdb_id']} prepared in {job['finished'] - job['started']:.0f} s")
+            with open(job["zip_path"], "rb") as f:
+                st.download_button(f"Download {job['pdb_id']} files", f.read(), file_name=f"{job['pdb_id']}_prepared.zip",
+                                   mime="application/zip", key=f"download_{job_id}")
+        elif job["status"] == "failed":
+            st.error(f"{job['pdb_id']} failed: {job['error']}")
+        else:
+            st.info(f"{job['pdb_id']}: {job['status']}" + (f" ({job['step']})" if job["step"] else ""))
+    return queue.active(job_ids)
+
+
+def show_batch(batch_id):
+    """
+    Live table of a batch: status, current step, stage timings and error of every
+    target, and the archive of the batch once no target is left running.
+
+    Returns:
+    - bool: whether a target is still queued or running.
+    """
+    queue = job_queue()
+    table = queue.batch_table(batch_id)
+    finished = int(table["status"].isin(["done", "failed"]).sum())
+    failed = int((table["status"] == "failed").sum())
+    st.progress(finished / max(len(table), 1),
+                text=f"{finished}/{len(table)} targets finished" + (f", {failed} failed" if failed else ""))
+    st.dataframe(table.round(2), use_container_width=True, hide_index=True)
+    zip_path = queue.batch_archive(batch_id)
+    if zip_path:
+        with open(zip_path, "rb") as f:
+            st.download_button("Download receptors, ligands and configs", f.read(), file_name=f"{batch_id}.zip",
+                               mime="application/zip", key=f"download_{batch_id}")
+    return finished < len(table)
+
+
+def poll(active):
+    """
+    Rerun the script after POLL_SECONDS while jobs are running, so their status is refreshed.
+    """
+    if active:
+        time.sleep(POLL_SECONDS)
+        st.rerun()
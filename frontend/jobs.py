@@ -0,0 +1,321 @@
+import csv
+import io
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+from fetch_rcsb.pdb_fetch_structure_ligand import fetch_ligand_name
+from grid_box.vina_config import read_config, write_config_table
+from protein_preprocessing.ligand_prep import DEFAULT_CACHE
+from protein_preprocessing.pdb_processed import prepare_structure
+from structure.triage import classify, scan_pdb
+
+PDB_URL = "https://files.rcsb.org/download/{pdb_id}.pdb"
+
+# Downloaded entries and job outputs, shared by all the sessions of the app
+DOWNLOAD_DIRECTORY = os.path.join(os.getcwd(), "downloads")
+JOB_DIRECTORY = os.path.join(os.getcwd(), "jobs")
+
+# Job states, in order
+JOB_STATES = ("queued", "running", "done", "failed")
+
+# Timed stages of a preparation job, see prepare_entry
+STAGES = ("download", "ligand", "receptor", "archive")
+
+# PDB IDs: a digit and three alphanumerics, e.g. 1sqt
+PDB_ID = re.compile(r"^[0-9][A-Za-z0-9]{3}$")
+
+_download_locks = {}
+_download_locks_guard = threading.Lock()
+
+
+def parse_pdb_ids(text):
+    """
+    PDB IDs of a free-text list: separated by spaces, commas, semicolons or new lines,
+    upper-cased and deduplicated in order.
+
+    Returns:
+    - (list, list): the valid IDs and the rejected tokens.
+    """
+    pdb_ids, rejected = [], []
+    for token in re.split(r"[\s,;]+", text.strip()):
+        if not token:
+            continue
+        if PDB_ID.match(token):
+            pdb_ids.append(token.upper())
+        else:
+            rejected.append(token)
+    return list(dict.fromkeys(pdb_ids)), rejected
+
+
+def parse_manifest(data):
+    """
+    PDB IDs of an uploaded manifest: a CSV with a pdb_id (or pdb, id) column,
+    or a plain list of IDs.
+
+    Args:
+    - data (bytes or str): content of the manifest.
+
+    Returns:
+    - (list, list): the valid IDs and the rejected tokens, see parse_pdb_ids.
+    """
+    text = data.decode(errors="replace") if isinstance(data, bytes) else data
+    rows = list(csv.reader(io.StringIO(text)))
+    header = [cell.strip().lower() for cell in rows[0]] if rows else []
+    for column in ("pdb_id", "pdb", "id"):
+        if column in header:
+            index = header.index(column)
+            return parse_pdb_ids("\n".join(row[index] for row in rows[1:] if len(row) > index))
+    return parse_pdb_ids(text)
+
+
+def fetch_pdb(pdb_id, download_directory=DOWNLOAD_DIRECTORY):
+    """
+    Download a PDB entry from RCSB once and reuse the file afterwards. Concurrent
+    requests for the same entry wait for a single download.
+
+    Args:
+    - pdb_id (str): 4 letter code protein from the RCSB.org website.
+    - download_directory (str): Path to the directory of the downloaded files.
+
+    Returns:
+    - str: path of the PDB file.
+    """
+    pdb_id = pdb_id.strip()[:4].upper()
+    pdb_path = os.path.join(download_directory, f"{pdb_id}.pdb")
+    with _download_locks_guard:
+        lock = _download_locks.setdefault(pdb_id, threading.Lock())
+    with lock:
+        if not os.path.isfile(pdb_path):
+            response = requests.get(PDB_URL.format(pdb_id=pdb_id), timeout=60)
+            if response.status_code != 200:
+                raise ValueError(f"Failed to download PDB file for {pdb_id}")
+            os.makedirs(download_directory, exist_ok=True)
+            tmp_path = f"{pdb_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(response.content)
+            os.replace(tmp_path, pdb_path)
+    return pdb_path
+
+
+def prepare_entry(pdb_id, output_directory, pH=7.4, cache_directory=DEFAULT_CACHE, progress=None):
+    """
+    Prepare one PDB entry for docking without PyMOL: receptor PDBQT, ligand
+    PDBQT/SMILES (when obabel is installed) and one Vina config per ligand pocket.
+
+    Args:
+    - pdb_id (str): 4 letter code protein from the RCSB.org website.
+    - output_directory (str): Path to the directory for saving the prepared files.
+    - pH (float): protonation pH, 7.4 by default.
+    - cache_directory (str): Path to the prepared ligands shared across runs.
+    - progress (callable, optional): called with the name of every step.
+
+    Returns:
+    - list of str: paths of the prepared files.
+    """
+    progress = progress or (lambda step: None)
+    os.makedirs(output_directory, exist_ok=True)
+
+    progress("download")
+    pdb_id = pdb_id.strip()[:4].upper()
+    pdb_path = fetch_pdb(pdb_id)
+
+    # Ligand pockets and files, then the receptor, see pdb_processed.prepare_structure
+    progress("ligand")
+    ligand = fetch_ligand_name(pdb_id)
+    # Fail fast on entries without protein, without the ligand or too large, before the expensive steps
+    route, reason = classify(scan_pdb(pdb_path), ligand)
+    if route != "holo":
+        raise ValueError(f"{pdb_id} skipped: {reason}")
+    prepare_structure(pdb_path, output_directory, pH, resn=ligand, target=pdb_id, cache_directory=cache_directory,
+                      progress=progress)
+    return sorted(os.path.join(output_directory, filename) for filename in os.listdir(output_directory))
+
+
+def zip_directory(directory, zip_path):
+    """
+    Zip the files of a directory, e.g. the outputs of a job for download.
+
+    Returns:
+    - str: zip_path
+    """
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for filename in sorted(os.listdir(directory)):
+            archive.write(os.path.join(directory, filename), arcname=filename)
+    return zip_path
+
+
+class JobQueue:
+    """
+    Local worker pool running the preparation jobs in the background, so the
+    Streamlit script only submits jobs and polls their status.
+
+    The same entry prepared at the same pH is shared between sessions: submitting
+    it again returns the job already queued, running or done. Entries submitted
+    together form a batch with one status table and one archive. The pool uses
+    threads, the heavy steps are numpy and obabel subprocesses.
+    """
+
+    def __init__(self, workers=4, job_directory=JOB_DIRECTORY, cache_directory=DEFAULT_CACHE):
+        self.job_directory = job_directory
+        self.cache_directory = cache_directory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prepare")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.batches = {}
+
+    def submit(self, pdb_id, pH=7.4):
+        """
+        Queue the preparation of an entry.
+
+        Returns:
+        - str: job id.
+        """
+        pdb_id = pdb_id.strip()[:4].upper()
+        with self.lock:
+            for job in self.jobs.values():
+                if job["pdb_id"] == pdb_id and job["pH"] == pH and job["status"] != "failed":
+                    return job["job_id"]
+            job_id = f"{pdb_id}_{uuid.uuid4().hex[:8]}"
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "pdb_id": pdb_id,
+                "pH": pH,
+                "status": "queued",
+                "step": None,
+                "step_started": None,
+                "stages": {},
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "error": None,
+                "output_directory": os.path.join(self.job_directory, job_id),
+                "zip_path": None,
+            }
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def submit_batch(self, pdb_ids, pH=7.4):
+        """
+        Queue the preparation of several entries as one batch.
+
+        Returns:
+        - str: batch id.
+        """
+        job_ids = list(dict.fromkeys(self.submit(pdb_id, pH) for pdb_id in pdb_ids))
+        batch_id = f"batch_{uuid.uuid4().hex[:8]}"
+        with self.lock:
+            self.batches[batch_id] = {"batch_id": batch_id, "job_ids": job_ids, "submitted": time.time(),
+                                      "zip_path": None}
+        return batch_id
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _progress(self, job_id, step):
+        # Close the timing of the current stage and start the next one
+        now = time.time()
+        with self.lock:
+            job = self.jobs[job_id]
+            if job["step"] is not None:
+                job["stages"][job["step"]] = now - job["step_started"]
+            job["step"], job["step_started"] = step, now
+
+    def _run(self, job_id):
+        job = self.status(job_id)
+        self._update(job_id, status="running", started=time.time())
+        try:
+            prepare_entry(job["pdb_id"], job["output_directory"], job["pH"], self.cache_directory,
+                          progress=lambda step: self._progress(job_id, step))
+            self._progress(job_id, "archive")
+            zip_path = zip_directory(job["output_directory"], os.path.join(self.job_directory, f"{job_id}.zip"))
+            self._progress(job_id, None)
+            self._update(job_id, status="done", finished=time.time(), zip_path=zip_path)
+        except Exception as e:
+            self._progress(job_id, None)
+            self._update(job_id, status="failed", finished=time.time(), error=str(e))
+
+    def status(self, job_id):
+        """
+        Copy of a job record: status (see JOB_STATES), current step, stage timings, times,
+        error and zip_path.
+        """
+        with self.lock:
+            job = dict(self.jobs[job_id])
+            job["stages"] = dict(job["stages"])
+            return job
+
+    def active(self, job_ids):
+        """
+        Whether any of the jobs is still queued or running.
+        """
+        return any(self.status(job_id)["status"] in ("queued", "running") for job_id in job_ids)
+
+    def batch_table(self, batch_id):
+        """
+        Progress of a batch: one row per target with its status, current step,
+        stage timings in seconds and error.
+
+        Returns:
+        - pd.DataFrame: columns pdb_id, status, step, STAGES..., total and error.
+        """
+        with self.lock:
+            job_ids = list(self.batches[batch_id]["job_ids"])
+        rows = []
+        for job_id in job_ids:
+            job = self.status(job_id)
+            row = {"pdb_id": job["pdb_id"], "status": job["status"], "step": job["step"]}
+            row.update({stage: job["stages"].get(stage) for stage in STAGES})
+            row["total"] = (job["finished"] or time.time()) - job["started"] if job["started"] else None
+            row["error"] = job["error"]
+            rows.append(row)
+        return pd.DataFrame(rows, columns=["pdb_id", "status", "step"] + list(STAGES) + ["total", "error"])
+
+    def batch_archive(self, batch_id):
+        """
+        Zip the outputs of the finished targets of a batch, one folder per target,
+        with the status table (status.csv) and every grid box in one table (configs.csv).
+        The archive is built once, when no target is left running.
+
+        Returns:
+        - str: path of the archive, None while targets are still running.
+        """
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch["zip_path"]:
+                return batch["zip_path"]
+            job_ids = list(batch["job_ids"])
+        if self.active(job_ids):
+            return None
+
+        zip_path = os.path.join(self.job_directory, f"{batch_id}.zip")
+        records = []
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for job_id in job_ids:
+                job = self.status(job_id)
+                if job["status"] != "done":
+                    continue
+                for filename in sorted(os.listdir(job["output_directory"])):
+                    path = os.path.join(job["output_directory"], filename)
+                    archive.write(path, arcname=f"{job['pdb_id']}/{filename}")
+                    if filename.endswith("_config.txt"):
+                        # {pdb_id}_config.txt or {pdb_id}_{box_id}_config.txt, see vina_config.config_filename
+                        record = read_config(path)
+                        record["target"] = job["pdb_id"]
+                        record["box_id"] = filename[len(job["pdb_id"]) + 1:-len("_config.txt")] or None
+                        records.append(record)
+            archive.writestr("status.csv", self.batch_table(batch_id).to_csv(index=False))
+            if records:
+                table_path = write_config_table(records, os.path.join(self.job_directory, f"{batch_id}_configs.csv"))
+                archive.write(table_path, arcname="configs.csv")
+        with self.lock:
+            batch["zip_path"] = zip_path
+        return zip_path
@@ -1,80 +1,64 @@
 # This is app is inspired by Chanin Nantasenamat (Data Professor) https://youtube.com/dataprofessor
 
 
+import os
+import sys
+
 import streamlit as st
-from stmol import showmol
-import py3Dmol
-import requests
-import biotite.structure.io as bsio
+
+# `streamlit run frontend/protein_preparation_frontend.py` only puts frontend/ on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frontend.cached import job_queue, ligand_table, poll, render_structure, show_batch, show_jobs
+from frontend.jobs import parse_manifest, parse_pdb_ids
 
 #st.set_page_config(layout = 'wide')
 st.sidebar.title('Protein Preparation for virtual scrreening')
 st.sidebar.write('The code of this page is shown in [*Github*](https://github.com/NichaNichanok) in "pdb_fetch_app.py.')
 
 
-# stmol
-def render_mol(pdb):
-    pdbview = py3Dmol.view()
-    pdbview.addModel(pdb, 'pdb')
-    
-    # Set style for protein atoms (displayed as surface with gray color)
-    pdbview.setStyle({'chain': 'A'}, {'cartoon': {'color': 'green'}})
-
-    # Set style for water molecules (displayed as a cross)
-    pdbview.setStyle({'resn': ['HOH', 'WAT']}, {'cross': {}})
-    
-    # Set style for HETATM atoms (displayed in stick style)
-    pdbview.setStyle({'hetflag': True}, {'stick': {'colorscheme':'yellowCarbon'}})
-
-    # Set style for atoms within 5 angstrom of ligand UH7 (displayed in stick style)
-    pdbview.addStyle({'within': {'distance': '5', 'sel': {'organic': True}}}, {'stick': {}})
-    
-    # Set surface for other atoms (except ligands) with VDW representation
-    pdbview.addSurface(py3Dmol.VDW, {'opacity': 0.85, 'color': 'white'}, \
-                       {'not': {'hetflag': True}})
-    
-    pdbview.setBackgroundColor('white')
-    pdbview.zoomTo()
-    pdbview.zoom(0.8)  # Adjust zoom level as needed
-    pdbview.spin(True, speed=0.025,)
-    showmol(pdbview, height=500, width=800)
-
-
-# Protein sequence input
-DEFAULT_SEQ = "1sqt"
-txt = st.sidebar.text_area('Input PDB-ID: with ONLY a lignad', DEFAULT_SEQ, height=275)
-
-
-def get_pdb(pdb_id):
-    pdb_url = f"https://files.rcsb.org/download/{pdb_id}.pdb"
-    response = requests.get(pdb_url)
-    if response.status_code == 200:
-        pdb_filename = f"{pdb_id}.pdb"
-        with open(pdb_filename, 'wb') as f:
-            f.write(response.content)
-        return pdb_filename
-    else:
-        raise ValueError(f"Failed to download PDB file for {pdb_id}")
+# 3D view: the whole structure, or the pocket and a CA trace for large entries (see view_payload.py)
+def render_mol(pdb_id, mode="auto"):
+    render_structure(pdb_id, mode, width=800, height=500)
 
 
-# PDB-fetching
-def update(sequence=txt):
-    pdb_id = sequence[:4]
-    pdb_filename = get_pdb(pdb_id)
+# Protein sequence input: one or more PDB-IDs, or an uploaded manifest for a campaign
+DEFAULT_SEQ = "1sqt"
+txt = st.sidebar.text_area('Input PDB-ID(s): with ONLY a lignad, one per line or comma-separated', DEFAULT_SEQ, height=275)
+manifest = st.sidebar.file_uploader('or a manifest (.txt, or .csv with a pdb_id column)', type=["txt", "csv"])
+pH = st.sidebar.number_input('Protonation pH', value=7.4, min_value=0.0, max_value=14.0, step=0.1)
+view_mode = st.sidebar.radio('3D view', ["auto", "pocket", "full"], horizontal=True,
+                             help="auto shows the pocket and a CA trace only for large structures")
 
-    with open(pdb_filename, 'r') as f:
-        pdb_string = f.read()
+pdb_ids, rejected = parse_manifest(manifest.getvalue()) if manifest is not None else parse_pdb_ids(txt)
+if rejected:
+    st.sidebar.warning(f"Not PDB-IDs, skipped: {', '.join(rejected[:20])}")
+st.sidebar.write(f"{len(pdb_ids)} target(s)")
 
 
+# PDB-fetching, cached: a rerun or another session does not download or parse the entry again
+def update(pdb_id):
     # Display protein structure
     st.subheader(f'Visualization of the {pdb_id} protein structure')
-    render_mol(pdb_string)
-
-
+    render_mol(pdb_id, view_mode)
+    st.dataframe(ligand_table(pdb_id), use_container_width=True)
 
-predict = st.sidebar.button("Let's have a look!", on_click=update)
 
+if st.sidebar.button("Let's have a look!") and pdb_ids:
+    st.session_state["shown"] = pdb_ids[0]
+if st.sidebar.button("Let's get the protein prepare") and pdb_ids:
+    # One batch in the background worker pool, the page only polls its status
+    st.session_state.setdefault("batch_ids", []).append(job_queue().submit_batch(pdb_ids, pH))
 
-if not predict:
+if "shown" in st.session_state:
+    update(st.session_state["shown"])
+elif not st.session_state.get("batch_ids"):
     st.warning('👈 Enter proten PDB-ID!')
 
+active = False
+if st.session_state.get("job_ids"):
+    st.subheader('Preparation jobs')
+    active |= show_jobs(st.session_state["job_ids"])
+for number, batch_id in enumerate(st.session_state.get("batch_ids", []), start=1):
+    st.subheader(f'Preparation batch {number}')
+    active |= show_batch(batch_id)
+poll(active)
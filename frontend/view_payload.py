@@ -0,0 +1,160 @@
+import base64
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+
+from structure.filters import organic_mask, protein_mask, water_mask
+from structure.pdb_arrays import format_pdb, read_pdb_arrays
+from structure.spatial_index import spatial_index
+
+# Structures up to this size are sent whole in the "auto" mode, larger ones as pocket + CA trace
+FULL_ATOM_LIMIT = 5000
+
+# Protein residues within this distance of a ligand are sent with all their atoms
+POCKET_RADIUS = 8.0
+
+# Styles of the former render_mol, applied in the browser as (selection, style, add) steps
+FULL_STYLES = [
+    ({"chain": "A"}, {"cartoon": {"color": "green"}}, False),
+    ({"resn": ["HOH", "WAT"]}, {"cross": {}}, False),
+    ({"hetflag": True}, {"stick": {"colorscheme": "yellowCarbon"}}, False),
+    ({"within": {"distance": "5", "sel": {"organic": True}}}, {"stick": {}}, True),
+]
+POCKET_STYLES = [
+    ({}, {"cartoon": {"color": "green", "style": "trace"}}, False),
+    ({"hetflag": True}, {"stick": {"colorscheme": "yellowCarbon"}}, False),
+    ({"within": {"distance": "5", "sel": {"organic": True}}}, {"stick": {}}, True),
+]
+
+VIEWER_HTML = """<div id="viewer" style="width: __WIDTH__px; height: __HEIGHT__px; position: relative;"></div>
+<script src="https://3Dmol.org/build/3Dmol-min.js"></script>
+<script>
+(async () => {
+  const payload = __PAYLOAD__;
+  // The model is sent gzipped and inflated by the browser
+  const bytes = Uint8Array.from(atob(payload.model), c => c.charCodeAt(0));
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+  const pdb = await new Response(stream).text();
+  const viewer = $3Dmol.createViewer("viewer", {backgroundColor: "white"});
+  viewer.addModel(pdb, "pdb");
+  for (const [selection, style, add] of payload.styles) {
+    add ? viewer.addStyle(selection, style) : viewer.setStyle(selection, style);
+  }
+  if (payload.surface) {
+    viewer.addSurface($3Dmol.SurfaceType.VDW, {opacity: 0.85, color: "white"}, payload.surface);
+  }
+  viewer.zoomTo(payload.zoom);
+  viewer.zoom(0.8);
+  viewer.render();
+  if (payload.spin) viewer.spin(true, 0.025);
+})();
+</script>
+"""
+
+
+def view_payload(structure, mode="auto", radius=POCKET_RADIUS):
+    """
+    Atoms and styles sent to the 3D viewer for a structure.
+
+    - "full": every atom, with the styles, surface and spin of the former render_mol;
+    - "pocket": the ligands, the protein residues within `radius` of them and the CA
+      trace of the rest, with the surface of the pocket residues only and no spin;
+    - "auto": "full" up to FULL_ATOM_LIMIT atoms, "pocket" above.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - mode (str): "full", "pocket" or "auto".
+    - radius (float): pocket radius in Angstrom.
+
+    Returns:
+    - dict: mode, model (PDB text), n_atoms, styles, surface and zoom selections, spin.
+    """
+    if mode == "auto":
+        mode = "full" if len(structure) <= FULL_ATOM_LIMIT else "pocket"
+    if mode == "full":
+        return {"mode": mode, "model": format_pdb(structure, renumber=False), "n_atoms": len(structure),
+                "styles": FULL_STYLES, "surface": {"not": {"hetflag": True}}, "zoom": {}, "spin": True}
+    if mode != "pocket":
+        raise ValueError(f"Unknown view mode {mode}, expected full, pocket or auto")
+
+    protein = protein_mask(structure)
+    ligands = organic_mask(structure) & ~water_mask(structure)
+    keep = ligands | (protein & (structure.atom_name == "CA"))
+    pocket = np.zeros(len(structure), dtype=bool)
+    if ligands.any():
+        index = spatial_index(structure)
+        residues = index.residues_within(structure.coords[ligands], radius, mask=protein)
+        pocket[index.residue_atoms(residues)] = True
+        pocket &= protein
+        keep |= pocket
+
+    # Pocket residues are the only ones sent with side chains, they carry the surface
+    view = structure.subset(keep)
+    pocket_keys = sorted({f"{chain}:{resi}" for chain, resi in zip(structure.chain[pocket], structure.resi[pocket])})
+    surface = None
+    if pocket_keys:
+        surface = {"or": [{"resi": int(resi), "hetflag": False, **({"chain": chain} if chain else {})}
+                          for chain, resi in (key.split(":") for key in pocket_keys)]}
+    return {"mode": mode, "model": format_pdb(view, renumber=False), "n_atoms": len(view),
+            "styles": POCKET_STYLES, "surface": surface,
+            "zoom": {"hetflag": True} if ligands.any() else {}, "spin": False}
+
+
+def payload_html(payload, width=800, height=500):
+    """
+    Standalone 3Dmol.js viewer of a payload, with the model gzipped and base64-encoded.
+
+    Returns:
+    - str: HTML to embed, e.g. with streamlit.components.v1.html.
+    """
+    data = {key: value for key, value in payload.items() if key not in ("model", "mode", "n_atoms")}
+    data["model"] = base64.b64encode(gzip.compress(payload["model"].encode(), compresslevel=6)).decode()
+    return (VIEWER_HTML.replace("__WIDTH__", str(width)).replace("__HEIGHT__", str(height))
+            .replace("__PAYLOAD__", json.dumps(data)))
+
+
+def benchmark_payloads(pdb_paths, modes=("full", "pocket")):
+    """
+    Size of the viewer payload and time to prepare it for every structure and mode.
+    The atoms sent (and the atoms under the surface) drive the time to first render
+    in the browser, which cannot be measured server side.
+
+    Args:
+    - pdb_paths (list of str): PDB files, large entries or assemblies in particular.
+    - modes (tuple): view modes to compare.
+
+    Returns:
+    - list of dict: one row per structure and mode with n_atoms, pdb_bytes, html_bytes and prepare_ms.
+    """
+    results = []
+    for pdb_path in pdb_paths:
+        structure = read_pdb_arrays(pdb_path)
+        with open(pdb_path, "rb") as pdb_file:
+            original_bytes = len(pdb_file.read())
+        for mode in modes:
+            start = time.perf_counter()
+            payload = view_payload(structure, mode)
+            html = payload_html(payload)
+            prepare_ms = (time.perf_counter() - start) * 1e3
+            results.append({
+                "target": structure.name,
+                "mode": mode,
+                "atoms": len(structure),
+                "n_atoms": payload["n_atoms"],
+                "original_bytes": original_bytes,
+                "pdb_bytes": len(payload["model"]),
+                "html_bytes": len(html),
+                "prepare_ms": prepare_ms,
+            })
+            print(f"{structure.name} {mode}: {payload['n_atoms']}/{len(structure)} atoms, "
+                  f"{original_bytes / 1e3:.0f} kB file -> {len(html) / 1e3:.0f} kB sent, prepared in {prepare_ms:.0f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    benchmark_payloads([os.path.join(input_path, filename) for filename in sorted(os.listdir(input_path))
+                        if filename.endswith(".pdb")])
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from structure.pdb_arrays import read_pdb_arrays
+
+# Smallest box edge accepted by the docking programs for a drug-like ligand
+MIN_BOX_SIZE = 10.0
+
+
+def heuristic_size(diameter):
+    """
+    Cubic grid size used by crystal_processing: round(16 + 0.8 * diameter).
+    """
+    return round(16 + 0.8 * round(diameter))
+
+
+def _principal_axes(coords):
+    # Rows are the principal axes of the point cloud, largest variance first
+    centered = coords - coords.mean(axis=0)
+    _, _, axes = np.linalg.svd(centered, full_matrices=False)
+    if np.linalg.det(axes) < 0:
+        axes[2] *= -1
+    return axes
+
+
+def fit_box(pocket_coords, ligand_coords=None, margin=4.0, oriented=False):
+    """
+    Fit a tight, anisotropic grid box around the pocket atoms.
+
+    Each edge covers the extent of the pocket atoms plus `margin` on both sides.
+    When the ligand is known, every edge is also at least the ligand diameter
+    plus `margin`, so the ligand can still rotate freely inside the box.
+
+    Args:
+    - pocket_coords (np.ndarray): (N, 3) coordinates of the pocket atoms,
+                                  e.g. binding residues or the crystal ligand.
+    - ligand_coords (np.ndarray, optional): (M, 3) coordinates of the ligand.
+    - margin (float): padding in Angstrom, 4 A by default.
+    - oriented (bool): fit the box along the principal axes of the pocket
+                       instead of the x/y/z axes. Vina only supports axis-aligned boxes.
+
+    Returns:
+    - dict: center (x, y, z), size (size_x, size_y, size_z), axes (3x3 rotation,
+            rows are the box axes) and volume in A^3.
+    """
+    pocket_coords = np.asarray(pocket_coords, dtype=float)
+    axes = _principal_axes(pocket_coords) if oriented else np.eye(3)
+
+    # Extents of the pocket in the box frame
+    projected = pocket_coords @ axes.T
+    low, high = projected.min(axis=0), projected.max(axis=0)
+    size = (high - low) + 2 * margin
+
+    if ligand_coords is not None and len(ligand_coords) > 1:
+        ligand_coords = np.asarray(ligand_coords, dtype=float)
+        diameter = np.max(np.linalg.norm(ligand_coords[:, None] - ligand_coords, axis=-1))
+        size = np.maximum(size, diameter + margin)
+
+    size = np.maximum(size, MIN_BOX_SIZE)
+    center = ((low + high) / 2) @ axes
+
+    return {
+        "center": tuple(float(c) for c in center),
+        "size": tuple(float(s) for s in size),
+        "axes": axes,
+        "volume": float(np.prod(size)),
+    }
+
+
+def box_volume_report(input_path, margin=4.0):
+    """
+    Compare the fitted boxes with the fixed 16 + 0.8 * diameter heuristic for every
+    ligand of every PDB file in a directory. The docking cost scales with the box
+    volume, so the volume ratio is the expected docking speed-up.
+
+    Args:
+    - input_path (str): Path to the directory containing holo PDB files.
+    - margin (float): padding of the fitted boxes in Angstrom, 4 A by default.
+
+    Returns:
+    - pd.DataFrame: one row per ligand pocket with both box sizes and volumes.
+    """
+    # ligand_sites imports fit_box, so import it here to avoid a circular import
+    from grid_box.ligand_sites import ligand_grid_boxes
+
+    rows = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = read_pdb_arrays(os.path.join(input_path, filename))
+                for box in ligand_grid_boxes(structure, tight=True, margin=margin):
+                    heuristic = heuristic_size(box["diameter"])
+                    rows.append({
+                        "target": structure.name,
+                        "ligand_id": box["ligand_id"],
+                        "heuristic_size": heuristic,
+                        "size_x": box["size"][0],
+                        "size_y": box["size"][1],
+                        "size_z": box["size"][2],
+                        "heuristic_volume": float(heuristic ** 3),
+                        "fitted_volume": float(np.prod(box["size"])),
+                    })
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+
+    report = pd.DataFrame(rows)
+    if len(report):
+        report["volume_reduction"] = 1 - report["fitted_volume"] / report["heuristic_volume"]
+        total = 1 - report["fitted_volume"].sum() / report["heuristic_volume"].sum()
+        print(f"Total box volume reduced by {100 * total:.1f}% over {len(report)} pockets")
+    return report
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    print(box_volume_report(input_path).to_string(index=False))
@@ -0,0 +1,251 @@
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from grid_box.box_fit import fit_box
+from grid_box.ligand_sites import ligand_grid_boxes
+from grid_box.site_clusters import cluster_predictions
+from grid_box.vina_config import config_record, write_configs
+from structure.filters import protein_mask
+from structure.geometry import geometry
+from structure.structure_cache import load_structure
+from structure.selection import select
+
+# Site sources of a grid box:
+# - {"type": "ligand", "resn": None}: one box per crystal ligand instance
+# - {"type": "pbind", "pbind": 0.8}: af2bind residues with p(bind) above the threshold
+# - {"type": "top_n", "top_n": 15}: the af2bind residues with the highest p(bind)
+# - {"type": "clusters", "pbind": 0.5, "linkage": 8.0, "min_residues": 3, "max_sites": None}:
+#   one box per spatial cluster of af2bind residues, ranked by summed p(bind) (see site_clusters)
+# - {"type": "residues", "residues": [112, ("A", 137)]}: explicit residues, by resi or (chain, resi)
+# - {"type": "selection", "selection": "resi 112 + resi 137"}: any PyMOL selection string
+SOURCE_TYPES = ("ligand", "pbind", "top_n", "clusters", "residues", "selection")
+
+# Default sources of define_grids: the crystal ligand and both af2bind cut-offs
+DEFAULT_SOURCES = ({"type": "ligand"}, {"type": "pbind", "pbind": 0.8}, {"type": "top_n", "top_n": 15})
+
+# File names of the af2bind results of a target, as written by af2bind_cl.py and the notebooks
+AF2BIND_CSV_NAMES = ("results_{target}.csv", "af2bind_{target}_results.csv")
+
+
+def read_af2bind_csv(csv_path):
+    """
+    Read the per-residue af2bind predictions (columns chain, resi, resn, p(bind)).
+
+    Returns:
+    - pd.DataFrame: predictions sorted by decreasing p(bind).
+    """
+    predictions = pd.read_csv(csv_path, index_col=0)
+    predictions["chain"] = predictions["chain"].fillna("").astype(str)
+    return predictions.sort_values("p(bind)", ascending=False, kind="stable", ignore_index=True)
+
+
+def find_af2bind_csv(csv_directory, target):
+    """
+    Path of the af2bind results of a target in csv_directory, or None.
+    """
+    for pattern in AF2BIND_CSV_NAMES:
+        csv_path = os.path.join(csv_directory, pattern.format(target=target))
+        if os.path.isfile(csv_path):
+            return csv_path
+    return None
+
+
+def residue_mask(structure, residues):
+    """
+    Protein atoms of the given residues. Residues are resi numbers, matched in every
+    chain, or (chain, resi) keys, so residue numbers repeated in several chains or
+    used by waters and ligands do not leak into the selection.
+
+    Args:
+    - structure (Structure): parsed atoms, see structure.pdb_arrays.
+    - residues (list): resi numbers and/or (chain, resi) tuples.
+
+    Returns:
+    - np.ndarray: boolean mask of the selected atoms.
+    """
+    plain = [resi for resi in residues if not isinstance(resi, tuple)]
+    keyed = [f"{chain}:{resi}" for chain, resi in (key for key in residues if isinstance(key, tuple))]
+    mask = np.isin(structure.resi, np.asarray(plain, dtype=int))
+    if keyed:
+        keys = np.char.add(np.char.add(structure.chain, ":"), structure.resi.astype(str))
+        mask |= np.isin(keys, keyed)
+    return mask & protein_mask(structure)
+
+
+def _prediction_residues(predictions):
+    # af2bind rows to residue keys, chain-aware when the chain is known
+    return [(chain, int(resi)) if chain else int(resi) for chain, resi in zip(predictions["chain"], predictions["resi"])]
+
+
+def _residue_box(structure, mask, box_id, source, size, tight, margin):
+    # Grid box centered on the center of mass of the selected atoms
+    if not mask.any():
+        return None
+    if tight:
+        box = fit_box(structure.coords[mask], margin=margin)
+        center, box_size = box["center"], box["size"]
+    else:
+        center, box_size = tuple(float(c) for c in geometry(structure).center_of_mass(mask)), size
+    residues = np.unique(np.char.add(np.char.add(structure.chain[mask], ":"), structure.resi[mask].astype(str)))
+    return {
+        "box_id": box_id,
+        "source": source,
+        "center": center,
+        "size": box_size,
+        "n_atoms": int(np.count_nonzero(mask)),
+        "residues": list(residues),
+    }
+
+
+def grid_boxes(structure, sources=DEFAULT_SOURCES, predictions=None, size=34, tight=False, margin=4.0):
+    """
+    Candidate grid boxes of one parsed structure for every site source.
+
+    All the sources share the parsed structure, its selection masks and its
+    geometry cache, and the af2bind predictions are read once for the
+    threshold, top-N and cluster sources.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - sources (list of dict): site sources, see SOURCE_TYPES.
+    - predictions (pd.DataFrame or str, optional): af2bind results or the path of their CSV,
+                                                    required by the "pbind", "top_n" and "clusters" sources.
+    - size (float): edge of the residue boxes in Angstrom, 34 by default.
+    - tight (bool): fit anisotropic boxes with box_fit.fit_box instead.
+    - margin (float): padding of the tight boxes in Angstrom.
+
+    Returns:
+    - list of dict: boxes with box_id, source, center, size, n_atoms and residues.
+    """
+    if isinstance(predictions, str):
+        predictions = read_af2bind_csv(predictions)
+    elif predictions is not None:
+        predictions = predictions.sort_values("p(bind)", ascending=False, kind="stable", ignore_index=True)
+    boxes = []
+    for source in sources:
+        kind = source["type"]
+        if kind not in SOURCE_TYPES:
+            raise ValueError(f"Unknown site source {kind}, expected one of {SOURCE_TYPES}")
+        if kind == "ligand":
+            for box in ligand_grid_boxes(structure, resn=source.get("resn"), tight=tight, margin=margin):
+                boxes.append({"box_id": box["ligand_id"], "source": "ligand", "center": box["center"],
+                              "size": box["size"], "n_atoms": box["n_atoms"], "residues": [box["resn"]]})
+            continue
+        if kind in ("pbind", "top_n", "clusters") and predictions is None:
+            print(f"No af2bind predictions for {structure.name}, {kind} source skipped.")
+            continue
+        if kind == "clusters":
+            sites = cluster_predictions(structure, predictions, source.get("pbind", 0.5), source.get("linkage", 8.0),
+                                        source.get("min_residues", 3))
+            for site in sites[:source.get("max_sites")]:
+                box = _residue_box(structure, residue_mask(structure, site["keys"]), f"site{site['site']}", kind,
+                                   size, tight, margin)
+                if box is not None:
+                    box["score"] = site["score"]
+                    boxes.append(box)
+            continue
+        if kind in ("pbind", "top_n"):
+            if kind == "pbind":
+                picked = predictions[predictions["p(bind)"] > source.get("pbind", 0.8)]
+                box_id = f"pbind{source.get('pbind', 0.8)}"
+            else:
+                picked = predictions.head(source.get("top_n", 15))
+                box_id = f"top{source.get('top_n', 15)}"
+            mask = residue_mask(structure, _prediction_residues(picked))
+        elif kind == "residues":
+            mask, box_id = residue_mask(structure, source["residues"]), source.get("box_id", "residues")
+        else:
+            mask, box_id = np.array(select(structure, source["selection"])), source.get("box_id", "selection")
+        box = _residue_box(structure, mask, box_id, kind, size, tight, margin)
+        if box is None:
+            print(f"The {box_id} source selects no atom of {structure.name}, skipped.")
+            continue
+        boxes.append(box)
+    return boxes
+
+
+def _bounds(box):
+    # Lower and upper corners of an axis-aligned box
+    center = np.asarray(box["center"], dtype=float)
+    half = np.broadcast_to(np.asarray(box["size"], dtype=float), (3,)) / 2
+    return center - half, center + half
+
+
+def box_agreement(boxes):
+    """
+    Pairwise agreement of candidate boxes: distance between the centers, overlap
+    volume and overlap over union (1 for identical boxes, 0 for disjoint ones).
+
+    Returns:
+    - pd.DataFrame: one row per pair of boxes.
+    """
+    rows = []
+    for box_a, box_b in itertools.combinations(boxes, 2):
+        low_a, high_a = _bounds(box_a)
+        low_b, high_b = _bounds(box_b)
+        overlap = float(np.prod(np.clip(np.minimum(high_a, high_b) - np.maximum(low_a, low_b), 0, None)))
+        volume_a, volume_b = float(np.prod(high_a - low_a)), float(np.prod(high_b - low_b))
+        rows.append({
+            "box_a": box_a["box_id"],
+            "box_b": box_b["box_id"],
+            "center_distance": float(np.linalg.norm(np.subtract(box_a["center"], box_b["center"]))),
+            "overlap_volume": overlap,
+            "overlap_fraction": overlap / (volume_a + volume_b - overlap),
+        })
+    return pd.DataFrame(rows, columns=["box_a", "box_b", "center_distance", "overlap_volume", "overlap_fraction"])
+
+
+def define_grids(input_path, output_directory=None, sources=DEFAULT_SOURCES, csv_directory=None, size=34,
+                 tight=False, margin=4.0, structure_cache=None):
+    """
+    Compute the candidate grid boxes of every PDB file in a directory from one parse
+    per target, write their config files and report how well the sources agree.
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - output_directory (str, optional): Path to the directory for saving the config files,
+                                        None only reports the boxes.
+    - sources (list of dict): site sources, see SOURCE_TYPES.
+    - csv_directory (str, optional): directory of the af2bind results (`results_{target}.csv`
+                                     or `af2bind_{target}_results.csv`), input_path by default.
+    - size (float): edge of the residue boxes in Angstrom, 34 by default.
+    - tight (bool): fit anisotropic boxes instead.
+    - margin (float): padding of the tight boxes in Angstrom.
+    - structure_cache (str, optional): directory of the binary structure files, see structure_cache.load_structure.
+
+    Returns:
+    - (dict, pd.DataFrame): {target: boxes} and the agreement of every pair of boxes per target.
+    """
+    csv_directory = csv_directory or input_path
+    all_boxes, reports = {}, []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = load_structure(os.path.join(input_path, filename), structure_cache)
+                csv_path = find_af2bind_csv(csv_directory, structure.name)
+                boxes = grid_boxes(structure, sources, predictions=csv_path, size=size, tight=tight, margin=margin)
+                if not boxes:
+                    print(f"No grid box found for {filename}, skipped.")
+                    continue
+                all_boxes[structure.name] = boxes
+                report = box_agreement(boxes)
+                report.insert(0, "target", structure.name)
+                reports.append(report)
+                if output_directory:
+                    records = [config_record(box, target=structure.name) for box in boxes]
+                    write_configs(records, output_directory)
+                print(f"Processed {filename}: {len(boxes)} box(es) from {', '.join(box['box_id'] for box in boxes)}")
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+    report = pd.concat(reports, ignore_index=True) if reports else box_agreement([])
+    return all_boxes, report
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    _, report = define_grids(input_path, sources=[{"type": "ligand"}, {"type": "selection", "box_id": "pocket",
+                                                                      "selection": "byres (polymer.protein within 5 of organic)"}])
+    print(report.to_string(index=False))
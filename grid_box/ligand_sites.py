@@ -0,0 +1,239 @@
+import os
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from grid_box.box_fit import fit_box, heuristic_size
+from grid_box.vina_config import config_record, write_configs
+from structure.bonds import perceive_bonds
+from structure.filters import organic_mask
+from structure.pdb_arrays import atom_masses, covalent_radii, read_pdb_arrays, residue_index
+from structure.spatial_index import pocket_residues
+
+
+def perceive_ligands(structure, bond_tolerance=0.45, resn=None, min_atoms=2):
+    """
+    Group the organic HETATM atoms of a structure into connected ligand instances.
+
+    Bonds are perceived in one pass over the coordinates: two atoms are bonded
+    when their distance is below the sum of their covalent radii plus
+    `bond_tolerance`. Atoms of the same residue are always kept together, and
+    covalently linked residues (e.g. glycans) end up in one instance.
+    Only the atoms of the "organic" selection of PyMOL are candidates (see
+    structure.filters.organic_mask): waters, ions, residues without carbon (e.g. SO4)
+    and modified residues of the chain (e.g. MSE written as HETATM) are skipped.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - bond_tolerance (float): tolerance added to the covalent radii sum, 0.45 A by default.
+    - resn (str or list, optional): only keep instances containing these residue names,
+                                    e.g. the ligand name from fetch_ligand_name.
+    - min_atoms (int): smallest instance kept, 2 atoms by default.
+
+    Returns:
+    - list of np.ndarray: atom indices (into the structure) of each ligand instance.
+    """
+    candidates = np.flatnonzero(organic_mask(structure))
+    if len(candidates) == 0:
+        return []
+
+    coords = structure.coords[candidates]
+    radii = covalent_radii(structure)[candidates]
+    n = len(candidates)
+
+    # Bond-distance graph over the candidate atoms
+    pairs = perceive_bonds(coords, radii, bond_tolerance)
+
+    # Chain consecutive atoms of the same residue, so a residue never splits apart
+    residues = residue_index(structure)[candidates]
+    same_residue = np.flatnonzero(residues[1:] == residues[:-1])
+    residue_pairs = np.stack([same_residue, same_residue + 1], axis=1)
+
+    edges = np.concatenate([pairs.reshape(-1, 2), residue_pairs])
+    graph = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    n_components, labels = connected_components(graph, directed=False)
+
+    # Sort atoms by component once, then slice out every instance
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(n_components + 1))
+    wanted = None if resn is None else set([resn] if isinstance(resn, str) else resn)
+
+    ligands = []
+    for k in range(n_components):
+        members = candidates[order[bounds[k]:bounds[k + 1]]]
+        if len(members) < min_atoms:
+            continue
+        if wanted is not None and not wanted.intersection(structure.resn[members]):
+            continue
+        ligands.append(members)
+
+    # Keep the file order of the ligands
+    ligands.sort(key=lambda members: members[0])
+    return ligands
+
+
+def ligand_id(structure, members):
+    """
+    Identifier of a ligand instance built from its residues, e.g. "107_A501"
+    or "NAG_A601-NAG_A602" for covalently linked residues.
+    """
+    keys = []
+    for i in members:
+        key = f"{structure.resn[i]}_{structure.chain[i]}{structure.resi[i]}{structure.icode[i]}"
+        if key not in keys:
+            keys.append(key)
+    return "-".join(keys)
+
+
+def ligand_grid_boxes(structure, resn=None, bond_tolerance=0.45, tight=False, margin=4.0):
+    """
+    Compute one grid box per ligand instance of a holo structure.
+
+    The grid coordinate is the center of mass of the ligand instance and the
+    grid size follows the ligand diameter: size = round(16 + 0.8 * diameter).
+    With `tight=True` the box is fitted to the ligand instead (see box_fit.fit_box):
+    the size becomes (size_x, size_y, size_z) and the center is the box center.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - resn (str or list, optional): restrict to instances of these residue names.
+    - bond_tolerance (float): tolerance for the bond perception, 0.45 A by default.
+    - tight (bool): fit an anisotropic box to the ligand, False by default.
+    - margin (float): padding of the tight box in Angstrom, 4 A by default.
+
+    Returns:
+    - list of dict: one box per ligand with the keys ligand_id, resn, n_atoms,
+                    center (x, y, z), diameter and size.
+    """
+    masses = atom_masses(structure)
+    boxes = []
+    for members in perceive_ligands(structure, bond_tolerance=bond_tolerance, resn=resn):
+        coords = structure.coords[members]
+        center = np.average(coords, axis=0, weights=masses[members])
+        diameter = float(np.max(np.linalg.norm(coords[:, None] - coords, axis=-1)))
+        size = heuristic_size(diameter)
+        if tight:
+            box = fit_box(coords, ligand_coords=coords, margin=margin)
+            center, size = box["center"], box["size"]
+        boxes.append({
+            "ligand_id": ligand_id(structure, members),
+            "resn": "-".join(dict.fromkeys(structure.resn[members])),
+            "n_atoms": len(members),
+            "center": tuple(float(c) for c in center),
+            "diameter": diameter,
+            "size": size,
+        })
+    return boxes
+
+
+def pocket_ligand_file(target, ligand_ids, ligand_id, extension="pdbqt"):
+    """
+    Name of the prepared ligand of a pocket, named like its config file (see vina_config.config_filename):
+    `{target}_ligand.pdbqt` for a single ligand instance, `{target}_{ligand_id}_ligand.pdbqt` for several.
+
+    Args:
+    - target (str): target name, usually the PDB-ID.
+    - ligand_ids (list of str): ligand instances of the target.
+    - ligand_id (str): instance of the pocket.
+    - extension (str): "pdbqt" or "smi".
+    """
+    if len(ligand_ids) > 1:
+        return f"{target}_{ligand_id}_ligand.{extension}"
+    return f"{target}_ligand.{extension}"
+
+
+def write_pocket_configs(boxes, output_directory, target, receptor=None, ligand="ligand.pdbqt",
+                         ligand_per_pocket=False):
+    """
+    Write one Vina config file per ligand pocket.
+
+    A single pocket keeps the `{target}_config.txt` name, several pockets are
+    written as `{target}_{ligand_id}_config.txt`.
+
+    Args:
+    - boxes (list of dict): grid boxes from ligand_grid_boxes.
+    - output_directory (str): Path to the directory for saving the config files.
+    - target (str): target name, usually the PDB-ID.
+    - receptor (str, optional): receptor file name, `{target}.pdbqt` by default.
+    - ligand (str): ligand file name written in the config.
+    - ligand_per_pocket (bool): write the ligand of each pocket instead, see pocket_ligand_file
+                                (the files written by ligand_prep.prepare_ligands).
+
+    Returns:
+    - list of str: paths of the written config files.
+    """
+    ligand_ids = [box["ligand_id"] for box in boxes]
+    records = [config_record(box, target=target, receptor=receptor,
+                             ligand=pocket_ligand_file(target, ligand_ids, box["ligand_id"]) if ligand_per_pocket else ligand)
+               for box in boxes]
+    return write_configs(records, output_directory)
+
+
+def define_grid_byligands(input_path, output_directory, resn=None):
+    """
+    Process experimental holo-PDB files in the input directory:
+    - identify every ligand instance and its center of mass in a single parse
+    - save one config file per ligand pocket in the output directory.
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - output_directory (str): Path to the directory for saving the config files.
+    - resn (str or list, optional): restrict to ligands with these residue names.
+
+    Returns:
+    - dict: {target: list of grid boxes}
+    """
+    all_boxes = {}
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = read_pdb_arrays(os.path.join(input_path, filename))
+                boxes = ligand_grid_boxes(structure, resn=resn)
+                if not boxes:
+                    print(f"No ligand found in {filename}, skipped.")
+                    continue
+                config_paths = write_pocket_configs(boxes, output_directory, structure.name)
+                all_boxes[structure.name] = boxes
+                for box in boxes:
+                    print(f"The grid coordinates of '{structure.name}' by ligand {box['ligand_id']}:", box["center"])
+                print(f"Processed {filename}. {len(config_paths)} config file(s) saved to {output_directory}")
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+    return all_boxes
+
+
+def pocket_residues_batch(input_path, radius=5.0):
+    """
+    Extract the pocket-lining residues of every ligand of every PDB file in a directory,
+    with one parse and one spatial index per structure.
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - radius (float): distance cutoff in Angstrom, 5 A by default.
+
+    Returns:
+    - dict: {target: {ligand_id: list of residue keys}}
+    """
+    pockets = {}
+    start = time.perf_counter()
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = read_pdb_arrays(os.path.join(input_path, filename))
+                pockets[structure.name] = {
+                    ligand_id(structure, members): pocket_residues(structure, members, radius)
+                    for members in perceive_ligands(structure)
+                }
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+    elapsed = time.perf_counter() - start
+    print(f"Pocket residues of {len(pockets)} structures extracted in {elapsed:.3f} s")
+    return pockets
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    output_directory = os.path.join(os.getcwd(), "output_files")
+    define_grid_byligands(input_path, output_directory)
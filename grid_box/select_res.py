@@ -1,13 +1,28 @@
 import pymol 
 import os
 import __main__
+from grid_box.grid_engine import read_af2bind_csv
+from grid_box.vina_config import config_record, write_configs
+from structure.selection import residue_selection
 
 
-def define_grid_bybindingres(input_path, csv_path, output_directory, pbind=0.8):
+def binding_selection(csv_path, pbind=0.8):
+    """
+    Chain-aware PyMOL selection of the af2bind residues with p(bind) > pbind, restricted
+    to the protein so that waters or ligands sharing a residue number are left out,
+    e.g. "polymer.protein and ((chain A and resi 112+137) or (chain B and resi 40))".
+    """
+    predictions = read_af2bind_csv(csv_path)
+    picked = predictions[predictions["p(bind)"] > pbind]
+    residues = [(chain, int(resi)) if chain else int(resi) for chain, resi in zip(picked["chain"], picked["resi"])]
+    return f"polymer.protein and ({residue_selection(residues)})"
+
+
+def define_grid_bybindingres(input_path, csv_path, output_directory, pbind=0.8, size=34):
     """
     Define the grid from the predicted binding site:
     - Select the binding residues (as binding_res) based on the pbind value by default 0.8
-    - Calculate the center of mass of the binding_res for further use as grid coordinate (config.txt)
+    - Calculate the center of mass of the binding_res for further use as grid coordinate ({pdb_id}_config.txt)
     - Save config file with the coordinate in the output directory.
     
     Args:
@@ -15,6 +30,7 @@ def define_grid_bybindingres(input_path, csv_path, output_directory, pbind=0.8):
     - csv_path (str): Path to the predicted binding site by af2bind in CSV format.
     - output_directory (str): Path to the directory for saving modified PDB files.
     - pbind (foat): pbind value cutoff
+    - size (float): grid box edge in Angstrom, 34 by default
     """
     __main__.pymol_argv = ['pymol', '-qc']  # Quiet and no GUI
     pymol.finish_launching()
@@ -22,41 +38,27 @@ def define_grid_bybindingres(input_path, csv_path, output_directory, pbind=0.8):
     # Load protein structure
     pymol.cmd.load(input_path, 'protein')
 
-    # Initialize list to store binding residues
-    binding_res = set()
-
-    # Read CSV file and extract residues with p(bind) > 0.8
-    with open(csv_path, 'r') as f:
-        next(f)  # Skip header
-        for line in f:
-            data = line.strip().split(',')
-            resi = int(data[2])  # Convert to integer
-            p_bind = float(data[4])  
-            if p_bind > pbind:
-                binding_res.add(resi)  # Add residue to binding_res set
+    # Select the residues with p(bind) > pbind, keyed by chain and residue number
+    binding_res = binding_selection(csv_path, pbind)
 
     # Select all binding residues
-    pymol.cmd.select('binding_res', 'resi ' + '+'.join(map(str, binding_res)))
+    pymol.cmd.select('binding_res', binding_res)
     #pymol.cmd.show('sphere', 'binding_res')
     #pymol.cmd.show('sticks', 'binding_res')  # Show sticks for binding residues
     #pymol.cmd.color('red', 'binding_res')
 
     # Compute the overall center of mass
-    binding_res_coords = pymol.cmd.centerofmass('resi ' + '+'.join(map(str, binding_res)))
+    binding_res_coords = pymol.cmd.centerofmass(binding_res)
 
 
+    protein_name= input_path.split("/")[-1].split(".")[0]
+
     # Print the overall center of mass
     print(f"The grid coordinates of '{protein_name}' protein by selected binding residues with the pbind > {pbind}:", binding_res_coords)
 
-    protein_name= input_path.split("/")[-1].split(".")[0]
-
-    # Save the coordinates of the binding residues' center of mass to a text file
-    output_config_path = os.path.join(output_directory, "config.txt")
-    with open(output_config_path, "w") as config_file:
-        config_file.write(f"The grid coordinates of '{protein_name}' protein by selected binding residues with the pbind > {pbind}:\n")
-        config_file.write("X: {:.3f}\n".format(binding_res_coords[0]))
-        config_file.write("Y: {:.3f}\n".format(binding_res_coords[1]))
-        config_file.write("Z: {:.3f}\n".format(binding_res_coords[2]))
+    # Save the coordinates of the binding residues' center of mass as a Vina config file
+    record = config_record({"center": binding_res_coords, "size": size}, target=protein_name)
+    output_config_path = write_configs([record], output_directory)[0]
 
     print(f"Output saved to {output_config_path}")
 
@@ -78,27 +80,17 @@ def visualize_binding_residues(input_path, csv_path, pbind=0.8):
     pymol.cmd.util.cba('orange', 'LBM')
 
 
-    # Initialize list to store binding residues
-    binding_res = set()
-
-    # Read CSV file and extract residues with p(bind) > 0.8
-    with open(csv_path, 'r') as f:
-        next(f)  # Skip header
-        for line in f:
-            data = line.strip().split(',')
-            resi = int(data[2])  # Convert to integer
-            p_bind = float(data[4])  
-            if p_bind > pbind:
-                binding_res.add(resi)  # Add residue to binding_res set
+    # Select the residues with p(bind) > pbind, keyed by chain and residue number
+    binding_res = binding_selection(csv_path, pbind)
 
     # Select all binding residues
-    pymol.cmd.select(f'binding_res{pbind}', 'resi ' + '+'.join(map(str, binding_res)))
+    pymol.cmd.select(f'binding_res{pbind}', binding_res)
     pymol.cmd.show('sphere', f'binding_res{pbind}')
     pymol.cmd.show('sticks', f'binding_res{pbind}')  # Show sticks for binding residues
     pymol.cmd.color('red', f'binding_res{pbind}')
 
     # Compute the overall center of mass
-    binding_res_coords = pymol.cmd.centerofmass('resi ' + '+'.join(map(str, binding_res)))
+    binding_res_coords = pymol.cmd.centerofmass(binding_res)
 
     # Print the overall center of mass
     print("Overall center of mass of binding residues:", binding_res_coords)
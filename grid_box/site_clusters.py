@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from structure.filters import protein_mask
+from structure.pdb_arrays import read_pdb_arrays, residue_index
+
+# Indices of CA and CB in the atom37 layout of AlphaFold (all_atom_positions of af_model._pdb["batch"])
+ATOM37_CA = 1
+ATOM37_CB = 3
+
+
+def af2bind_anchor_coords(batch):
+    """
+    One anchor per residue from the AlphaFold input features of af_model._pdb["batch"]:
+    the CB coordinates, or CA for glycine and residues without CB.
+
+    Returns:
+    - np.ndarray: (L, 3) anchor coordinates.
+    """
+    positions = np.asarray(batch["all_atom_positions"])
+    has_cb = np.asarray(batch["all_atom_mask"])[:, ATOM37_CB] > 0
+    return np.where(has_cb[:, None], positions[:, ATOM37_CB], positions[:, ATOM37_CA])
+
+
+def residue_anchor_coords(structure, chains, resis):
+    """
+    Anchor coordinates (CB, or CA for glycine) of protein residues of a parsed structure.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - chains (array-like): chain of every residue, "" to match any chain.
+    - resis (array-like): residue number of every residue.
+
+    Returns:
+    - np.ndarray: (R, 3) anchor coordinates, NaN for residues missing from the structure.
+    """
+    protein = protein_mask(structure)
+    anchors = np.full((len(resis), 3), np.nan)
+    for atom_name in ("CA", "CB"):
+        atoms = np.flatnonzero(protein & (structure.atom_name == atom_name))
+        # First atom of every residue (alternate locations keep the first one)
+        atoms = atoms[np.unique(residue_index(structure)[atoms], return_index=True)[1]]
+        lookup = {(str(structure.chain[i]), int(structure.resi[i])): i for i in atoms}
+        lookup.update({("", int(structure.resi[i])): i for i in atoms[::-1]})
+        for k, key in enumerate(zip(chains, resis)):
+            i = lookup.get((str(key[0]), int(key[1])))
+            if i is not None:
+                anchors[k] = structure.coords[i]
+    return anchors
+
+
+def cluster_sites(coords, p_bind, pbind=0.5, linkage=8.0, min_residues=3):
+    """
+    Group the residues above a p(bind) threshold into spatial sites by single-linkage
+    clustering: residues whose anchors are closer than `linkage` are joined, using a
+    KD-tree for the neighbor pairs and connected components for the clusters.
+
+    Args:
+    - coords (np.ndarray): (L, 3) residue anchors (CB or CA), NaN rows are ignored.
+    - p_bind (np.ndarray): (L,) af2bind binding probabilities.
+    - pbind (float): probability threshold, 0.5 by default.
+    - linkage (float): single-linkage distance in Angstrom, 8 A by default.
+    - min_residues (int): smallest site kept, 3 residues by default.
+
+    Returns:
+    - list of dict: sites ranked by summed probability, with the keys site (rank from 1),
+                    residues (indices into coords), score (summed p(bind)), max_pbind and n_residues.
+    """
+    coords = np.asarray(coords, dtype=float)
+    p_bind = np.asarray(p_bind, dtype=float)
+    candidates = np.flatnonzero((p_bind > pbind) & ~np.isnan(coords).any(axis=1))
+    if len(candidates) == 0:
+        return []
+
+    pairs = cKDTree(coords[candidates]).query_pairs(linkage, output_type="ndarray")
+    n = len(candidates)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    n_components, labels = connected_components(graph, directed=False)
+
+    # Rank the clusters by summed probability in one bincount pass
+    scores = np.bincount(labels, p_bind[candidates], n_components)
+    sizes = np.bincount(labels, minlength=n_components)
+    sites = []
+    for component in np.argsort(-scores, kind="stable"):
+        if sizes[component] < min_residues:
+            continue
+        members = candidates[labels == component]
+        members = members[np.argsort(-p_bind[members], kind="stable")]
+        sites.append({
+            "site": len(sites) + 1,
+            "residues": members,
+            "score": float(scores[component]),
+            "max_pbind": float(p_bind[members].max()),
+            "n_residues": int(sizes[component]),
+        })
+    return sites
+
+
+def cluster_predictions(structure, predictions, pbind=0.5, linkage=8.0, min_residues=3):
+    """
+    Cluster the af2bind predictions of a structure into candidate sites.
+
+    Args:
+    - structure (Structure): parsed target structure.
+    - predictions (pd.DataFrame): af2bind results with the columns chain, resi and p(bind).
+    - pbind, linkage, min_residues: see cluster_sites.
+
+    Returns:
+    - list of dict: sites of cluster_sites, with a `keys` list of (chain, resi) per site.
+    """
+    chains = predictions["chain"].fillna("").astype(str).to_numpy()
+    resis = predictions["resi"].to_numpy(dtype=int)
+    anchors = residue_anchor_coords(structure, chains, resis)
+    sites = cluster_sites(anchors, predictions["p(bind)"].to_numpy(), pbind, linkage, min_residues)
+    for site in sites:
+        site["keys"] = [(chains[i], int(resis[i])) if chains[i] else int(resis[i]) for i in site["residues"]]
+    return sites
+
+
+def site_table(sites):
+    """
+    One row per site: rank, score, maximum p(bind), size and residue list.
+    """
+    return pd.DataFrame([
+        {"site": site["site"], "score": site["score"], "max_pbind": site["max_pbind"],
+         "n_residues": site["n_residues"],
+         "residues": " ".join(f"{key[0]}{key[1]}" if isinstance(key, tuple) else str(key) for key in site["keys"])}
+        for site in sites
+    ], columns=["site", "score", "max_pbind", "n_residues", "residues"])
+
+
+if __name__ == "__main__":
+    # Pseudo-predictions on 1fvv: the residues around both copies of the ligand 107 bind
+    structure = read_pdb_arrays(os.path.join(os.getcwd(), "input_pdb_files", "1fvv.pdb"))
+    ca = protein_mask(structure) & (structure.atom_name == "CA") & (structure.altloc != "B")
+    ligand = structure.coords[structure.resn == "107"]
+    distance = np.min(np.linalg.norm(structure.coords[ca][:, None] - ligand, axis=-1), axis=1)
+    predictions = pd.DataFrame({"chain": structure.chain[ca], "resi": structure.resi[ca],
+                                "resn": structure.resn[ca], "p(bind)": 1 / (1 + np.exp(distance - 6))})
+    sites = cluster_predictions(structure, predictions)
+    print(site_table(sites).to_string(index=False))
+    top = predictions.sort_values("p(bind)", ascending=False).head(15)
+    print("Chains of the global top 15:", dict(top["chain"].value_counts()))
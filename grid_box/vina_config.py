@@ -0,0 +1,269 @@
+import csv
+import io
+import math
+import os
+
+import numpy as np
+
+# Docking config schema: field -> (type, required). Vina, smina and qvina share this format.
+CONFIG_SCHEMA = {
+    "receptor": (str, True),
+    "ligand": (str, False),
+    "center_x": (float, True),
+    "center_y": (float, True),
+    "center_z": (float, True),
+    "size_x": (float, True),
+    "size_y": (float, True),
+    "size_z": (float, True),
+    "exhaustiveness": (int, False),
+    "num_modes": (int, False),
+    "energy_range": (float, False),
+    "seed": (int, False),
+    "cpu": (int, False),
+    "out": (str, False),
+}
+
+# Columns of the consolidated table: the target and box identifiers, then the schema
+TABLE_COLUMNS = ["target", "box_id"] + list(CONFIG_SCHEMA)
+
+# Atom types written in the AutoGrid parameter file for AutoDock-GPU
+RECEPTOR_TYPES = ["A", "C", "HD", "N", "NA", "OA", "S", "SA"]
+LIGAND_TYPES = ["A", "C", "HD", "N", "NA", "OA", "SA", "F", "Cl", "Br", "I", "P", "S"]
+
+
+def config_record(box, target=None, receptor=None, ligand=None, **options):
+    """
+    Flatten a grid box into a config record following CONFIG_SCHEMA.
+
+    Args:
+    - box (dict): grid box with center (x, y, z) and size (edge or (size_x, size_y, size_z)),
+                  e.g. from ligand_grid_boxes or fit_box. A box_id/ligand_id key is kept.
+    - target (str, optional): target name, taken from box["target"] if missing.
+    - receptor (str, optional): receptor file, `{target}.pdbqt` by default.
+    - ligand (str, optional): ligand file.
+    - options: other schema fields, e.g. exhaustiveness=16.
+
+    Returns:
+    - dict: validated config record.
+    """
+    target = target or box.get("target")
+    size_x, size_y, size_z = np.broadcast_to(np.asarray(box["size"], dtype=float), (3,))
+    record = {
+        "target": target,
+        "box_id": box.get("box_id") or box.get("ligand_id"),
+        "receptor": receptor or box.get("receptor") or f"{target}.pdbqt",
+        "ligand": ligand or box.get("ligand"),
+        "center_x": box["center"][0],
+        "center_y": box["center"][1],
+        "center_z": box["center"][2],
+        "size_x": size_x,
+        "size_y": size_y,
+        "size_z": size_z,
+    }
+    record.update(options)
+    return validate_config(record)
+
+
+def validate_config(record):
+    """
+    Check a config record against CONFIG_SCHEMA and coerce its values to the schema types.
+
+    Raises:
+    - ValueError: missing required field, unknown field, wrong type, non-finite
+                  coordinate or non-positive box size.
+    """
+    unknown = set(record) - set(CONFIG_SCHEMA) - {"target", "box_id"}
+    if unknown:
+        raise ValueError(f"Unknown config fields: {sorted(unknown)}")
+
+    validated = {"target": record.get("target"), "box_id": record.get("box_id")}
+    for key, (value_type, required) in CONFIG_SCHEMA.items():
+        value = record.get(key)
+        if value is None or value == "":
+            if required:
+                raise ValueError(f"Missing required config field '{key}' for target {record.get('target')}")
+            continue
+        try:
+            value = value_type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Config field '{key}' must be {value_type.__name__}, got {value!r}")
+        if value_type is float and not math.isfinite(value):
+            raise ValueError(f"Config field '{key}' is not finite for target {record.get('target')}")
+        if key.startswith("size_") and value <= 0:
+            raise ValueError(f"Config field '{key}' must be positive, got {value}")
+        validated[key] = value
+    return validated
+
+
+def format_config(record, flavor="vina", spacing=0.375):
+    """
+    Render a validated config record as the text of one docking config file.
+
+    Args:
+    - record (dict): config record from config_record.
+    - flavor (str): "vina" (also read by smina and qvina) or "gpf" for an AutoGrid
+                    parameter file, whose maps are the input of AutoDock-GPU.
+    - spacing (float): grid spacing of the gpf flavor, 0.375 A by default.
+
+    Returns:
+    - str: content of the config file.
+    """
+    if flavor in ("vina", "smina"):
+        # The box identifiers are comments for the docking programs, read back by read_config
+        lines = [f"# {key} = {record[key]}" for key in ("target", "box_id") if record.get(key)]
+        for key in CONFIG_SCHEMA:
+            if key not in record:
+                continue
+            if key == "size_x":
+                lines.append("")
+            value = record[key]
+            lines.append(f"{key} = {value:.3f}" if isinstance(value, float) else f"{key} = {value}")
+        return "\n".join(lines) + "\n"
+
+    if flavor == "gpf":
+        stem = os.path.splitext(record["receptor"])[0]
+        # AutoGrid counts grid intervals, which must be even
+        npts = [2 * math.ceil(record[f"size_{axis}"] / spacing / 2) for axis in "xyz"]
+        lines = [
+            "npts {} {} {}".format(*npts),
+            f"gridfld {stem}.maps.fld",
+            f"spacing {spacing}",
+            "receptor_types " + " ".join(RECEPTOR_TYPES),
+            "ligand_types " + " ".join(LIGAND_TYPES),
+            f"receptor {record['receptor']}",
+            "gridcenter {:.3f} {:.3f} {:.3f}".format(record["center_x"], record["center_y"], record["center_z"]),
+            "smooth 0.5",
+        ]
+        lines += [f"map {stem}.{atom_type}.map" for atom_type in LIGAND_TYPES]
+        lines += [f"elecmap {stem}.e.map", f"dsolvmap {stem}.d.map", "dielectric -0.1465"]
+        return "\n".join(lines) + "\n"
+
+    raise ValueError(f"Unknown config flavor: {flavor}")
+
+
+def config_filename(record, multiple_boxes, flavor="vina"):
+    """
+    `{target}_config.txt`, or `{target}_{box_id}_config.txt` when a target has several boxes.
+    """
+    if not record.get("target"):
+        raise ValueError("A config record needs a target to be written to a file")
+    extension = "gpf" if flavor == "gpf" else "txt"
+    if multiple_boxes and record.get("box_id"):
+        return f"{record['target']}_{record['box_id']}_config.{extension}"
+    return f"{record['target']}_config.{extension}"
+
+
+def write_configs(records, output_directory, flavor="vina"):
+    """
+    Write one docking config file per box.
+
+    The records are validated and rendered in memory first, so an invalid box
+    aborts the batch before anything is written, and the names never collide
+    between targets.
+
+    Args:
+    - records (list of dict): config records from config_record.
+    - output_directory (str): Path to the directory for saving the config files.
+    - flavor (str): "vina"/"smina" or "gpf", see format_config.
+
+    Returns:
+    - list of str: paths of the written config files.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    records = [validate_config(record) for record in records]
+    boxes_per_target = {}
+    for record in records:
+        boxes_per_target[record["target"]] = boxes_per_target.get(record["target"], 0) + 1
+
+    rendered = {}
+    for record in records:
+        filename = config_filename(record, boxes_per_target[record["target"]] > 1, flavor)
+        if filename in rendered:
+            raise ValueError(f"Two boxes would be written to {filename}, give them a box_id")
+        rendered[filename] = format_config(record, flavor)
+
+    config_paths = []
+    for filename, text in rendered.items():
+        output_config_path = os.path.join(output_directory, filename)
+        with open(output_config_path, "w") as config_file:
+            config_file.write(text)
+        config_paths.append(output_config_path)
+    return config_paths
+
+
+def write_config_table(records, output_path):
+    """
+    Write all boxes of a batch into one consolidated CSV table (one row per box,
+    columns TABLE_COLUMNS) in a single buffered write.
+
+    Args:
+    - records (list of dict): config records from config_record.
+    - output_path (str): Path of the CSV file.
+
+    Returns:
+    - str: output_path
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=TABLE_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for record in records:
+        record = validate_config(record)
+        writer.writerow({key: round(value, 3) if isinstance(value, float) else value for key, value in record.items()})
+    with open(output_path, "w") as table_file:
+        table_file.write(buffer.getvalue())
+    return output_path
+
+
+def read_config(config_path):
+    """
+    Read a `key = value` docking config file back into a validated config record.
+
+    The target and box_id are read from the comment lines written by format_config.
+    For files without them they come from the file name (see config_filename): the
+    receptor name `{target}.pdbqt` splits `{target}_{box_id}_config.txt`, otherwise
+    the whole part before "_config" is taken as the target.
+    """
+    record, identifiers = {}, {}
+    with open(config_path) as config_file:
+        for line in config_file:
+            line, _, comment = (part.strip() for part in line.partition("#"))
+            if "=" in line:
+                key, value = (part.strip() for part in line.split("=", 1))
+                record[key] = value
+            elif "=" in comment:
+                key, value = (part.strip() for part in comment.split("=", 1))
+                if key in ("target", "box_id"):
+                    identifiers[key] = value
+
+    if "target" not in identifiers:
+        stem = os.path.basename(config_path).split("_config")[0]
+        target = os.path.splitext(os.path.basename(record.get("receptor", "")))[0]
+        if target and stem.startswith(f"{target}_"):
+            identifiers = {"target": target, "box_id": stem[len(target) + 1:]}
+        else:
+            identifiers = {"target": stem}
+    record.update(identifiers)
+    return validate_config(record)
+
+
+def read_config_table(table_path):
+    """
+    Read a consolidated config table back into a list of validated config records.
+    """
+    with open(table_path, newline="") as table_file:
+        return [validate_config(row) for row in csv.DictReader(table_file)]
+
+
+if __name__ == "__main__":
+    from grid_box.ligand_sites import ligand_grid_boxes
+    from structure.pdb_arrays import read_pdb_arrays
+
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    output_directory = os.path.join(os.getcwd(), "output_files")
+    records = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            structure = read_pdb_arrays(os.path.join(input_path, filename))
+            records += [config_record(box, target=structure.name) for box in ligand_grid_boxes(structure)]
+    table_path = write_config_table(records, os.path.join(output_directory, "configs.csv"))
+    print(f"{len(records)} boxes saved to {table_path}")
@@ -4,7 +4,7 @@
 import pandas as pd
 import biopandas
 from biopandas.pdb import PandasPdb
-from prody import parsePDBHeader
+from structure.pdb_header import read_pdb_header
 from typing import Optional
 
 def read_pdb_to_dataframe(pdb_path: Optional[str] = None,model_index: int = 1,parse_header: bool = True, ) -> pd.DataFrame:
@@ -15,16 +15,18 @@ def read_pdb_to_dataframe(pdb_path: Optional[str] = None,model_index: int = 1,pa
         pdb_path (str, optional): Path to a local PDB file to read. Defaults to None.
         model_index (int, optional): Index of the model to extract from the PDB file, in case
             it contains multiple models. Defaults to 1.
-        parse_header (bool, optional): Whether to parse the PDB header and extract metadata.
+        parse_header (bool, optional): Whether to read the PDB header records and extract metadata
+            (see structure/pdb_header.py, the header is read without a second parse of the atoms).
             Defaults to True.
 
     Returns:
         pd.DataFrame: A DataFrame containing the atomic coordinates and metadata, with one row
             per atom
+        PDBHeader: header fields of the entry, None if parse_header is False
     """
     atomic_df = PandasPdb().read_pdb(pdb_path)
     if parse_header:
-        header = parsePDBHeader(pdb_path)
+        header = read_pdb_header(pdb_path)
     else:
         header = None
     atomic_df = atomic_df.get_model(model_index)
@@ -1,9 +1,11 @@
 import os
 
+from protein_preprocessing.protonation import protonate_pdb
+
 # this code requires the OpenBabel installation
 
 
-def add_hcharges(input_directory, output_directory, pH=7.4):
+def add_hcharges(input_directory, output_directory, pH=7.4, native=False):
     """
     Process PDB files in the input directory, 
     protonate them at pH 7.4, and save them to PDB format.
@@ -12,6 +14,8 @@ def add_hcharges(input_directory, output_directory, pH=7.4):
     - input_directory (str): Path to the directory containing PDB files.
     - output_directory (str): Path to the directory for saving modified PDB files.
     - pH (float): pH value for protonation (default is 7.4).
+    - native (bool): protonate standard residues from templates (protonation.py),
+                     obabel is then only used for the non-standard residues.
     """
     # Create the output directory if it doesn't exist
     os.makedirs(output_directory, exist_ok=True)
@@ -27,8 +31,11 @@ def add_hcharges(input_directory, output_directory, pH=7.4):
                 # Protonated PDB file path
                 protonated_pdb = os.path.join(output_directory, f"{os.path.splitext(filename)[0]}_protonated.pdb")
 
-                # Run the command to protonate at pH 7.4, save in pdbq
-                os.system(f"obabel {input_pdb} -opdb -h -p {pH} -O {protonated_pdb}")
+                # Protonate at pH 7.4, save in pdb
+                if native:
+                    protonate_pdb(input_pdb, protonated_pdb, pH)
+                else:
+                    os.system(f"obabel {input_pdb} -opdb -h -p {pH} -O {protonated_pdb}")
 
                 print(f"Processed {filename}. Protonated file saved to {protonated_pdb}.")
             except Exception as e:
@@ -0,0 +1,380 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from protein_preprocessing.pdbqt_writer import read_pdbqt, write_pdbqt
+from structure.bonds import bond_graph, neighbor_counts
+from structure.pdb_arrays import read_pdb_arrays, residue_index
+
+# Aromatic ring carbons of the standard residues (AutoDock type "A")
+AROMATIC_CARBONS = {
+    "PHE": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"],
+    "TYR": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"],
+    "TRP": ["CG", "CD1", "CD2", "CE2", "CE3", "CZ2", "CZ3", "CH2"],
+    "HIS": ["CG", "CD2", "CE1"],
+}
+
+# sp2 heavy atoms of the standard residues, besides the backbone C, O and N
+SP2_ATOMS = {
+    "ASP": ["CG", "OD1", "OD2"],
+    "GLU": ["CD", "OE1", "OE2"],
+    "ASN": ["CG", "OD1", "ND2"],
+    "GLN": ["CD", "OE1", "NE2"],
+    "ARG": ["NE", "CZ", "NH1", "NH2"],
+    "HIS": ["ND1", "NE2"],
+    "TRP": ["NE1"],
+}
+for _resn, _names in AROMATIC_CARBONS.items():
+    SP2_ATOMS[_resn] = SP2_ATOMS.get(_resn, []) + _names
+BACKBONE_SP2 = ["C", "O", "OXT"]
+
+# Aromatic rings of the standard residues. As Open Babel perceives them on a protonated structure,
+# a ring with an sp3 atom (4 neighbors, e.g. an extra hydrogen) is not aromatic, and a five-membered
+# ring is only aromatic when one of its nitrogens carries a hydrogen (pyrrole-like)
+AROMATIC_RINGS = [
+    {"PHE": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"]},
+    {"TYR": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"]},
+    {"TRP": ["CD2", "CE2", "CE3", "CZ2", "CZ3", "CH2"]},
+    {"HIS": ["CG", "ND1", "CD2", "CE1", "NE2"], "TRP": ["CG", "CD1", "NE1", "CE2", "CD2"]},
+]
+
+# Gasteiger-Marsili PEOE parameters (a, b, c) by element and hybridization
+GASTEIGER_PARAMETERS = {
+    ("H", 0): (7.17, 6.24, -0.56),
+    ("C", 3): (7.98, 9.18, 1.88),
+    ("C", 2): (8.79, 9.32, 1.51),
+    ("C", 1): (10.39, 9.45, 0.73),
+    ("N", 3): (11.54, 10.82, 1.36),
+    ("N", 2): (12.87, 11.15, 0.85),
+    ("N", 1): (15.68, 11.70, -0.27),
+    ("O", 3): (14.18, 12.92, 1.39),
+    ("O", 2): (17.07, 13.79, 0.47),
+    ("F", 3): (14.66, 13.85, 2.31),
+    ("CL", 3): (11.00, 9.69, 1.35),
+    ("BR", 3): (10.08, 8.47, 1.16),
+    ("I", 3): (9.90, 7.96, 0.96),
+    ("S", 3): (10.14, 9.13, 1.38),
+    ("S", 2): (10.88, 9.49, 1.33),
+    ("P", 3): (8.90, 8.24, 0.96),
+}
+# Electronegativity of the H cation, used instead of a + b + c for hydrogens
+HYDROGEN_CHI_PLUS = 20.02
+
+# AutoDock spelling of the element types that are not retyped
+AUTODOCK_ELEMENT_TYPES = {"CL": "Cl", "BR": "Br", "ZN": "Zn", "MG": "Mg", "CA": "Ca", "MN": "Mn", "FE": "Fe"}
+
+
+def _template_mask(structure, templates, backbone=()):
+    # Atoms whose (resn, name) is listed in a residue template dictionary
+    keys = np.char.add(np.char.add(structure.resn, ":"), structure.atom_name)
+    listed = [f"{resn}:{name}" for resn, names in templates.items() for name in names]
+    mask = np.isin(keys, listed)
+    if backbone:
+        mask |= ~structure.is_het & np.isin(structure.atom_name, list(backbone))
+    return mask
+
+
+def _bonded_elements(structure, bonds):
+    # For every atom, a boolean per element telling whether it has such a neighbor
+    i, j = bonds[:, 0], bonds[:, 1]
+    bonded = {}
+    for element in ("H", "C", "N", "O", "S"):
+        has = np.zeros(len(structure), dtype=bool)
+        has[i[structure.element[j] == element]] = True
+        has[j[structure.element[i] == element]] = True
+        bonded[element] = has
+    return bonded
+
+
+def hybridization(structure, bonds=None):
+    """
+    Hybridization of every heavy atom (3 = sp3, 2 = sp2, 1 = sp, 0 for hydrogens).
+
+    Standard residues use the residue templates, so structures without hydrogens are
+    handled too. Other atoms fall back on their number of bonded neighbors.
+    """
+    bonds = bond_graph(structure) if bonds is None else bonds
+    n_neighbors = neighbor_counts(len(structure), bonds)
+    element = structure.element
+
+    hyb = np.full(len(structure), 3)
+    hyb[(element == "C") & (n_neighbors == 3)] = 2
+    hyb[(element == "C") & (n_neighbors <= 2) & (n_neighbors > 0)] = 1
+    hyb[(element == "N") & (n_neighbors == 2)] = 2
+    hyb[(element == "N") & (n_neighbors == 1)] = 1
+    hyb[(element == "O") & (n_neighbors == 1)] = 2
+
+    # N bonded to an sp2 carbon is conjugated (amide, guanidine)
+    sp2_carbon = (element == "C") & (hyb == 2)
+    i, j = bonds[:, 0], bonds[:, 1]
+    conjugated = np.zeros(len(structure), dtype=bool)
+    conjugated[i[sp2_carbon[j]]] = True
+    conjugated[j[sp2_carbon[i]]] = True
+    hyb[(element == "N") & (n_neighbors == 3) & conjugated] = 2
+
+    # Standard residues: template knowledge wins over the neighbor count.
+    # The backbone N is an amide (sp2) when peptide-bonded, an amine at the N-terminus or a chain break
+    standard = ~structure.is_het & np.isin(element, ["C", "N", "O", "S"])
+    carbonyl = standard & (structure.atom_name == "C")
+    peptide = np.zeros(len(structure), dtype=bool)
+    peptide[i[carbonyl[j]]] = True
+    peptide[j[carbonyl[i]]] = True
+    hyb[standard] = 3
+    hyb[standard & _template_mask(structure, SP2_ATOMS, BACKBONE_SP2)] = 2
+    hyb[standard & (structure.atom_name == "N") & peptide] = 2
+    hyb[element == "H"] = 0
+    return hyb
+
+
+def autodock_types(structure, bonds=None):
+    """
+    AutoDock4 receptor atom types for every atom, following the rules of Open Babel's PDBQT writer:
+    - A for aromatic carbons, C for the other carbons. The HIS and TRP five-membered rings
+      are aromatic only when a ring nitrogen carries a hydrogen (or the structure has none)
+    - N for amide-like nitrogens (3 neighbors, sp2) and ammonium (4 neighbors, sp3),
+      NA for the other nitrogens (hydrogen bond acceptors)
+    - OA for oxygens, S for sulfurs
+    - HD for hydrogens bonded to N, O or S, H for the other hydrogens
+    - the element symbol for everything else (Zn, Mg, Cl, ...)
+
+    Args:
+    - structure (Structure): protonated receptor, see structure.pdb_arrays.
+    - bonds (np.ndarray, optional): (M, 2) bonds, perceived from the coordinates by default.
+
+    Returns:
+    - np.ndarray: AutoDock atom type per atom.
+    """
+    bonds = bond_graph(structure) if bonds is None else bonds
+    element = structure.element
+    bonded = _bonded_elements(structure, bonds)
+    n_neighbors = neighbor_counts(len(structure), bonds)
+    hyb = hybridization(structure, bonds)
+
+    # Aromatic ring atoms, ring by ring (atoms shared by the two TRP rings are aromatic if either ring is)
+    rid = residue_index(structure)
+    protonated = (element == "H").any()
+    aromatic = np.zeros(len(structure), dtype=bool)
+    for ring in AROMATIC_RINGS:
+        in_ring = _template_mask(structure, ring)
+        broken = np.zeros(rid[-1] + 1, dtype=bool)
+        broken[rid[in_ring & (n_neighbors >= 4)]] = True
+        if protonated and len(next(iter(ring.values()))) == 5:
+            has_nh = np.zeros(rid[-1] + 1, dtype=bool)
+            has_nh[rid[in_ring & (element == "N") & bonded["H"]]] = True
+            broken |= ~has_nh
+        aromatic |= in_ring & ~broken[rid]
+
+    types = np.array([AUTODOCK_ELEMENT_TYPES.get(e, e.capitalize()) for e in element], dtype="U2")
+    types[element == "C"] = "C"
+    types[(element == "C") & aromatic] = "A"
+    types[element == "N"] = "NA"
+    donor_only = ((n_neighbors == 3) & (hyb == 2)) | ((n_neighbors == 4) & (hyb == 3))
+    types[(element == "N") & donor_only] = "N"
+    types[element == "O"] = "OA"
+    types[element == "S"] = "S"
+    types[element == "H"] = "H"
+    types[(element == "H") & (bonded["N"] | bonded["O"] | bonded["S"])] = "HD"
+    return types
+
+
+def gasteiger_charges(structure, bonds=None, iterations=6):
+    """
+    Gasteiger-Marsili partial charges by iterative partial equalization of orbital
+    electronegativity, evaluated for all atoms and bonds at once per iteration.
+
+    Args:
+    - structure (Structure): protonated structure, see structure.pdb_arrays.
+    - bonds (np.ndarray, optional): (M, 2) bonds, perceived from the coordinates by default.
+    - iterations (int): number of equalization steps, 6 as in Open Babel.
+
+    Returns:
+    - np.ndarray: partial charge per atom.
+    """
+    bonds = bond_graph(structure) if bonds is None else bonds
+    hyb = hybridization(structure, bonds)
+    parameters = np.array([
+        GASTEIGER_PARAMETERS.get((element, h), GASTEIGER_PARAMETERS.get((element, 3), (0.0, 0.0, 0.0)))
+        for element, h in zip(structure.element, hyb)
+    ])
+    a, b, c = parameters.T
+    chi_plus = np.where(structure.element == "H", HYDROGEN_CHI_PLUS, a + b + c)
+    # Atoms without parameters (metals) keep their formal charge
+    active = chi_plus != 0
+    chi_plus[~active] = 1.0
+
+    charges = formal_charges(structure)
+    i, j = bonds[:, 0], bonds[:, 1]
+    both_active = active[i] & active[j]
+    i, j = i[both_active], j[both_active]
+    damping = 1.0
+    for _ in range(iterations):
+        damping *= 0.5
+        chi = a + b * charges + c * charges ** 2
+        delta = chi[j] - chi[i]
+        # The less electronegative atom of each bond gives the electrons
+        transfer = damping * delta / np.where(delta > 0, chi_plus[i], chi_plus[j])
+        charges += np.bincount(i, transfer, len(structure)) - np.bincount(j, transfer, len(structure))
+    return charges
+
+
+def formal_charges(structure):
+    """
+    Formal charges from the charge column of the PDB records ("1+", "2-", ...).
+    """
+    charge = np.char.strip(structure.charge)
+    values = np.zeros(len(structure))
+    signed = np.char.str_len(charge) == 2
+    magnitude = np.where(signed, np.char.replace(np.char.replace(charge, "+", ""), "-", ""), "0")
+    values[signed] = magnitude[signed].astype(float)
+    values[np.char.endswith(charge, "-")] *= -1
+    return values
+
+
+def hydrogen_parents(structure, bonds=None):
+    """
+    Parent of every hydrogen: the nearest heavy atom bonded to it. A hydrogen of a
+    distorted geometry may be perceived as bonded to two heavy atoms, it keeps one.
+
+    Returns:
+    - np.ndarray: index of the parent per atom, -1 for heavy atoms and lone hydrogens.
+    """
+    bonds = bond_graph(structure) if bonds is None else bonds
+    bonds = np.concatenate([bonds, bonds[:, ::-1]])
+    h, parent = bonds[:, 0], bonds[:, 1]
+    pick = (structure.element[h] == "H") & (structure.element[parent] != "H")
+    h, parent = h[pick], parent[pick]
+    distance = np.linalg.norm(structure.coords[h] - structure.coords[parent], axis=1)
+    # Nearest bonded heavy atom first for every hydrogen
+    order = np.lexsort((distance, h))
+    h, parent = h[order], parent[order]
+    first = np.r_[True, h[1:] != h[:-1]]
+    parents = np.full(len(structure), -1)
+    parents[h[first]] = parent[first]
+    return parents
+
+
+def merge_nonpolar_hydrogens(structure, types, charges, bonds=None):
+    """
+    Fold the charge of every hydrogen whose parent (see hydrogen_parents) is a carbon
+    into that carbon and drop it, as AutoDock expects for a united-atom receptor.
+    The net charge is unchanged.
+
+    Returns:
+    - (Structure, np.ndarray, np.ndarray): the remaining atoms, their types and charges.
+    """
+    parents = hydrogen_parents(structure, bonds)
+    charges = np.array(charges, dtype=float)
+    nonpolar = (parents >= 0) & (structure.element[parents] == "C")
+    np.add.at(charges, parents[nonpolar], charges[nonpolar])
+    keep = ~nonpolar
+    return structure.subset(keep), types[keep], charges[keep]
+
+
+def prepare_receptor_pdbqt(pdb_path, pdbqt_path):
+    """
+    Type, charge and write a protonated receptor PDB as rigid receptor PDBQT,
+    without calling obabel.
+
+    Args:
+    - pdb_path (str): protonated receptor PDB, e.g. from add_hcharges.
+    - pdbqt_path (str): Path of the output PDBQT file.
+
+    Returns:
+    - str: pdbqt_path
+    """
+    structure = read_pdb_arrays(pdb_path)
+    bonds = bond_graph(structure)
+    types = autodock_types(structure, bonds)
+    charges = gasteiger_charges(structure, bonds)
+    receptor, types, charges = merge_nonpolar_hydrogens(structure, types, charges, bonds)
+    return write_pdbqt(receptor, pdbqt_path, types, charges, name=pdb_path)
+
+
+def validate_against_obabel(input_directory):
+    """
+    Compare the native atom types and Gasteiger charges with Open Babel
+    (`obabel -xr -opdbqt --partialcharge gasteiger`) for every PDB file of a directory.
+    Atoms are matched by position, as obabel names all added hydrogens "H".
+
+    Args:
+    - input_directory (str): Path to the directory containing PDB files, e.g. input_pdb_files.
+
+    Returns:
+    - list of dict: per structure the number of matched atoms, the type agreement,
+                    the mean absolute charge difference and the native atoms/second.
+    """
+    obabel = shutil.which("obabel")
+    if obabel is None:
+        raise RuntimeError("obabel is not installed, cannot validate against Open Babel")
+
+    results = []
+    for filename in sorted(os.listdir(input_directory)):
+        if not filename.endswith(".pdb"):
+            continue
+        try:
+            pdb_path = os.path.join(input_directory, filename)
+            structure = read_pdb_arrays(pdb_path)
+            structure = structure.subset(~structure.is_het)
+
+            start = time.perf_counter()
+            bonds = bond_graph(structure)
+            types = autodock_types(structure, bonds)
+            charges = gasteiger_charges(structure, bonds)
+            elapsed = time.perf_counter() - start
+
+            with tempfile.TemporaryDirectory() as tmp:
+                protein_pdb = os.path.join(tmp, "protein.pdb")
+                with open(pdb_path) as pdb_file, open(protein_pdb, "w") as protein_file:
+                    protein_file.writelines(line for line in pdb_file if line.startswith("ATOM"))
+                reference_pdbqt = os.path.join(tmp, "reference.pdbqt")
+                subprocess.run([obabel, protein_pdb, "-xr", "-opdbqt", "--partialcharge", "gasteiger",
+                                "-O", reference_pdbqt], capture_output=True)
+                reference, reference_types, reference_charges = read_pdbqt(reference_pdbqt)
+
+            distances, native = cKDTree(structure.coords).query(reference.coords)
+            matched = distances < 0.01
+            native, ref = native[matched], np.where(matched)[0]
+            results.append({
+                "structure": structure.name,
+                "atoms": len(ref),
+                "type_agreement": float(np.mean(types[native] == reference_types[ref])),
+                "charge_mae": float(np.mean(np.abs(charges[native] - reference_charges[ref]))),
+                "atoms_per_s": len(structure) / elapsed,
+            })
+            print(f"{filename}: {results[-1]['atoms']} atoms, {results[-1]['type_agreement']:.1%} same type, "
+                  f"charge MAE {results[-1]['charge_mae']:.3f} e, {results[-1]['atoms_per_s']:,.0f} atoms/s")
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+    return results
+
+
+def benchmark_atom_typing(input_directory, repeats=3):
+    """
+    Throughput of the native typing + charge engine (atoms/second) on the PDB files
+    of a directory, bond perception included.
+    """
+    structures = [read_pdb_arrays(os.path.join(input_directory, filename))
+                  for filename in sorted(os.listdir(input_directory)) if filename.endswith(".pdb")]
+    n_atoms = sum(len(structure) for structure in structures)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for structure in structures:
+            structure.cache.clear()
+            bonds = bond_graph(structure)
+            autodock_types(structure, bonds)
+            gasteiger_charges(structure, bonds)
+    rate = repeats * n_atoms / (time.perf_counter() - start)
+    print(f"Typed and charged {n_atoms} atoms x {repeats}: {rate:,.0f} atoms/s")
+    return rate
+
+
+if __name__ == "__main__":
+    input_directory = os.path.join(os.getcwd(), "input_pdb_files")
+    benchmark_atom_typing(input_directory)
+    if shutil.which("obabel"):
+        validate_against_obabel(input_directory)
@@ -0,0 +1,312 @@
+import collections
+import difflib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from af2bind.result_store import ResultStore
+from grid_box.grid_engine import find_af2bind_csv, read_af2bind_csv
+from structure.triage import scan_pdb
+
+# One-letter codes of the observed residues, modified residues mapped to their parent
+THREE_TO_ONE = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H",
+    "ILE": "I", "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P", "SER": "S", "THR": "T", "TRP": "W",
+    "TYR": "Y", "VAL": "V", "MSE": "M", "SEC": "U", "PYL": "O", "SEP": "S", "TPO": "T", "PTR": "Y", "HYP": "P",
+    "CSO": "C", "MLY": "K", "HID": "H", "HIE": "H", "HIP": "H", "CYX": "C", "ASH": "D", "GLH": "E", "LYN": "K",
+}
+
+# Chains are clustered when they share this fraction of identical residues over the shorter one,
+# and the shorter one covers this fraction of the longer one (observed residues, so disordered loops count)
+IDENTITY = 0.95
+COVERAGE = 0.8
+
+# Length of the k-mers of the candidate search
+KMER = 5
+
+
+def chain_sequence(residues):
+    """
+    One-letter sequence of the observed residues of a chain, see scan_pdb.
+    """
+    return "".join(THREE_TO_ONE.get(resn, "X") for _, resn in residues)
+
+
+def sequence_identity(a, b):
+    """
+    Identity over the shorter sequence and coverage of the longer one, from the
+    matching blocks of difflib (no gap penalties, enough for near-identical chains).
+
+    Returns:
+    - (float, float): identity and coverage.
+    """
+    shorter, longer = sorted((len(a), len(b)))
+    if shorter == 0:
+        return 0.0, 0.0
+    matches = sum(block.size for block in difflib.SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks())
+    return matches / shorter, shorter / longer
+
+
+def cluster_chains(sequences, identity=IDENTITY, coverage=COVERAGE, k=KMER):
+    """
+    Greedy clustering of chain sequences, longest first (as CD-HIT): a chain joins the
+    first cluster whose representative passes the identity and coverage thresholds,
+    or starts a new cluster.
+
+    The representatives are indexed by k-mer, so a chain is only aligned to the
+    representatives sharing enough k-mers to reach the identity threshold (every
+    mismatch breaks at most k of its k-mers).
+
+    Args:
+    - sequences (dict): {chain key: one-letter sequence}, e.g. {("6o0k", "A"): "MEN..."}.
+    - identity (float): identity threshold.
+    - coverage (float): coverage threshold.
+    - k (int): k-mer length.
+
+    Returns:
+    - dict: {chain key: cluster number}.
+    """
+    keys = sorted(sequences, key=lambda key: -len(sequences[key]))
+    index = collections.defaultdict(list)
+    representatives = []
+    clusters = {}
+    for key in keys:
+        sequence = sequences[key]
+        kmers = {sequence[i:i + k] for i in range(max(len(sequence) - k + 1, 1))}
+        needed = max(1, len(kmers) - k * int((1 - identity) * len(sequence) + 0.999))
+        shared = collections.Counter(cluster for kmer in kmers for cluster in index.get(kmer, ()))
+        match = None
+        for cluster, count in shared.most_common():
+            if count < needed:
+                break
+            if sequence == representatives[cluster]:
+                match = cluster
+                break
+            shared_identity, shared_coverage = sequence_identity(sequence, representatives[cluster])
+            if shared_identity >= identity and shared_coverage >= coverage:
+                match = cluster
+                break
+        if match is None:
+            # New cluster represented by this chain
+            match = len(representatives)
+            for kmer in kmers:
+                index[kmer].append(match)
+            representatives.append(sequence)
+        clusters[key] = match
+    return clusters
+
+
+def dedup_directory(input_path, chains=None, identity=IDENTITY, coverage=COVERAGE, k=KMER, report_path=None):
+    """
+    Group the PDB files of a directory that hold the same protein, and pick one
+    representative per group: the best resolution, then the most complete chains.
+
+    The chain sequences come from the streaming scan of structure/triage.py, and
+    two entries are grouped when their (scored) chains fall in the same clusters, with
+    the same number of chains per cluster (a homodimer is not grouped with its monomer).
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - chains (str, optional): comma-separated chains compared between entries, e.g. "A"
+                              as scored by af2bind; all the protein chains by default.
+    - identity (float), coverage (float), k (int): chain clustering, see cluster_chains.
+    - report_path (str, optional): CSV file of the report.
+
+    Returns:
+    - pd.DataFrame: target, group, representative, is_representative, chain_clusters
+                    (e.g. "A:0 B:1"), resolution, completeness and residues, one row per file.
+    """
+    start = time.perf_counter()
+    scans = {}
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                scans[os.path.splitext(filename)[0]] = scan_pdb(os.path.join(input_path, filename))
+            except Exception as e:
+                print(f"Error scanning {filename}: {e}")
+    wanted = chains.split(",") if chains else None
+    sequences = {(target, chain): chain_sequence(residues) for target, scan in scans.items()
+                 for chain, residues in scan["residues"].items() if wanted is None or chain in wanted}
+    clusters = cluster_chains(sequences, identity, coverage, k)
+
+    rows = []
+    for target, scan in scans.items():
+        chain_clusters = {chain: clusters[target, chain] for chain in scan["residues"] if (target, chain) in clusters}
+        observed = sum(len(scan["residues"][chain]) for chain in chain_clusters)
+        expected = sum(scan["seqres"].get(chain, len(scan["residues"][chain])) for chain in chain_clusters)
+        rows.append({"target": target, "signature": tuple(sorted(chain_clusters.values())),
+                     "chain_clusters": " ".join(f"{chain}:{cluster}" for chain, cluster in chain_clusters.items()),
+                     "resolution": scan["resolution"], "completeness": observed / expected if expected else 0.0,
+                     "residues": observed})
+    report = pd.DataFrame(rows, columns=["target", "signature", "chain_clusters", "resolution", "completeness",
+                                         "residues"])
+
+    # Best entry of every group of identical signatures
+    report["group"] = report.groupby("signature", sort=False).ngroup()
+    ranked = report.assign(rank_resolution=report["resolution"].fillna(float("inf")))
+    ranked = ranked.sort_values(["rank_resolution", "completeness", "target"], ascending=[True, False, True])
+    representatives = ranked.groupby("group").first()["target"]
+    report["representative"] = report["group"].map(representatives)
+    report["is_representative"] = report["target"] == report["representative"]
+    report = report.drop(columns="signature")[["target", "group", "representative", "is_representative",
+                                               "chain_clusters", "resolution", "completeness", "residues"]]
+
+    print(f"{len(report)} file(s), {len(sequences)} chain(s) in {len(set(clusters.values()))} cluster(s): "
+          f"{report['group'].nunique()} unique protein(s) in {time.perf_counter() - start:.2f} s")
+    if report_path:
+        report.to_csv(report_path, index=False)
+    return report
+
+
+def residue_mapping(source_residues, target_residues):
+    """
+    Map the residue numbers of one chain onto another chain of the same cluster,
+    through the alignment of their sequences (so renumbered, truncated or mutated
+    entries map correctly).
+
+    Args:
+    - source_residues, target_residues (list): (resi, resn) of the observed residues, see scan_pdb.
+
+    Returns:
+    - dict: {source resi: target resi} of the matched residues.
+    """
+    matcher = difflib.SequenceMatcher(None, chain_sequence(source_residues), chain_sequence(target_residues),
+                                      autojunk=False)
+    mapping = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        # Identical stretches, and substitutions of the same length (point mutants)
+        if tag == "equal" or (tag == "replace" and i2 - i1 == j2 - j1):
+            for offset in range(i2 - i1):
+                mapping[source_residues[i1 + offset][0]] = target_residues[j1 + offset][0]
+    return mapping
+
+
+def _chain_clusters(text):
+    return [(item.split(":")[0], int(item.split(":")[1])) for item in text.split()]
+
+
+def map_predictions(predictions, source_scan, target_scan, chain_pairs):
+    """
+    af2bind predictions of a representative carried over to another entry of its group.
+
+    Args:
+    - predictions (pd.DataFrame): af2bind results of the representative (chain, resi, resn, p(bind)).
+    - source_scan, target_scan (dict): scans of both entries, see scan_pdb.
+    - chain_pairs (list): (representative chain, entry chain) pairs of the same cluster.
+
+    Returns:
+    - pd.DataFrame: predictions renumbered on the entry, residues without counterpart dropped.
+    """
+    mapped = []
+    for source_chain, target_chain in chain_pairs:
+        mapping = residue_mapping(source_scan["residues"][source_chain], target_scan["residues"][target_chain])
+        rows = predictions[predictions["chain"] == source_chain]
+        rows = rows.assign(chain=target_chain, resi=rows["resi"].astype(str).map(mapping)).dropna(subset=["resi"])
+        # In the residue order of the entry, with its residue names (point mutants keep their own)
+        residues = target_scan["residues"][target_chain]
+        position = {resi: i for i, (resi, _) in enumerate(residues)}
+        rows = rows.assign(position=rows["resi"].map(position)).sort_values("position", kind="stable")
+        rows["resn"] = [THREE_TO_ONE.get(residues[i][1], "X") for i in rows["position"]]
+        mapped.append(rows.drop(columns="position"))
+    mapped = pd.concat(mapped, ignore_index=True) if mapped else predictions.iloc[:0]
+    # Residue numbers with an insertion code stay strings
+    mapped["resi"] = [int(resi) if str(resi).lstrip("-").isdigit() else resi for resi in mapped["resi"]]
+    return mapped
+
+
+def reuse_predictions(report, input_path, csv_directory, store_path=None, overwrite=False):
+    """
+    Write the af2bind results of every non-representative entry from its representative's
+    ones (`results_{target}.csv` in csv_directory, and the ResultStore if given), so
+    af2bind only runs on the representatives of dedup_directory.
+
+    Returns:
+    - int: number of entries written.
+    """
+    written = 0
+    scans = {}
+
+    def scan(target):
+        # A representative is shared by several entries, every file is scanned once
+        if target not in scans:
+            scans[target] = scan_pdb(os.path.join(input_path, f"{target}.pdb"))
+        return scans[target]
+
+    representatives = report.set_index("target")
+    for _, row in report[~report["is_representative"]].iterrows():
+        output_csv = os.path.join(csv_directory, f"results_{row['target']}.csv")
+        if os.path.isfile(output_csv) and not overwrite:
+            continue
+        csv_path = find_af2bind_csv(csv_directory, row["representative"])
+        if csv_path is None:
+            print(f"No af2bind results of {row['representative']} to reuse for {row['target']}")
+            continue
+        try:
+            # Pair the chains of the same cluster, in file order
+            free = collections.defaultdict(list)
+            for chain, cluster in _chain_clusters(row["chain_clusters"]):
+                free[cluster].append(chain)
+            chain_pairs = [(chain, free[cluster].pop(0))
+                           for chain, cluster in _chain_clusters(representatives.loc[row["representative"], "chain_clusters"])
+                           if free[cluster]]
+            predictions = read_af2bind_csv(csv_path)
+            mapped = map_predictions(predictions, scan(row["representative"]), scan(row["target"]), chain_pairs)
+            mapped[["chain", "resi", "resn", "p(bind)"]].to_csv(output_csv)
+            if store_path:
+                # The store keys residues by number, residues with an insertion code are left out
+                numbered = mapped[[isinstance(resi, int) for resi in mapped["resi"]]]
+                with ResultStore(store_path) as store:
+                    store.insert(row["target"], numbered, source=f"mapped from {row['representative']}")
+            written += 1
+            print(f"Reused the af2bind results of {row['representative']} for {row['target']}: "
+                  f"{len(mapped)}/{len(predictions)} residues mapped")
+        except Exception as e:
+            print(f"Error reusing the af2bind results for {row['target']}: {e}")
+    return written
+
+
+def benchmark_clustering(n_proteins=50, copies=5, length=300, mutations=3, seed=0):
+    """
+    Time cluster_chains on synthetic entries (random proteins, each present `copies`
+    times with point mutations and truncated ends) against aligning every chain to
+    every representative, the greedy clustering without the k-mer index.
+
+    Returns:
+    - dict: seconds of both, and the clusters found (should be n_proteins).
+    """
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    sequences = {}
+    for p in range(n_proteins):
+        protein = rng.choice(alphabet, length)
+        for c in range(copies):
+            copy = protein.copy()
+            copy[rng.integers(0, length, mutations)] = rng.choice(alphabet, mutations)
+            start, end = rng.integers(0, 10), length - rng.integers(0, 10)
+            sequences[(f"P{p}_{c}", "A")] = "".join(copy[start:end])
+
+    start = time.perf_counter()
+    clusters = cluster_chains(sequences)
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    representatives = []
+    for key in sorted(sequences, key=lambda key: -len(sequences[key])):
+        for representative in representatives:
+            shared_identity, shared_coverage = sequence_identity(sequences[key], representative)
+            if shared_identity >= IDENTITY and shared_coverage >= COVERAGE:
+                break
+        else:
+            representatives.append(sequences[key])
+    all_pairs = time.perf_counter() - start
+
+    print(f"{len(sequences)} chains: {len(set(clusters.values()))} clusters with the k-mer index in {indexed:.2f} s, "
+          f"{len(representatives)} aligning to every representative in {all_pairs:.2f} s")
+    return {"indexed": indexed, "all_pairs": all_pairs, "clusters": len(set(clusters.values()))}
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    print(dedup_directory(input_path).to_string(index=False))
@@ -1,7 +1,11 @@
 import os
+
+from protein_preprocessing.atom_typing import prepare_receptor_pdbqt
+from protein_preprocessing.minimize import minimize_pdb
 # this code require the Openbabel install
 
-def energy_minimize_pdbqt(input_directory, output_directory):
+def energy_minimize_pdbqt(input_directory, output_directory, native_pdbqt=False, mode=None, max_steps=500, tolerance=0.1,
+                          obabel_steps=None, obabel_crit=None):
     """
     Process PDB files in the input directory, 
     perform the energy minimize, and convert them to PDBQT format.
@@ -9,6 +13,14 @@ def energy_minimize_pdbqt(input_directory, output_directory):
     Args:
     - input_directory (str): Path to the directory containing PDB files.
     - output_directory (str): Path to the directory for saving modified PDBQT files.
+    - native_pdbqt (bool): type and charge the receptor with atom_typing instead of obabel.
+    - mode (str, optional): minimize with minimize.py in "hydrogens", "restrained" or "all" mode
+                            instead of obabel --minimize.
+    - max_steps (int): maximum number of minimization steps of minimize.py.
+    - tolerance (float): convergence criterion of minimize.py, largest gradient component (kcal/mol/A).
+    - obabel_steps (int, optional): --steps of obabel --minimize, obabel's default if None.
+    - obabel_crit (float, optional): --crit of obabel --minimize, an energy change criterion,
+                                     obabel's default if None.
     """
     # Create the output directory if it doesn't exist
     os.makedirs(output_directory, exist_ok=True)
@@ -27,11 +39,23 @@ def energy_minimize_pdbqt(input_directory, output_directory):
                 # Output PDBQT file path
                 output_pdbqt = os.path.join(output_directory, f"{os.path.splitext(filename)[0]}_protein.pdbqt")
 
-                # Run the command to protonate at pH 7.4 and conduct local energy minimizer the input PDB file
-                os.system(f"obabel {input_pdb} -opdb --minimize  -O {minimized_pdb}")
+                # Conduct local energy minimization of the input PDB file
+                if mode:
+                    report = minimize_pdb(input_pdb, minimized_pdb, mode, max_steps, tolerance)
+                    print(f"Minimized {filename} in {report['steps']} steps, heavy atom RMSD {report['heavy_rmsd']:.3f} A")
+                else:
+                    options = ""
+                    if obabel_steps is not None:
+                        options += f" --steps {obabel_steps}"
+                    if obabel_crit is not None:
+                        options += f" --crit {obabel_crit}"
+                    os.system(f"obabel {input_pdb} -opdb --minimize{options} -O {minimized_pdb}")
 
-                # Run the command to convert PDB file to PDBQT format
-                os.system(f"obabel {minimized_pdb} -opdbqt -xr -O {output_pdbqt}")
+                # Convert the PDB file to PDBQT format
+                if native_pdbqt:
+                    prepare_receptor_pdbqt(minimized_pdb, output_pdbqt)
+                else:
+                    os.system(f"obabel {minimized_pdb} -opdbqt -xr -O {output_pdbqt}")
                 
                 print(f"Processed {filename}. minimized file saved to {minimized_pdb}. PDBQT file saved to {output_pdbqt}")
             except Exception as e:
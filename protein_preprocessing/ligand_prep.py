@@ -0,0 +1,294 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from grid_box.ligand_sites import ligand_id, perceive_ligands, pocket_ligand_file
+from structure.bonds import perceive_bonds
+from structure.filters import altloc_mask, hydrogen_mask
+from structure.pdb_arrays import covalent_radii, read_pdb_arrays, write_pdb
+
+# obabel options of the docking-ready ligand: 3D conformer, hydrogens and Gasteiger charges
+GEN3D_ARGS = ["--gen3d", "-h", "--partialcharge", "gasteiger"]
+
+# Prepared ligands shared by all the runs, next to the input files by default
+DEFAULT_CACHE = os.path.join(os.getcwd(), "ligand_cache")
+
+# Serializes the index writes of the batches running in the same process, the
+# index lock file those of the processes sharing the cache (e.g. cluster workers)
+_save_lock = threading.Lock()
+
+
+def ligand_key(structure, members, keep=None):
+    """
+    Graph key of a ligand instance: a Weisfeiler-Lehman hash of its heavy-atom bond
+    graph labelled by element. It does not depend on the residue name, atom names,
+    atom order or coordinates, so the copies of a molecule in a batch get the same key
+    without calling obabel.
+
+    Bond orders, charges and stereochemistry are not part of the graph (enantiomers,
+    alkene/alkane pairs share a key): the key only groups the instances of one residue
+    name within a batch, the ligand cache is keyed by InChIKey.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - members (np.ndarray): atom indices of the instance, see perceive_ligands.
+    - keep (np.ndarray, optional): atoms kept after resolving alternate locations (altloc_mask).
+
+    Returns:
+    - str: 16 hexadecimal characters.
+    """
+    keep = altloc_mask(structure) if keep is None else keep
+    atoms = members[keep[members] & ~hydrogen_mask(structure)[members]]
+    bonds = perceive_bonds(structure.coords[atoms], covalent_radii(structure)[atoms])
+    neighbors = [[] for _ in atoms]
+    for i, j in bonds:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+
+    # Refine the atom labels with their neighbors until the partition is stable
+    labels = structure.element[atoms].tolist()
+    n_classes = len(set(labels))
+    for _ in range(len(atoms)):
+        labels = [hashlib.sha1(f"{labels[i]}({','.join(sorted(labels[j] for j in neighbors[i]))})".encode()).hexdigest()
+                  for i in range(len(atoms))]
+        if len(set(labels)) == n_classes:
+            break
+        n_classes = len(set(labels))
+    return hashlib.sha1(" ".join(sorted(labels)).encode()).hexdigest()[:16]
+
+
+def extract_ligands(structure, resn=None):
+    """
+    Ligand instances of a structure with their graph keys.
+
+    Args:
+    - structure (Structure): parsed structure.
+    - resn (str or list, optional): restrict to these residue names, e.g. from fetch_ligand_name.
+
+    Returns:
+    - list of dict: ligand_id, resn, key, members (atom indices) and heavy_atoms of every instance.
+    """
+    keep = altloc_mask(structure)
+    ligands = []
+    for members in perceive_ligands(structure, resn=resn):
+        ligands.append({
+            "ligand_id": ligand_id(structure, members),
+            "resn": "-".join(dict.fromkeys(structure.resn[members])),
+            "key": ligand_key(structure, members, keep),
+            "members": members[keep[members]],
+            "heavy_atoms": int((structure.element[members[keep[members]]] != "H").sum()),
+        })
+    return ligands
+
+
+class LigandCache:
+    """
+    Prepared ligands on disk, shared across targets and runs:
+    - {inchikey}.pdbqt: docking-ready 3D ligand, {inchikey}.smi: canonical SMILES;
+    - index.json: InChIKey -> SMILES and residue names.
+
+    Every unique molecule of a batch needs the cheap SMILES/InChIKey conversion,
+    and 3D generation only runs for new InChIKeys.
+    """
+
+    def __init__(self, cache_directory=DEFAULT_CACHE):
+        self.cache_directory = cache_directory
+        os.makedirs(cache_directory, exist_ok=True)
+        self.index_path = os.path.join(cache_directory, "index.json")
+        self.index = {"ligands": {}}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as index_file:
+                self.index = {"ligands": json.load(index_file)["ligands"]}
+
+    def path(self, inchikey, extension):
+        return os.path.join(self.cache_directory, f"{inchikey}.{extension}")
+
+    def lookup(self, inchikey):
+        """
+        Whether the prepared ligand of an InChIKey is in the cache.
+        """
+        return os.path.isfile(self.path(inchikey, "pdbqt"))
+
+    def workspace(self):
+        """
+        Temporary directory inside the cache directory: the files prepared there are
+        moved in place with os.replace, which cannot cross file systems.
+        """
+        return tempfile.TemporaryDirectory(dir=self.cache_directory)
+
+    def add(self, inchikey, smiles, resn):
+        record = self.index["ligands"].setdefault(inchikey, {"smiles": smiles, "resn": []})
+        if resn not in record["resn"]:
+            record["resn"].append(resn)
+
+    def save(self):
+        # Merge with the entries saved meanwhile by other batches, then write to a
+        # temporary file first, so a reader never sees half an index
+        with _save_lock, open(f"{self.index_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.isfile(self.index_path):
+                with open(self.index_path) as index_file:
+                    saved = json.load(index_file)
+                for inchikey, record in saved["ligands"].items():
+                    merged = self.index["ligands"].setdefault(inchikey, record)
+                    merged["resn"] = list(dict.fromkeys(merged["resn"] + record["resn"]))
+            tmp_path = f"{self.index_path}.{os.uname().nodename}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as index_file:
+                json.dump(self.index, index_file, indent=1)
+            os.replace(tmp_path, self.index_path)
+
+
+def _obabel_output(obabel, ligand_pdb, output_format):
+    # First field of the single-line obabel output (SMILES or InChIKey)
+    result = subprocess.run([obabel, ligand_pdb, f"-o{output_format}"], capture_output=True, text=True)
+    fields = result.stdout.split()
+    if not fields:
+        raise RuntimeError(f"obabel could not convert {ligand_pdb} to {output_format}: {result.stderr.strip()}")
+    return fields[0]
+
+
+def prepare_ligand(structure, ligand, cache, obabel):
+    """
+    Canonicalize one ligand instance (SMILES and InChIKey) and generate its 3D PDBQT
+    unless the cache has its InChIKey.
+
+    Returns:
+    - dict: key, inchikey, smiles and whether the 3D conformer was generated.
+    """
+    with cache.workspace() as tmp:
+        ligand_pdb = write_pdb(structure.subset(ligand["members"]), os.path.join(tmp, "ligand.pdb"))
+        smiles = _obabel_output(obabel, ligand_pdb, "can")
+        inchikey = _obabel_output(obabel, ligand_pdb, "inchikey")
+        generated = False
+        if not cache.lookup(inchikey):
+            # Prepare in the temporary directory and move in place, so parallel runs never read a partial file
+            output_pdbqt = os.path.join(tmp, "ligand.pdbqt")
+            subprocess.run([obabel, ligand_pdb, "-O", output_pdbqt] + GEN3D_ARGS, capture_output=True)
+            if not os.path.isfile(output_pdbqt) or os.path.getsize(output_pdbqt) == 0:
+                raise RuntimeError(f"obabel could not prepare the ligand {ligand['ligand_id']}")
+            with open(os.path.join(tmp, "ligand.smi"), "w") as smi_file:
+                smi_file.write(f"{smiles}\t{ligand['resn']}\n")
+            os.replace(output_pdbqt, cache.path(inchikey, "pdbqt"))
+            os.replace(os.path.join(tmp, "ligand.smi"), cache.path(inchikey, "smi"))
+            generated = True
+    return {"key": ligand["key"], "inchikey": inchikey, "smiles": smiles, "generated": generated}
+
+
+def prepare_ligands(targets, output_directory, cache_directory=DEFAULT_CACHE, workers=4):
+    """
+    Prepare the ligands of a batch of targets, each unique molecule once.
+
+    The instances are grouped by residue name and graph key within the batch, every
+    group is canonicalized with obabel (SMILES and InChIKey) and the InChIKeys missing
+    from the cache get their 3D conformer, in parallel (obabel runs in subprocesses).
+
+    The cached PDBQT and SMILES of every instance are copied to the output directory
+    under the name its pocket config refers to (see ligand_sites.pocket_ligand_file):
+    `{target}_ligand.pdbqt/.smi` for a single instance, `{target}_{ligand_id}_ligand.pdbqt/.smi`
+    for several, so no pocket is docked with the ligand of another one.
+
+    Args:
+    - targets (list): (target name, Structure, resn or None) of every target.
+    - output_directory (str): Path to the directory for saving the ligand files.
+    - cache_directory (str): Path to the shared ligand cache.
+    - workers (int): number of ligands prepared at the same time.
+
+    Returns:
+    - dict: {target: list of ligand records with ligand_id, resn, key, inchikey, smiles,
+            heavy_atoms and files (the PDBQT and SMILES written to the output directory)}
+    """
+    obabel = shutil.which("obabel")
+    if obabel is None:
+        raise RuntimeError("obabel is not installed, cannot prepare the ligands")
+    cache = LigandCache(cache_directory)
+
+    # Ligand instances of every target, and one representative per molecule of the batch
+    instances, pending = {}, {}
+    for target, structure, resn in targets:
+        try:
+            instances[target] = (structure, extract_ligands(structure, resn=resn))
+            for ligand in instances[target][1]:
+                pending.setdefault((ligand["resn"], ligand["key"]), (structure, ligand))
+        except Exception as e:
+            print(f"Error extracting the ligands of {target}: {e}")
+
+    # Canonicalize the molecules in parallel, 3D generation only for the new InChIKeys
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {group: executor.submit(prepare_ligand, structure, ligand, cache, obabel)
+                   for group, (structure, ligand) in pending.items()}
+    generated, inchikeys = 0, {}
+    for group, future in futures.items():
+        try:
+            record = future.result()
+            cache.add(record["inchikey"], record["smiles"], group[0])
+            inchikeys[group] = record["inchikey"]
+            generated += record["generated"]
+        except Exception as e:
+            print(f"Error preparing the ligand {pending[group][1]['ligand_id']}: {e}")
+    cache.save()
+
+    # Copy the prepared files of every target from the cache
+    os.makedirs(output_directory, exist_ok=True)
+    prepared = {}
+    for target, (structure, ligands) in instances.items():
+        records = []
+        ligand_ids = [ligand["ligand_id"] for ligand in ligands]
+        for ligand in ligands:
+            inchikey = inchikeys.get((ligand["resn"], ligand["key"]))
+            if inchikey is None:
+                continue
+            files = []
+            for extension in ("pdbqt", "smi"):
+                files.append(os.path.join(output_directory,
+                                          pocket_ligand_file(target, ligand_ids, ligand["ligand_id"], extension)))
+                shutil.copyfile(cache.path(inchikey, extension), files[-1])
+            records.append({"ligand_id": ligand["ligand_id"], "resn": ligand["resn"], "key": ligand["key"],
+                            "inchikey": inchikey, "smiles": cache.index["ligands"][inchikey]["smiles"],
+                            "heavy_atoms": ligand["heavy_atoms"], "files": files})
+        prepared[target] = records
+
+    n_instances = sum(len(ligands) for _, ligands in instances.values())
+    print(f"{n_instances} ligand instance(s) in {len(instances)} target(s): {len(pending)} unique molecule(s), "
+          f"{generated} 3D conformer(s) generated in {time.perf_counter() - start:.1f} s")
+    return prepared
+
+
+def ligand_inventory(input_path, resn=None):
+    """
+    Count the ligand instances of the PDB files of a directory and the unique
+    molecules among them (by residue name and graph key, as prepare_ligands groups them),
+    i.e. the canonicalizations a batch needs.
+
+    Returns:
+    - dict: {(resn, graph key): list of (target, ligand_id)}
+    """
+    inventory = {}
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = read_pdb_arrays(os.path.join(input_path, filename))
+                for ligand in extract_ligands(structure, resn=resn):
+                    inventory.setdefault((ligand["resn"], ligand["key"]), []).append((structure.name, ligand["ligand_id"]))
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+    n_instances = sum(len(found) for found in inventory.values())
+    print(f"{n_instances} ligand instance(s), {len(inventory)} unique molecule(s)")
+    return inventory
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    for (resn, key), found in ligand_inventory(input_path).items():
+        print(resn, key, ", ".join(f"{target}:{ligand}" for target, ligand in found))
+    if shutil.which("obabel"):
+        targets = [(os.path.splitext(filename)[0], read_pdb_arrays(os.path.join(input_path, filename)), None)
+                   for filename in sorted(os.listdir(input_path)) if filename.endswith(".pdb")]
+        prepare_ligands(targets, os.path.join(os.getcwd(), "output_files"))
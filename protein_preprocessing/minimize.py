@@ -0,0 +1,259 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.spatial import cKDTree
+
+from protein_preprocessing.protonation import BOND_LENGTH, protonate
+from structure.bonds import adjacency, bond_graph
+from structure.pdb_arrays import read_pdb_arrays, write_pdb
+
+# Van der Waals radii (Angstrom) used by the clash term
+VDW_RADIUS = {"H": 1.1, "C": 1.7, "N": 1.55, "O": 1.52, "S": 1.8, "P": 1.8, "SE": 1.9}
+
+# Minimization modes:
+# - "hydrogens": only hydrogens move, heavy atoms stay at the crystal pose
+# - "restrained": all atoms move, heavy atoms are pulled back to the crystal pose
+# - "all": all atoms move freely
+MINIMIZATION_MODES = ("hydrogens", "restrained", "all")
+
+# Force constants (kcal/mol/A^2)
+BOND_K = 300.0
+ANGLE_K = 50.0
+CLASH_K = 10.0
+# Two non-bonded atoms clash below this fraction of their van der Waals radii sum
+CLASH_SCALE = 0.75
+
+
+def force_field_terms(structure, bond_tolerance=0.45):
+    """
+    Build the bonded terms of a simple restrained force field for a structure.
+
+    Bonds keep their crystal length, except X-H bonds that get the ideal lengths of
+    protonation.py. Angles are 1-3 distance terms (Urey-Bradley style) on the
+    starting geometry. 1-2 and 1-3 pairs are excluded from the clash term, as are
+    pairs of different alternate locations.
+
+    Returns:
+    - dict: index and reference arrays of every term, ready for force_field_energy.
+    """
+    coords = structure.coords
+    n_atoms = len(structure)
+    bonds = bond_graph(structure, bond_tolerance)
+
+    # X-H bonds take the ideal length of their heavy atom
+    bond_i, bond_j = bonds[:, 0], bonds[:, 1]
+    bond_r0 = np.linalg.norm(coords[bond_i] - coords[bond_j], axis=1)
+    heavy = np.where(structure.element[bond_i] == "H", bond_j, bond_i)
+    has_h = (structure.element[bond_i] == "H") | (structure.element[bond_j] == "H")
+    ideal = np.array([BOND_LENGTH.get(element, np.nan) for element in structure.element[heavy]])
+    bond_r0 = np.where(has_h & ~np.isnan(ideal), ideal, bond_r0)
+
+    # 1-3 pairs: atoms sharing a bonded neighbor
+    graph = adjacency(n_atoms, bonds)
+    two_paths = (graph @ graph).tocoo()
+    upper = two_paths.row < two_paths.col
+    angle_i, angle_j = two_paths.row[upper], two_paths.col[upper]
+    bonded_keys = bond_i * n_atoms + bond_j
+    angle_keep = ~np.isin(angle_i * n_atoms + angle_j, bonded_keys)
+    angle_i, angle_j = angle_i[angle_keep], angle_j[angle_keep]
+    angle_r0 = np.linalg.norm(coords[angle_i] - coords[angle_j], axis=1)
+
+    return {
+        "bond": (bond_i, bond_j, bond_r0),
+        "angle": (angle_i, angle_j, angle_r0),
+        "excluded": np.concatenate([bonded_keys, angle_i * n_atoms + angle_j]),
+        "radius": np.array([VDW_RADIUS.get(element, 1.8) for element in structure.element]),
+        "altloc": structure.altloc,
+        "reference": coords.copy(),
+    }
+
+
+def neighbor_pairs(coords, terms, cutoff):
+    """
+    Non-bonded neighbor list: atom pairs closer than `cutoff`, without the excluded
+    1-2/1-3 pairs and the pairs of different alternate locations.
+
+    Returns:
+    - (np.ndarray, np.ndarray, np.ndarray): pair indices and clash distances.
+    """
+    pairs = cKDTree(coords).query_pairs(cutoff, output_type="ndarray")
+    i, j = pairs[:, 0], pairs[:, 1]
+    keep = ~np.isin(i * len(coords) + j, terms["excluded"])
+    altloc = terms["altloc"]
+    keep &= (altloc[i] == "") | (altloc[j] == "") | (altloc[i] == altloc[j])
+    i, j = i[keep], j[keep]
+    return i, j, CLASH_SCALE * (terms["radius"][i] + terms["radius"][j])
+
+
+def _pair_energy(coords, i, j, r0, k, repulsive_only=False):
+    # Harmonic energy k * (r - r0)^2 of atom pairs and its per-atom gradient
+    delta = coords[i] - coords[j]
+    r = np.linalg.norm(delta, axis=1)
+    stretch = r - r0
+    if repulsive_only:
+        stretch = np.minimum(stretch, 0.0)
+    force = (2 * k * stretch / np.maximum(r, 1e-8))[:, None] * delta
+    gradient = np.zeros_like(coords)
+    for axis in range(3):
+        gradient[:, axis] = (np.bincount(i, force[:, axis], len(coords))
+                             - np.bincount(j, force[:, axis], len(coords)))
+    return k * np.sum(stretch ** 2), gradient
+
+
+def force_field_energy(coords, terms, pairs, restraint_k=0.0, restrained=None):
+    """
+    Energy (kcal/mol) and gradient of all atoms in one vectorized evaluation.
+
+    Args:
+    - coords (np.ndarray): (N, 3) coordinates.
+    - terms (dict): bonded terms from force_field_terms.
+    - pairs (tuple): non-bonded neighbor list from neighbor_pairs.
+    - restraint_k (float): force constant of the positional restraints.
+    - restrained (np.ndarray, optional): boolean mask of the restrained atoms.
+
+    Returns:
+    - (dict, np.ndarray): energy per component plus "total", and the (N, 3) gradient.
+    """
+    energies = {}
+    energies["bond"], gradient = _pair_energy(coords, *terms["bond"], BOND_K)
+    energies["angle"], angle_gradient = _pair_energy(coords, *terms["angle"], ANGLE_K)
+    energies["clash"], clash_gradient = _pair_energy(coords, *pairs, CLASH_K, repulsive_only=True)
+    gradient += angle_gradient + clash_gradient
+
+    energies["restraint"] = 0.0
+    if restraint_k and restrained is not None and restrained.any():
+        displacement = coords[restrained] - terms["reference"][restrained]
+        energies["restraint"] = restraint_k * np.sum(displacement ** 2)
+        gradient[restrained] += 2 * restraint_k * displacement
+    energies["total"] = sum(energies.values())
+    return energies, gradient
+
+
+def minimize_structure(structure, mode="hydrogens", max_steps=500, tolerance=0.1, restraint_k=10.0, skin=1.0):
+    """
+    Minimize a protonated structure with L-BFGS on the restrained force field.
+
+    The neighbor list is built with a `skin` margin and rebuilt between L-BFGS rounds
+    whenever an atom moved more than half of it, so the energy is always evaluated
+    on pair arrays instead of all atom pairs.
+
+    Args:
+    - structure (Structure): protonated structure, see structure.pdb_arrays.
+    - mode (str): "hydrogens", "restrained" or "all", see MINIMIZATION_MODES.
+    - max_steps (int): maximum number of L-BFGS iterations.
+    - tolerance (float): convergence criterion on the largest gradient component (kcal/mol/A).
+    - restraint_k (float): force constant of the heavy atom restraints in "restrained" mode.
+    - skin (float): neighbor list margin in Angstrom.
+
+    Returns:
+    - (Structure, dict): the minimized structure and a report with the energies,
+                         steps, convergence and heavy atom RMSD.
+    """
+    if mode not in MINIMIZATION_MODES:
+        raise ValueError(f"Unknown minimization mode {mode}, expected one of {MINIMIZATION_MODES}")
+
+    terms = force_field_terms(structure)
+    heavy = structure.element != "H"
+    movable = ~heavy if mode == "hydrogens" else np.ones(len(structure), dtype=bool)
+    restrained = heavy if mode == "restrained" else None
+    restraint_k = restraint_k if mode == "restrained" else 0.0
+    cutoff = CLASH_SCALE * 2 * terms["radius"].max() + skin
+
+    coords = structure.coords.copy()
+    pairs = neighbor_pairs(coords, terms, cutoff)
+    initial, _ = force_field_energy(coords, terms, pairs, restraint_k, restrained)
+
+    def objective(x, pairs):
+        coords[movable] = x.reshape(-1, 3)
+        energies, gradient = force_field_energy(coords, terms, pairs, restraint_k, restrained)
+        return energies["total"], gradient[movable].ravel()
+
+    steps, converged = 0, False
+    start = time.perf_counter()
+    while steps < max_steps and movable.any():
+        list_coords = coords.copy()
+        result = minimize(objective, coords[movable].ravel(), args=(pairs,), jac=True, method="L-BFGS-B",
+                          options={"maxiter": max_steps - steps, "gtol": tolerance})
+        coords[movable] = result.x.reshape(-1, 3)
+        steps += max(result.nit, 1)
+        moved = np.max(np.linalg.norm(coords - list_coords, axis=1))
+        pairs = neighbor_pairs(coords, terms, cutoff)
+        if moved < skin / 2:
+            converged = bool(result.success)
+            break
+
+    final, gradient = force_field_energy(coords, terms, pairs, restraint_k, restrained)
+    minimized = structure.subset(np.arange(len(structure)))
+    minimized.coords = coords
+    report = {
+        "structure": structure.name,
+        "mode": mode,
+        "atoms": len(structure),
+        "initial_energy": initial["total"],
+        "final_energy": final["total"],
+        "clash_energy": final["clash"],
+        "steps": steps,
+        "converged": converged,
+        "max_gradient": float(np.abs(gradient[movable]).max()) if movable.any() else 0.0,
+        "heavy_rmsd": float(np.sqrt(np.mean(np.sum((coords[heavy] - structure.coords[heavy]) ** 2, axis=1)))),
+        "all_rmsd": float(np.sqrt(np.mean(np.sum((coords - structure.coords) ** 2, axis=1)))),
+        "seconds": time.perf_counter() - start,
+    }
+    return minimized, report
+
+
+def minimize_pdb(input_pdb, output_pdb, mode="hydrogens", max_steps=500, tolerance=0.1, pH=7.4):
+    """
+    Minimize a PDB file and save the result. Structures without hydrogens are
+    protonated first with the template engine of protonation.py.
+
+    Returns:
+    - dict: minimization report, see minimize_structure.
+    """
+    structure = read_pdb_arrays(input_pdb)
+    if not np.any(structure.element == "H"):
+        structure = protonate(structure, pH)
+    minimized, report = minimize_structure(structure, mode, max_steps, tolerance)
+    write_pdb(minimized, output_pdb)
+    return report
+
+
+def minimization_report(input_directory, modes=("hydrogens", "restrained"), max_steps=500, tolerance=0.1, pH=7.4):
+    """
+    Minimize every PDB file of a directory in each mode and report the energies,
+    steps and RMSD to the starting coordinates.
+
+    Args:
+    - input_directory (str): Path to the directory containing PDB files, e.g. output_pdb_files.
+    - modes (tuple): minimization modes to compare, see MINIMIZATION_MODES.
+    - max_steps (int): maximum number of L-BFGS iterations.
+    - tolerance (float): convergence criterion on the largest gradient component (kcal/mol/A).
+    - pH (float): pH value for protonation (default is 7.4).
+
+    Returns:
+    - pd.DataFrame: one row per structure and mode.
+    """
+    rows = []
+    for filename in sorted(os.listdir(input_directory)):
+        if filename.endswith(".pdb"):
+            try:
+                structure = protonate(read_pdb_arrays(os.path.join(input_directory, filename)), pH)
+                for mode in modes:
+                    _, report = minimize_structure(structure, mode, max_steps, tolerance)
+                    rows.append(report)
+                    print(f"{filename} ({mode}): {report['initial_energy']:.1f} -> {report['final_energy']:.1f} kcal/mol "
+                          f"in {report['steps']} steps, heavy RMSD {report['heavy_rmsd']:.3f} A, {report['seconds']:.1f} s")
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    report = minimization_report(os.path.join(current_directory, "output_pdb_files"))
+    print(report.to_string(index=False))
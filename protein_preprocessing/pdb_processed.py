@@ -1,84 +1,124 @@
-import os, pymol
-import __main__
+import os
+import shutil
+from grid_box.ligand_sites import ligand_grid_boxes, write_pocket_configs
+from protein_preprocessing.atom_typing import prepare_receptor_pdbqt
+from protein_preprocessing.ligand_prep import DEFAULT_CACHE, prepare_ligands
+from protein_preprocessing.protonation import protonate_pdb
+from structure.filters import filter_pdb
+from structure.pdb_arrays import read_pdb_arrays
+from structure.triage import routed_files, triage_directory
 
-def pdb_processed(input_path, output_directory, pH = 7.4):
+def pdb_processed(input_path, output_directory, pH = 7.4, native_protonation=False, cache_directory=DEFAULT_CACHE):
     """
     Process experimental PDB files in the input directory:
+    - Skip the files without protein or ligand and the oversized ones after one scan
+      of the directory (see structure/triage.py)
     - Identify the ligand and its center of mass for further use as grid coordinate
     - Remove non-protein atoms, protonate at pH 7.4 and convert to pdbqt
-    - Save the ligand file in PDBQT format
-    - The grid coordinate and the smile format are save in config.txt
+    - Save the ligand file in PDBQT format, each unique ligand of the batch is prepared
+      once and cached by InChIKey (see ligand_prep.py)
+    - The grid coordinates are saved as one Vina config file per ligand pocket, each
+      referring to the ligand of its pocket ({pdb_id}_ligand.pdbqt, or {pdb_id}_{ligand_id}_ligand.pdbqt
+      for several ligands), the canonical smile format in the matching .smi file
     - Save modified files in the output directory.
     
     Args:
     - input_path (str): Path to the directory containing PDB files.
     - output_directory (str): Path to the directory for saving modified PDB files.
     - protonate pH, 7.4 by default.
+    - native_protonation (bool): protonate with the template engine of protonation.py instead of obabel.
+    - cache_directory (str): Path to the prepared ligands shared across runs.
     """
-    __main__.pymol_argv = ['pymol', '-qc']  # Quiet and no GUI
-    # Initialize PyMOL
-    pymol.finish_launching()
-
-    # Loop over all files in the input directory
-    for filename in os.listdir(input_path):
-        if filename.endswith(".pdb"):
-            try:
-                # Load the PDB file
-                pdb_file_path = os.path.join(input_path, filename)
-                # Remove the .pdb extension to create a valid object name
-                object_name = os.path.splitext(filename)[0]
-                pymol.cmd.load(pdb_file_path, object_name)
-
-                # Select the ligand and calculate its center of mass
-                pymol.cmd.select("ligand", "organic")
-                center_of_mass = pymol.cmd.centerofmass("ligand")
-                
-                # Save the coordinates of the ligand's center of mass to a text file
-                output_config_path = os.path.join(output_directory, "config.txt")
-                with open(output_config_path, "w") as config_file:
-                    config_file.write(f"Protein PDB-ID: {filename[:-4]}\n")
-                    config_file.write("Grid box coordinates by center of mass of its true ligand:\n")
-                    config_file.write("X: {:.3f}\n".format(center_of_mass[0]))
-                    config_file.write("Y: {:.3f}\n".format(center_of_mass[1]))
-                    config_file.write("Z: {:.3f}\n".format(center_of_mass[2]))
-
-                    # Convert the ligand to PDBQT format
-                    ligand_pdb = os.path.join(output_directory, "ligand.pdb")
-                    pymol.cmd.save(ligand_pdb, "ligand", format="pdb")
-                    output_pdbqt = os.path.join(output_directory, "ligand.pdbqt")
-                    os.system(f"obabel {ligand_pdb} -opdbqt -xr -O {output_pdbqt}")
-
-                    # Obtain the SMILES representation of the ligand
-                    output_smi = os.path.join(output_directory, "ligand.smi")
-                    os.system(f"obabel {ligand_pdb} -osmi -O {output_smi} --gen3d -h")
-                    with open(output_smi, "r") as smi_file:
-                        smiles = smi_file.read().strip()
-                    config_file.write("SMILES: {}\n".format(smiles))
-
-                # Remove non-protein atoms
-                pymol.cmd.remove("not polymer.protein")
-
-                # Save the pdb structure without non-protein molecules
-                output_filename_rmnpm = os.path.splitext(filename)[0] + "_rmnpm.pdb"
-                output_file_path_rmnpm = os.path.join(output_directory, output_filename_rmnpm)
-                pymol.cmd.save(output_file_path_rmnpm, format="pdb")
-
-                output_filename_protonated = os.path.splitext(filename)[0] + "_protonated.pdb"
-                output_file_path_protonated = os.path.join(output_directory, output_filename_protonated)
-                # Run the command to protonate at pH 7.4, save in pdbqt
+    # Scan the files once before loading any of them: files without protein or ligand and oversized ones are skipped
+    report = triage_directory(input_path)
+    ligand_targets = []
+    # Loop over the files with a ligand
+    for pdb_file_path in routed_files(report, input_path):
+        filename = os.path.basename(pdb_file_path)
+        try:
+            object_name = os.path.splitext(filename)[0]
+
+            # One grid box per ligand instance, saved as one Vina config file per pocket
+            structure = read_pdb_arrays(pdb_file_path)
+            boxes = ligand_grid_boxes(structure)
+            write_pocket_configs(boxes, output_directory, object_name, ligand_per_pocket=True)
+
+            # Save the ligand, its PDBQT and SMILES are prepared for the whole batch after the loop
+            ligand_pdb = os.path.join(output_directory, f"{object_name}_ligand.pdb")
+            filter_pdb(pdb_file_path, ligand_pdb, protein=False, organic=True)
+            ligand_targets.append((object_name, structure, None))
+
+            # Save the pdb structure without non-protein molecules
+            output_filename_rmnpm = os.path.splitext(filename)[0] + "_rmnpm.pdb"
+            output_file_path_rmnpm = os.path.join(output_directory, output_filename_rmnpm)
+            filter_pdb(pdb_file_path, output_file_path_rmnpm)
+
+            output_filename_protonated = os.path.splitext(filename)[0] + "_protonated.pdb"
+            output_file_path_protonated = os.path.join(output_directory, output_filename_protonated)
+            # Protonate at pH 7.4, save in pdb
+            if native_protonation:
+                protonate_pdb(output_file_path_rmnpm, output_file_path_protonated, pH)
+            else:
                 os.system(f"obabel {output_file_path_rmnpm} -opdb -h -p {pH} -O {output_file_path_protonated}")
 
-                # Save the final processed file in pdbqt format 
-                output_filename_processed = os.path.splitext(filename)[0] + "_processed.pdbqt"
-                output_file_path_processed = os.path.join(output_directory, output_filename_processed)
-                os.system(f"obabel {output_file_path_protonated} -opdbqt -xr -O {output_file_path_processed}")
+            # Save the final processed file in pdbqt format 
+            output_filename_processed = os.path.splitext(filename)[0] + "_processed.pdbqt"
+            output_file_path_processed = os.path.join(output_directory, output_filename_processed)
+            os.system(f"obabel {output_file_path_protonated} -opdbqt -xr -O {output_file_path_processed}")
+
+            print(f"Processed {filename}. Output saved to {output_file_path_processed}")
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+
+    # Prepare every unique ligand of the batch once, cached by InChIKey
+    try:
+        prepare_ligands(ligand_targets, output_directory, cache_directory)
+    except Exception as e:
+        print(f"Error preparing the ligands: {e}")
+
+
+def prepare_structure(pdb_path, output_directory, pH=7.4, resn=None, target=None, cache_directory=DEFAULT_CACHE,
+                      progress=None):
+    """
+    Prepare one structure for docking without PyMOL or the obabel receptor steps:
+    one Vina config per ligand pocket, the ligand PDB (and its PDBQT/SMILES from the
+    ligand cache when obabel is installed) and the protonated receptor PDBQT.
+
+    Args:
+    - pdb_path (str): Path to the PDB file.
+    - output_directory (str): Path to the directory for saving the prepared files.
+    - pH (float): protonation pH, 7.4 by default.
+    - resn (str, optional): residue name of the ligand, e.g. from fetch_ligand_name; every organic ligand by default.
+    - target (str, optional): prefix of the output files, the PDB file name by default.
+    - cache_directory (str): Path to the prepared ligands shared across runs.
+    - progress (callable, optional): called with the name of every step.
+
+    Returns:
+    - list of str: paths of the prepared files.
+    """
+    progress = progress or (lambda step: None)
+    target = target or os.path.splitext(os.path.basename(pdb_path))[0]
+    os.makedirs(output_directory, exist_ok=True)
+    structure = read_pdb_arrays(pdb_path)
 
-                print(f"Processed {filename}. Output saved to {output_file_path_processed}")
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
+    # One grid box per instance of the annotated ligand, or of every organic ligand
+    boxes = ligand_grid_boxes(structure, resn=resn)
+    if not boxes:
+        raise ValueError(f"ligand {resn} not found in {target}" if resn else f"no ligand found in {target}")
+    paths = write_pocket_configs(boxes, output_directory, target, receptor=f"{target}_processed.pdbqt",
+                                 ligand_per_pocket=True)
+    paths.append(filter_pdb(pdb_path, os.path.join(output_directory, f"{target}_ligand.pdb"), protein=False,
+                            organic=resn is None, ligands=[resn] if resn else None))
+    if shutil.which("obabel"):
+        for record in prepare_ligands([(target, structure, resn)], output_directory, cache_directory).get(target, []):
+            paths += record["files"]
 
-    # Quit PyMOL
-    pymol.cmd.quit()
+    # Remove non-protein atoms, protonate and write the rigid receptor
+    progress("receptor")
+    rmnpm_pdb = filter_pdb(pdb_path, os.path.join(output_directory, f"{target}_rmnpm.pdb"))
+    protonated_pdb = protonate_pdb(rmnpm_pdb, os.path.join(output_directory, f"{target}_protonated.pdb"), pH)
+    processed_pdbqt = prepare_receptor_pdbqt(protonated_pdb, os.path.join(output_directory, f"{target}_processed.pdbqt"))
+    return paths + [rmnpm_pdb, protonated_pdb, processed_pdbqt]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from structure.bonds import bond_graph
+from structure.pdb_arrays import parse_pdb_arrays, pdb_atom_name, read_pdb_arrays
+
+# Same layout as the rigid receptor PDBQT written by `obabel -opdbqt -xr`
+PDBQT_HEADER = (
+    "REMARK  Name = {name}\n"
+    "REMARK                            x       y       z     vdW  Elec       q    Type\n"
+    "REMARK                         _______ _______ _______ _____ _____    ______ ____\n"
+)
+PDBQT_ATOM = "{:<6}{:>5} {:<4}{:1}{:>3} {:1}{:>4}{:1}   {:8.3f}{:8.3f}{:8.3f}  0.00  0.00    {:+6.3f} {:<2}\n"
+
+# Element of each AutoDock atom type, used when reading PDBQT files back
+AUTODOCK_TYPE_ELEMENT = {"A": "C", "NA": "N", "NS": "N", "OA": "O", "OS": "O", "SA": "S", "HD": "H", "HS": "H"}
+
+
+def write_pdbqt(structure, pdbqt_path, atom_types, charges, name=None, chunk_size=50000):
+    """
+    Write a rigid receptor PDBQT file from atom arrays in one buffered streaming pass.
+
+    The atoms are formatted chunk by chunk and every chunk is written with a single
+    call, so memory stays bounded for very large receptors.
+
+    Args:
+    - structure (Structure): receptor atoms, see structure.pdb_arrays. Non-polar
+                             hydrogens are expected to be merged already.
+    - pdbqt_path (str): Path of the output PDBQT file.
+    - atom_types (np.ndarray): AutoDock atom type per atom, e.g. C, A, N, NA, OA, SA, HD.
+    - charges (np.ndarray): partial charge per atom.
+    - name (str, optional): source written in the REMARK Name line, the structure name by default.
+    - chunk_size (int): atoms formatted per write call.
+
+    Returns:
+    - str: pdbqt_path
+    """
+    if not (len(structure) == len(atom_types) == len(charges)):
+        raise ValueError("atom_types and charges must have one entry per atom")
+
+    serial = np.arange(1, len(structure) + 1)
+    # Atom names in the 4-column layout of the PDB format
+    names = [pdb_atom_name(atom_name, element) for atom_name, element in zip(structure.atom_name, structure.element)]
+    x, y, z = structure.coords[:, 0].tolist(), structure.coords[:, 1].tolist(), structure.coords[:, 2].tolist()
+    charges = np.asarray(charges, dtype=float).tolist()
+
+    with open(pdbqt_path, "w", buffering=1 << 20) as pdbqt_file:
+        pdbqt_file.write(PDBQT_HEADER.format(name=name or structure.name))
+        for start in range(0, len(structure), chunk_size):
+            stop = min(start + chunk_size, len(structure))
+            pdbqt_file.write("".join(
+                PDBQT_ATOM.format(
+                    structure.record[i], serial[i], names[i], structure.altloc[i], structure.resn[i],
+                    structure.chain[i], structure.resi[i], structure.icode[i], x[i], y[i], z[i],
+                    charges[i], atom_types[i],
+                )
+                for i in range(start, stop)
+            ))
+        pdbqt_file.write("TER \n")
+    return pdbqt_path
+
+
+def read_pdbqt(pdbqt_path):
+    """
+    Read the atoms of a PDBQT file.
+
+    Returns:
+    - (Structure, np.ndarray, np.ndarray): atoms, AutoDock atom types and partial charges.
+    """
+    with open(pdbqt_path, "rb") as pdbqt_file:
+        lines = [line for line in pdbqt_file.read().splitlines() if line.startswith((b"ATOM  ", b"HETATM"))]
+    name = os.path.splitext(os.path.basename(pdbqt_path))[0]
+    structure = parse_pdb_arrays(b"\n".join(lines), name=name)
+    atom_types = np.array([line[77:79].decode().strip() for line in lines])
+    charges = np.array([float(line[70:76] or 0) for line in lines])
+    structure.element = np.array(
+        [AUTODOCK_TYPE_ELEMENT.get(atom_type, atom_type.upper()) for atom_type in atom_types], dtype="U2"
+    )
+    return structure, atom_types, charges
+
+
+def compare_with_obabel(native_pdbqt_path, obabel_pdbqt_path, charge_tolerance=0.001):
+    """
+    Compare a native receptor PDBQT (see atom_typing.prepare_receptor_pdbqt) with the
+    one obabel converted from the same PDB file, field by field.
+
+    Atoms are matched by position: obabel restarts the serial numbers for every
+    disconnected fragment, so the serial column is not compared.
+
+    Args:
+    - native_pdbqt_path (str): PDBQT written by write_pdbqt.
+    - obabel_pdbqt_path (str): PDBQT written by `obabel -opdbqt -xr`.
+    - charge_tolerance (float): largest charge difference counted as equal, 0.001 e by default.
+
+    Returns:
+    - dict: number of obabel atoms, of atoms without a partner in the other file, and of
+            matched atoms whose atom name, residue (name, chain, number), type or charge differ.
+
+    Raises:
+    - ValueError: if a file is missing or has no atom records.
+    """
+    for path in (native_pdbqt_path, obabel_pdbqt_path):
+        if not os.path.isfile(path):
+            raise ValueError(f"{path} is missing")
+        if os.path.getsize(path) == 0:
+            raise ValueError(f"{path} is empty")
+    native, native_types, native_charges = read_pdbqt(native_pdbqt_path)
+    reference, reference_types, reference_charges = read_pdbqt(obabel_pdbqt_path)
+
+    distances, partner = cKDTree(native.coords).query(reference.coords)
+    matched = distances < 0.01
+    ref, nat = np.flatnonzero(matched), partner[matched]
+    residue = ((native.resn[nat] != reference.resn[ref]) | (native.chain[nat] != reference.chain[ref])
+               | (native.resi[nat] != reference.resi[ref]))
+    return {
+        "atoms": len(reference),
+        "unmatched": int(len(reference) - len(ref) + len(native) - len(np.unique(nat))),
+        "atom_name": int(np.count_nonzero(native.atom_name[nat] != reference.atom_name[ref])),
+        "residue": int(np.count_nonzero(residue)),
+        "type": int(np.count_nonzero(native_types[nat] != reference_types[ref])),
+        "charge": int(np.count_nonzero(np.abs(native_charges[nat] - reference_charges[ref]) > charge_tolerance)),
+    }
+
+
+def benchmark_pdbqt_writer(pdbqt_directory, repeats=5):
+    """
+    Compare the throughput of write_pdbqt with the `obabel -opdbqt -xr` shell-out
+    on the receptors of a directory, and compare the native atom types and charges
+    (atom_typing) with the obabel PDBQT, see compare_with_obabel.
+
+    Args:
+    - pdbqt_directory (str): Directory with the `*_minimized.pdb` files and the
+                             `*_protein.pdbqt` files obabel converted them to.
+    - repeats (int): number of timed native writes per file.
+
+    Returns:
+    - list of dict: per receptor the atom count, the mismatches per field and the atoms/second
+                    of both paths, or the error for an empty or missing file.
+    """
+    # atom_typing imports write_pdbqt, so import it here to avoid a circular import
+    from protein_preprocessing.atom_typing import autodock_types, gasteiger_charges, merge_nonpolar_hydrogens
+
+    obabel = shutil.which("obabel")
+    results = []
+    for filename in sorted(os.listdir(pdbqt_directory)):
+        if not filename.endswith("_minimized.pdb"):
+            continue
+        minimized_pdb = os.path.join(pdbqt_directory, filename)
+        pdbqt_path = minimized_pdb.replace("_minimized.pdb", "_protein.pdbqt")
+        receptor = os.path.basename(pdbqt_path)
+        try:
+            if os.path.getsize(minimized_pdb) == 0:
+                raise ValueError(f"{minimized_pdb} is empty")
+            structure = read_pdb_arrays(minimized_pdb)
+            bonds = bond_graph(structure)
+            structure, atom_types, charges = merge_nonpolar_hydrogens(
+                structure, autodock_types(structure, bonds), gasteiger_charges(structure, bonds), bonds)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                native_path = os.path.join(tmp, receptor)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    write_pdbqt(structure, native_path, atom_types, charges)
+                native_rate = repeats * len(structure) / (time.perf_counter() - start)
+
+                obabel_rate = None
+                if obabel:
+                    start = time.perf_counter()
+                    subprocess.run([obabel, minimized_pdb, "-opdbqt", "-xr", "-O", os.path.join(tmp, "obabel.pdbqt")],
+                                   capture_output=True)
+                    obabel_rate = len(structure) / (time.perf_counter() - start)
+
+                mismatches = compare_with_obabel(native_path, pdbqt_path)
+        except ValueError as e:
+            print(f"Error processing {receptor}: {e}")
+            results.append({"receptor": receptor, "error": str(e)})
+            continue
+
+        results.append({"receptor": receptor, **mismatches,
+                        "native_atoms_per_s": native_rate, "obabel_atoms_per_s": obabel_rate})
+        speedup = f", {native_rate / obabel_rate:.0f}x obabel" if obabel_rate else ""
+        differ = ", ".join(f"{field} {mismatches[field]}" for field in ("unmatched", "atom_name", "residue", "type", "charge"))
+        print(f"{receptor}: {len(structure)} atoms, differing from obabel: {differ}, {native_rate:,.0f} atoms/s{speedup}")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_pdbqt_writer(os.path.join(os.getcwd(), "output_files"))
@@ -1,7 +1,12 @@
-import os, pymol
-import __main__
+import os
 import requests
 from bs4 import BeautifulSoup
+from grid_box.ligand_sites import ligand_grid_boxes, write_pocket_configs
+from protein_preprocessing.ligand_prep import DEFAULT_CACHE, prepare_ligands
+from structure.filters import filter_pdb
+from structure.pdb_arrays import read_pdb_arrays
+from structure.pdb_header import header_table
+from structure.triage import routed_files, triage_directory
 #from fetch_rcsb import fetch_ligand_name
 
 def fetch_ligand_name(pdb_id):
@@ -46,13 +51,17 @@ def fetch_ligand_name(pdb_id):
         else:
             return None
 
-def crystal_processing(input_path, output_directory, pH = 7.4):
+def crystal_processing(input_path, output_directory, pH = 7.4, cache_directory=DEFAULT_CACHE):
     """
     Process experimental PDB files (in holo format) in the input directory:
+    - Skip the apo entries (no HET group in the header, see structure/pdb_header.py, or no
+      ligand annotation), the files without protein or without their annotated
+      ligand and the oversized ones before loading any of them (see structure/triage.py)
     - Identify the ligand and its center of mass for further use as grid coordinate
     - Remove non-protein atoms, protonate at pH 7.4 and convert to pdbqt
-    - Save the ligand file in PDBQT format
-    - The grid coordinate and the smile format are save in config.txt
+    - Save the ligand file in PDBQT format, each unique ligand of the batch is prepared
+      once and cached by InChIKey (see ligand_prep.py)
+    - The grid coordinate is saved in one Vina config file per ligand pocket
     - Save modified files in the output directory.
     
     Args:
@@ -61,82 +70,77 @@ def crystal_processing(input_path, output_directory, pH = 7.4):
     - output_directory (str): Path to the directory for saving modified PDB files.
     - ligand_name (str): uppercase of 3-letter ligand name, used in RCSB
     - protonate pH, 7.4 by default.
+    - cache_directory (str): Path to the prepared ligands shared across runs.
     """
-    __main__.pymol_argv = ['pymol', '-qc']
-    pymol.finish_launching()
+    # Entries whose header lists no HET group have no ligand to annotate: their RCSB page is not fetched
+    headers = header_table(input_path).set_index("target")
+    without_het = set(headers.index[headers["idcode"].notna() & (headers["ligands"] == "")])
 
-    # Loop over all files in the input directory
-    for filename in os.listdir(input_path):
+    # Fetch the annotated ligand of every entry, apo entries (no annotation) are skipped
+    ligand_names = {}
+    for filename in sorted(os.listdir(input_path)):
         if filename.endswith(".pdb"):
+            if os.path.splitext(filename)[0] in without_het:
+                ligand_names[os.path.splitext(filename)[0]] = None
+                continue
             try:
-                # Load the PDB file
-                pdb_file_path = os.path.join(input_path, filename)
-                object_name = os.path.splitext(filename)[0]
-                pymol.cmd.load(pdb_file_path, object_name)
-
-                # Fetch the ligand name
-                ligand = fetch_ligand_name(filename[0:4])
-                pymol.cmd.select("ligand", f"resn {ligand}")
-                center_of_mass = pymol.cmd.centerofmass("ligand")
-
-                # Calculate the ligand diameter and grid size
-                atom_names = [atom.name for atom in pymol.cmd.get_model("ligand").atom]
-                max_distance = 0
-                for i, atom_name1 in enumerate(atom_names):
-                    for atom_name2 in atom_names[i+1:]:
-                        distance = pymol.cmd.distance(f'{atom_name1}_to_{atom_name2}',
-                                                      f'resname {ligand} and name {atom_name1}',
-                                                      f'resname {ligand} and name {atom_name2}')
-                        max_distance = max(max_distance, distance)
-                diameter = round(max_distance)
-                size = round(16 + 0.8*diameter)
-
-                ## Process ligand
-                ligand_filename_pdb = os.path.splitext(filename)[0] + "_ligand.pdb"
-                ligand_pdb = os.path.join(output_directory, ligand_filename_pdb)
-                pymol.cmd.save(ligand_pdb, "ligand", format="pdb")
-                ligand_filename_pdbqt = os.path.splitext(filename)[0] + "_ligand.pdbqt"
-                output_pdbqt = os.path.join(output_directory, ligand_filename_pdbqt)
-                ligand_filename_smi = os.path.splitext(filename)[0] + "_ligand.smi"
-                output_smi = os.path.join(output_directory, ligand_filename_smi)
-                # add gastaiger charges, set TORDOF, convert to pdbqt and smi
-                os.system(f"obabel {ligand_pdb} -O {output_pdbqt} --gen3d -p TORDOF --partialcharge gasteiger")
-
-                ## Process protein
-                # remove non-protein molecules
-                pymol.cmd.remove("not polymer.protein")
-                output_filename_rmnpm = os.path.splitext(filename)[0] + "_rmnpm.pdb"
-                output_file_path_rmnpm = os.path.join(output_directory, output_filename_rmnpm)
-                pymol.cmd.save(output_file_path_rmnpm, format="pdb")
-                # protonate at pH 7.4 by default,use for partial charges (eem is Bultnck B3LYP/6-13G*/MPA)
-                output_filename_protonated = os.path.splitext(filename)[0] + "_protonated.pdb"
-                output_file_path_protonated = os.path.join(output_directory, output_filename_protonated)
-                os.system(f"obabel {output_file_path_rmnpm} -opdb -p {pH} -partialcharge eem -O {output_file_path_protonated}")
-                # convert to pdbqt file
-                output_filename_processed = os.path.splitext(filename)[0] + "_processed.pdbqt"
-                output_file_path_processed = os.path.join(output_directory, output_filename_processed)
-                os.system(f"obabel {output_file_path_protonated} -opdbqt -xr -O {output_file_path_processed}")
-
-                # Write config.txt file
-                config_filename = os.path.splitext(filename)[0] + "_config.txt"
-                output_config_path = os.path.join(output_directory, config_filename)
-                with open(output_config_path, "w") as config_file:
-                    config_file.write(f"receptor = {filename[:-4]}.pdbqt\n")
-                    config_file.write(f"ligand = ligand.pdbqt\n")
-                    config_file.write("center_x = {:.3f}\n".format(center_of_mass[0]))
-                    config_file.write("center_y = {:.3f}\n".format(center_of_mass[1]))
-                    config_file.write("center_z = {:.3f}\n".format(center_of_mass[2]))
-                    config_file.write("\n")
-                    config_file.write("size_x = {:.3f}\n".format(size))
-                    config_file.write("size_y = {:.3f}\n".format(size))
-                    config_file.write("size_z = {:.3f}\n".format(size))
-
-                print(f"Processed {filename}. Output saved to {output_file_path_processed}")
+                ligand_names[os.path.splitext(filename)[0]] = fetch_ligand_name(filename[0:4])
             except Exception as e:
-                print(f"Error processing {filename}: {e}")
-
-    # Quit PyMOL
-    pymol.cmd.quit()
+                print(f"Error fetching the ligand name of {filename}: {e}")
+    for object_name, ligand in ligand_names.items():
+        if ligand is None:
+            print(f"Skipped {object_name}: no ligand annotation (apo entry)")
+
+    # Scan the files once before loading any of them: no protein, missing ligand or oversized files are skipped
+    report = triage_directory(input_path, resn={name: ligand for name, ligand in ligand_names.items() if ligand})
+    ligand_targets = []
+    # Loop over the files containing their annotated ligand
+    for pdb_file_path in routed_files(report, input_path):
+        filename = os.path.basename(pdb_file_path)
+        object_name = os.path.splitext(filename)[0]
+        if ligand_names.get(object_name) is None:
+            continue
+        try:
+            # One grid box per instance of the annotated ligand
+            ligand = ligand_names[object_name]
+            structure = read_pdb_arrays(pdb_file_path)
+            boxes = ligand_grid_boxes(structure, resn=ligand)
+            if not boxes:
+                raise ValueError(f"ligand {ligand} not found in {filename}")
+
+            ## Process ligand
+            ligand_filename_pdb = os.path.splitext(filename)[0] + "_ligand.pdb"
+            ligand_pdb = os.path.join(output_directory, ligand_filename_pdb)
+            filter_pdb(pdb_file_path, ligand_pdb, protein=False, ligands=[ligand])
+            # The PDBQT and SMILES are prepared for the whole batch after the loop
+            ligand_targets.append((object_name, structure, ligand))
+
+            ## Process protein
+            # remove non-protein molecules
+            output_filename_rmnpm = os.path.splitext(filename)[0] + "_rmnpm.pdb"
+            output_file_path_rmnpm = os.path.join(output_directory, output_filename_rmnpm)
+            filter_pdb(pdb_file_path, output_file_path_rmnpm)
+            # protonate at pH 7.4 by default,use for partial charges (eem is Bultnck B3LYP/6-13G*/MPA)
+            output_filename_protonated = os.path.splitext(filename)[0] + "_protonated.pdb"
+            output_file_path_protonated = os.path.join(output_directory, output_filename_protonated)
+            os.system(f"obabel {output_file_path_rmnpm} -opdb -p {pH} -partialcharge eem -O {output_file_path_protonated}")
+            # convert to pdbqt file
+            output_filename_processed = os.path.splitext(filename)[0] + "_processed.pdbqt"
+            output_file_path_processed = os.path.join(output_directory, output_filename_processed)
+            os.system(f"obabel {output_file_path_protonated} -opdbqt -xr -O {output_file_path_processed}")
+
+            # Write one config file per ligand pocket, referring to the ligand file of the pocket
+            write_pocket_configs(boxes, output_directory, object_name, ligand_per_pocket=True)
+
+            print(f"Processed {filename}. Output saved to {output_file_path_processed}")
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+
+    # Prepare every unique ligand of the batch once: 3D conformer, Gasteiger charges, PDBQT and SMILES
+    try:
+        prepare_ligands(ligand_targets, output_directory, cache_directory)
+    except Exception as e:
+        print(f"Error preparing the ligands: {e}")
 
 if __name__ == "__main__":
     input_path = "/home/nauevech/Documents/protein_preparation/protein_preparation/protein_preprocessing/input/"
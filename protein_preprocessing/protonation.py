@@ -0,0 +1,501 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from structure.pdb_arrays import concatenate_structures, read_pdb_arrays, residue_index, write_pdb
+
+# pKa of the titratable groups: a group carries its extra proton when pH < pKa
+PKA_TABLE = {
+    "ASP": 3.9,
+    "GLU": 4.2,
+    "HIS": 6.0,
+    "CYS": 8.3,
+    "TYR": 10.1,
+    "LYS": 10.5,
+    "ARG": 12.5,
+    "N_TERMINUS": 8.0,
+    "C_TERMINUS": 3.1,
+}
+
+# Formal charge of the titratable atom of each group: (atom, protonated, deprotonated)
+FORMAL_CHARGES = {
+    "ASP": ("OD2", "", "1-"),
+    "GLU": ("OE2", "", "1-"),
+    "HIS": ("ND1", "1+", ""),
+    "CYS": ("SG", "", "1-"),
+    "TYR": ("OH", "", "1-"),
+    "LYS": ("NZ", "1+", ""),
+    "ARG": ("NH2", "1+", ""),
+    "N_TERMINUS": ("N", "1+", ""),
+    "C_TERMINUS": ("OXT", "", "1-"),
+}
+
+# X-H bond lengths (Angstrom) by parent element
+BOND_LENGTH = {"C": 1.09, "N": 1.01, "O": 0.96, "S": 1.34}
+
+# Geometries: "planar" (1 H in the plane of 2 neighbors), "tetrahedral" (1 H, 3 neighbors),
+# "methylene" (2 H, 2 neighbors) or ("rotor", angle, dihedrals) for terminal groups,
+# where each H is placed at `angle` from the first reference and at a dihedral
+# from the second one (staggered methyl, hydroxyl, amide NH2, ...).
+METHYL = ("rotor", 109.5, (180.0, 60.0, -60.0))
+HYDROXYL = ("rotor", 109.5, (180.0,))
+AMIDE = ("rotor", 120.0, (0.0, 180.0))
+
+# Hydrogen templates of the standard residues:
+# (hydrogen names, parent atom, reference atoms, geometry, state)
+# state is None (always present), "protonated" or "deprotonated" for titratable groups.
+BACKBONE_TEMPLATE = [
+    (("HA",), "CA", ("N", "C", "CB"), "tetrahedral", None),
+]
+SIDECHAIN_TEMPLATES = {
+    "ALA": [(("HB1", "HB2", "HB3"), "CB", ("CA", "N"), METHYL, None)],
+    "ARG": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "CD"), "methylene", None),
+        (("HD2", "HD3"), "CD", ("CG", "NE"), "methylene", None),
+        (("HE",), "NE", ("CD", "CZ"), "planar", None),
+        (("HH11", "HH12"), "NH1", ("CZ", "NE"), AMIDE, None),
+        (("HH21",), "NH2", ("CZ", "NE"), ("rotor", 120.0, (0.0,)), None),
+        (("HH22",), "NH2", ("CZ", "NE"), ("rotor", 120.0, (180.0,)), "protonated"),
+    ],
+    "ASN": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD21", "HD22"), "ND2", ("CG", "OD1"), AMIDE, None),
+    ],
+    "ASP": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD2",), "OD2", ("CG", "OD1"), ("rotor", 109.5, (0.0,)), "protonated"),
+    ],
+    "CYS": [
+        (("HB2", "HB3"), "CB", ("CA", "SG"), "methylene", None),
+        (("HG",), "SG", ("CB", "CA"), ("rotor", 96.0, (180.0,)), "protonated"),
+    ],
+    "GLN": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "CD"), "methylene", None),
+        (("HE21", "HE22"), "NE2", ("CD", "OE1"), AMIDE, None),
+    ],
+    "GLU": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "CD"), "methylene", None),
+        (("HE2",), "OE2", ("CD", "OE1"), ("rotor", 109.5, (0.0,)), "protonated"),
+    ],
+    "GLY": [],
+    "HIS": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD1",), "ND1", ("CG", "CE1"), "planar", "protonated"),
+        (("HD2",), "CD2", ("CG", "NE2"), "planar", None),
+        (("HE1",), "CE1", ("ND1", "NE2"), "planar", None),
+        (("HE2",), "NE2", ("CD2", "CE1"), "planar", None),
+    ],
+    "ILE": [
+        (("HB",), "CB", ("CA", "CG1", "CG2"), "tetrahedral", None),
+        (("HG12", "HG13"), "CG1", ("CB", "CD1"), "methylene", None),
+        (("HG21", "HG22", "HG23"), "CG2", ("CB", "CA"), METHYL, None),
+        (("HD11", "HD12", "HD13"), "CD1", ("CG1", "CB"), METHYL, None),
+    ],
+    "LEU": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG",), "CG", ("CB", "CD1", "CD2"), "tetrahedral", None),
+        (("HD11", "HD12", "HD13"), "CD1", ("CG", "CB"), METHYL, None),
+        (("HD21", "HD22", "HD23"), "CD2", ("CG", "CB"), METHYL, None),
+    ],
+    "LYS": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "CD"), "methylene", None),
+        (("HD2", "HD3"), "CD", ("CG", "CE"), "methylene", None),
+        (("HE2", "HE3"), "CE", ("CD", "NZ"), "methylene", None),
+        (("HZ1", "HZ2", "HZ3"), "NZ", ("CE", "CD"), METHYL, "protonated"),
+        (("HZ1", "HZ2"), "NZ", ("CE", "CD"), ("rotor", 109.5, (180.0, 60.0)), "deprotonated"),
+    ],
+    "MET": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "SD"), "methylene", None),
+        (("HE1", "HE2", "HE3"), "CE", ("SD", "CG"), METHYL, None),
+    ],
+    "PHE": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD1",), "CD1", ("CG", "CE1"), "planar", None),
+        (("HD2",), "CD2", ("CG", "CE2"), "planar", None),
+        (("HE1",), "CE1", ("CD1", "CZ"), "planar", None),
+        (("HE2",), "CE2", ("CD2", "CZ"), "planar", None),
+        (("HZ",), "CZ", ("CE1", "CE2"), "planar", None),
+    ],
+    "PRO": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HG2", "HG3"), "CG", ("CB", "CD"), "methylene", None),
+        (("HD2", "HD3"), "CD", ("CG", "N"), "methylene", None),
+    ],
+    "SER": [
+        (("HB2", "HB3"), "CB", ("CA", "OG"), "methylene", None),
+        (("HG",), "OG", ("CB", "CA"), HYDROXYL, None),
+    ],
+    "THR": [
+        (("HB",), "CB", ("CA", "OG1", "CG2"), "tetrahedral", None),
+        (("HG1",), "OG1", ("CB", "CA"), HYDROXYL, None),
+        (("HG21", "HG22", "HG23"), "CG2", ("CB", "CA"), METHYL, None),
+    ],
+    "TRP": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD1",), "CD1", ("CG", "NE1"), "planar", None),
+        (("HE1",), "NE1", ("CD1", "CE2"), "planar", None),
+        (("HE3",), "CE3", ("CD2", "CZ3"), "planar", None),
+        (("HZ2",), "CZ2", ("CE2", "CH2"), "planar", None),
+        (("HZ3",), "CZ3", ("CE3", "CH2"), "planar", None),
+        (("HH2",), "CH2", ("CZ2", "CZ3"), "planar", None),
+    ],
+    "TYR": [
+        (("HB2", "HB3"), "CB", ("CA", "CG"), "methylene", None),
+        (("HD1",), "CD1", ("CG", "CE1"), "planar", None),
+        (("HD2",), "CD2", ("CG", "CE2"), "planar", None),
+        (("HE1",), "CE1", ("CD1", "CZ"), "planar", None),
+        (("HE2",), "CE2", ("CD2", "CZ"), "planar", None),
+        (("HH",), "OH", ("CZ", "CE1"), ("rotor", 109.5, (180.0,)), "protonated"),
+    ],
+    "VAL": [
+        (("HB",), "CB", ("CA", "CG1", "CG2"), "tetrahedral", None),
+        (("HG11", "HG12", "HG13"), "CG1", ("CB", "CA"), METHYL, None),
+        (("HG21", "HG22", "HG23"), "CG2", ("CB", "CA"), METHYL, None),
+    ],
+}
+GLYCINE_TEMPLATE = [(("HA2", "HA3"), "CA", ("N", "C"), "methylene", None)]
+
+# Termini, applied to the first/last residue of every chain segment
+N_TERMINUS_TEMPLATE = [
+    (("H1", "H2", "H3"), "N", ("CA", "C"), METHYL, "protonated"),
+    (("H1", "H2"), "N", ("CA", "C"), ("rotor", 109.5, (180.0, 60.0)), "deprotonated"),
+]
+N_TERMINUS_PRO_TEMPLATE = [
+    (("H2", "H3"), "N", ("CA", "CD"), "methylene", "protonated"),
+    (("H2",), "N", ("CA", "CD"), "planar", "deprotonated"),
+]
+C_TERMINUS_TEMPLATE = [
+    (("HXT",), "OXT", ("C", "O"), ("rotor", 109.5, (0.0,)), "protonated"),
+]
+
+
+def _unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _place(geometry, parent, refs, length):
+    """
+    Place the hydrogens of one geometry for all template entries and residues at once.
+
+    Args:
+    - geometry: template geometry, see SIDECHAIN_TEMPLATES.
+    - parent (np.ndarray): (R, 3) parent atom coordinates.
+    - refs (list of np.ndarray): (R, 3) coordinates of the reference atoms.
+    - length (np.ndarray): (R, 1) X-H bond lengths.
+
+    Returns:
+    - np.ndarray: (R, n_hydrogens, 3) hydrogen coordinates.
+    """
+    if geometry in ("planar", "tetrahedral"):
+        direction = _unit(sum(_unit(parent - ref) for ref in refs))
+        return (parent + length * direction)[:, None]
+
+    if geometry == "methylene":
+        b, c = refs
+        bisector = _unit(_unit(parent - b) + _unit(parent - c))
+        normal = _unit(np.cross(b - parent, c - parent))
+        half_angle = np.radians(109.5 / 2)
+        return np.stack([
+            parent + length * (np.cos(half_angle) * bisector + sign * np.sin(half_angle) * normal)
+            for sign in (1, -1)
+        ], axis=1)
+
+    # Rotor: natural extension reference frame from the two reference atoms
+    _, angle, dihedrals = geometry
+    b, c = refs
+    bc = _unit(parent - b)
+    normal = _unit(np.cross(b - c, bc))
+    frame = np.stack([bc, np.cross(normal, bc), normal], axis=1)
+    angle = np.radians(angle)
+    hydrogens = []
+    for dihedral in np.radians(dihedrals):
+        local = length * np.array([-np.cos(angle), np.sin(angle) * np.cos(dihedral), np.sin(angle) * np.sin(dihedral)])
+        hydrogens.append(parent + np.einsum("rj,rjk->rk", local, frame))
+    return np.stack(hydrogens, axis=1)
+
+
+def titration_states(pH, pka_table=PKA_TABLE):
+    """
+    Protonation state of every titratable group at a given pH.
+
+    Returns:
+    - dict: group name -> "protonated" or "deprotonated".
+    """
+    return {group: "protonated" if pH < pka else "deprotonated" for group, pka in pka_table.items()}
+
+
+def _atom_table(structure, rid, n_residues):
+    # For every atom name, the index of that atom in each residue (-1 if missing)
+    table = {}
+    for name in np.unique(structure.atom_name):
+        column = np.full(n_residues, -1)
+        members = np.where(structure.atom_name == name)[0]
+        # Reversed so that the first alternate location wins
+        column[rid[members[::-1]]] = members[::-1]
+        table[name] = column
+    return table
+
+
+def _missing(n_residues):
+    return np.full(n_residues, -1)
+
+
+def place_template_hydrogens(structure, pH=7.4, pka_table=PKA_TABLE):
+    """
+    Build the hydrogens of the standard amino acids from residue templates.
+
+    Every template entry is placed for all residues of its type in one vectorized
+    step. Titratable groups get their state from the pKa table, disulfide
+    cysteines lose HG, and chain termini get NH3+/COO- (or their neutral forms).
+    Each alternate location is protonated in its own conformation. The formal
+    charges of the titratable atoms are set to match their state.
+
+    Args:
+    - structure (Structure): heavy atoms of the protein, see structure.pdb_arrays.
+    - pH (float): pH value for protonation (default is 7.4).
+    - pka_table (dict): pKa per titratable group, PKA_TABLE by default.
+
+    Returns:
+    - (Structure, np.ndarray, np.ndarray): the hydrogens, the index of the parent atom
+                                           of each of them, and the formal charge column
+                                           of the heavy atoms.
+    """
+    states = titration_states(pH, pka_table)
+    charges = structure.charge.astype("U2")
+    altlocs = sorted(set(structure.altloc.tolist()) - {""}) or [""]
+    parts, part_parents = [], []
+    for k, altloc in enumerate(altlocs):
+        # Shared atoms plus one alternate location; shared hydrogens come from the first pass only
+        atoms = np.where((structure.altloc == "") | (structure.altloc == altloc))[0]
+        hydrogens, parents, atom_charges = _place_hydrogens(structure.subset(atoms), states)
+        keep = (hydrogens.altloc == altloc) | (k == 0)
+        parts.append(hydrogens.subset(keep))
+        part_parents.append(atoms[parents[keep]])
+        charges[atoms] = atom_charges
+    return concatenate_structures(parts, name=structure.name), np.concatenate(part_parents), charges
+
+
+def _place_hydrogens(structure, states):
+    rid = residue_index(structure)
+    n_residues = rid[-1] + 1 if len(structure) else 0
+    first_atom = np.searchsorted(rid, np.arange(n_residues))
+    resn = structure.resn[first_atom]
+    standard = (structure.record[first_atom] == "ATOM") & np.isin(resn, list(SIDECHAIN_TEMPLATES))
+    table = _atom_table(structure, rid, n_residues)
+    coords = structure.coords
+
+    # Peptide bond to the previous residue: backbone H, otherwise a chain (segment) start
+    n_atom, c_atom = table.get("N", _missing(n_residues)), table.get("C", _missing(n_residues))
+    previous_c = np.full(n_residues, -1)
+    previous_c[1:] = c_atom[:-1]
+    linked = (n_atom >= 0) & (previous_c >= 0)
+    linked[linked] = np.linalg.norm(coords[n_atom[linked]] - coords[previous_c[linked]], axis=1) < 2.0
+    next_linked = np.zeros(n_residues, dtype=bool)
+    next_linked[:-1] = linked[1:]
+
+    # Cysteines in a disulfide bond keep SG without hydrogen
+    sg = table.get("SG", _missing(n_residues))
+    disulfide = np.zeros(n_residues, dtype=bool)
+    cys = np.where((resn == "CYS") & (sg >= 0))[0]
+    if len(cys) > 1:
+        pairs = cKDTree(coords[sg[cys]]).query_pairs(2.5, output_type="ndarray")
+        disulfide[cys[pairs.ravel()]] = True
+
+    # (residues, entries, state key) groups to place
+    groups = []
+    for name, entries in SIDECHAIN_TEMPLATES.items():
+        residues = np.where(standard & (resn == name))[0]
+        groups.append((residues, (GLYCINE_TEMPLATE if name == "GLY" else BACKBONE_TEMPLATE) + entries, name))
+    amide = np.where(standard & linked & (resn != "PRO"))[0]
+    groups.append((amide, [(("H",), "N", ("CA", "PREV_C"), "planar", None)], None))
+    groups.append((np.where(standard & ~linked & (resn != "PRO"))[0], N_TERMINUS_TEMPLATE, "N_TERMINUS"))
+    groups.append((np.where(standard & ~linked & (resn == "PRO"))[0], N_TERMINUS_PRO_TEMPLATE, "N_TERMINUS"))
+    groups.append((np.where(standard & ~next_linked)[0], C_TERMINUS_TEMPLATE, "C_TERMINUS"))
+    table["PREV_C"] = previous_c
+
+    charges = structure.charge.astype("U2")
+    # Template entries are pooled by geometry, so each geometry is placed in one call
+    pooled = {}
+    for residues, entries, group in groups:
+        if group in FORMAL_CHARGES:
+            atom_name, protonated, deprotonated = FORMAL_CHARGES[group]
+            atom = table.get(atom_name, _missing(n_residues))[residues]
+            if group == "CYS":
+                atom = atom[~disulfide[residues]]
+            charges[atom[atom >= 0]] = protonated if states.get(group) == "protonated" else deprotonated
+        for h_names, parent_name, ref_names, geometry, state in entries:
+            if state is not None and states.get(group, "protonated") != state:
+                continue
+            parent = table.get(parent_name, _missing(n_residues))[residues]
+            refs = [table.get(ref, _missing(n_residues))[residues] for ref in ref_names]
+            valid = (parent >= 0) & np.all([ref >= 0 for ref in refs], axis=0)
+            if group == "CYS" and parent_name == "SG":
+                valid &= ~disulfide[residues]
+            if valid.any():
+                pool = pooled.setdefault((geometry, len(ref_names)), ([], [], []))
+                pool[0].append(parent[valid])
+                pool[1].append(np.stack([ref[valid] for ref in refs]))
+                pool[2].append(np.tile(h_names, (valid.sum(), 1)))
+
+    parents, names, positions = [], [], []
+    for (geometry, _), (pool_parents, pool_refs, pool_names) in pooled.items():
+        parent, refs = np.concatenate(pool_parents), np.concatenate(pool_refs, axis=1)
+        length = np.array([BOND_LENGTH.get(element, 1.0) for element in structure.element[parent]])[:, None]
+        placed = _place(geometry, coords[parent], list(coords[refs]), length)
+        parents.append(np.repeat(parent, placed.shape[1]))
+        names.append(np.concatenate(pool_names).ravel())
+        positions.append(placed.reshape(-1, 3))
+
+    if not parents:
+        return structure.subset(np.zeros(len(structure), dtype=bool)), np.empty(0, dtype=int), charges
+    parents = np.concatenate(parents)
+    hydrogens = structure.subset(parents)
+    hydrogens.atom_name = np.concatenate(names).astype(structure.atom_name.dtype)
+    hydrogens.coords = np.concatenate(positions)
+    hydrogens.element = np.full(len(parents), "H", dtype=structure.element.dtype)
+    hydrogens.charge = np.full(len(parents), "", dtype=structure.charge.dtype)
+    return hydrogens, parents, charges
+
+
+def _obabel_hydrogens(structure, pH, obabel):
+    """
+    Protonate atoms without templates with `obabel -h -p {pH}` and return the new
+    hydrogens with the index of their nearest heavy atom.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        input_pdb = write_pdb(structure, os.path.join(tmp, "nonstandard.pdb"))
+        output_pdb = os.path.join(tmp, "nonstandard_h.pdb")
+        subprocess.run([obabel, input_pdb, "-opdb", "-h", "-p", str(pH), "-O", output_pdb], capture_output=True)
+        protonated = read_pdb_arrays(output_pdb)
+    protonated = protonated.subset(protonated.element == "H")
+    _, parents = cKDTree(structure.coords).query(protonated.coords)
+    hydrogens = structure.subset(parents)
+    hydrogens.atom_name = protonated.atom_name.astype(structure.atom_name.dtype)
+    hydrogens.coords = protonated.coords
+    hydrogens.element = np.full(len(parents), "H", dtype=structure.element.dtype)
+    hydrogens.charge = np.full(len(parents), "", dtype=structure.charge.dtype)
+    return hydrogens, parents
+
+
+def protonate(structure, pH=7.4, pka_table=PKA_TABLE, fallback=True):
+    """
+    Add hydrogens to a structure at a given pH.
+
+    Standard residues are protonated from templates; only the non-standard residues
+    (ligands, modified residues, ...) are sent to obabel. Existing hydrogens are
+    rebuilt, and each hydrogen is written right after the heavy atoms of its residue.
+
+    Args:
+    - structure (Structure): structure to protonate, see structure.pdb_arrays.
+    - pH (float): pH value for protonation (default is 7.4).
+    - pka_table (dict): pKa per titratable group, PKA_TABLE by default.
+    - fallback (bool): protonate the non-standard residues with obabel when it is installed.
+
+    Returns:
+    - Structure: the protonated structure.
+    """
+    heavy = structure.subset(structure.element != "H")
+    hydrogens, parents, heavy.charge = place_template_hydrogens(heavy, pH, pka_table)
+    parts, part_parents = [heavy, hydrogens], [np.arange(len(heavy)), parents]
+
+    # Atoms of residues without a template
+    standard = (heavy.record == "ATOM") & np.isin(heavy.resn, list(SIDECHAIN_TEMPLATES))
+    nonstandard = np.where(~standard)[0]
+    if fallback and len(nonstandard):
+        obabel = shutil.which("obabel")
+        if obabel is None:
+            print(f"obabel is not installed, {len(nonstandard)} non-standard atoms of {structure.name} are left without hydrogens")
+        else:
+            extra, extra_parents = _obabel_hydrogens(heavy.subset(nonstandard), pH, obabel)
+            parts.append(extra)
+            part_parents.append(nonstandard[extra_parents])
+
+    protonated = concatenate_structures(parts, name=structure.name)
+    parent = np.concatenate(part_parents)
+    is_hydrogen = np.arange(len(protonated)) >= len(heavy)
+    # Residue order first, heavy atoms before hydrogens, hydrogens in the order of their parents
+    order = np.lexsort((np.arange(len(protonated)), parent, is_hydrogen, residue_index(heavy)[parent]))
+    return protonated.subset(order)
+
+
+def protonate_pdb(input_pdb, output_pdb, pH=7.4):
+    """
+    Protonate a PDB file with the template engine and save the result.
+
+    Returns:
+    - str: output_pdb
+    """
+    return write_pdb(protonate(read_pdb_arrays(input_pdb), pH), output_pdb)
+
+
+def benchmark_protonation(input_directory, pH=7.4, reference_directory=None):
+    """
+    Compare the template engine with `obabel -h -p {pH}` for speed and hydrogen count.
+
+    Args:
+    - input_directory (str): Path to the directory containing PDB files, e.g. output_pdb_files.
+    - pH (float): pH value for protonation (default is 7.4).
+    - reference_directory (str, optional): Directory with `*_protonated.pdb` files already
+                                           written by obabel, used when obabel is not installed.
+
+    Returns:
+    - list of dict: per structure the hydrogen counts and atoms/second of both engines.
+    """
+    obabel = shutil.which("obabel")
+    results = []
+    for filename in sorted(os.listdir(input_directory)):
+        if not filename.endswith(".pdb"):
+            continue
+        try:
+            input_pdb = os.path.join(input_directory, filename)
+            structure = read_pdb_arrays(input_pdb)
+            start = time.perf_counter()
+            protonated = protonate(structure, pH)
+            native_time = time.perf_counter() - start
+
+            reference_hydrogens, obabel_rate = None, None
+            with tempfile.TemporaryDirectory() as tmp:
+                reference_pdb = None
+                if obabel:
+                    reference_pdb = os.path.join(tmp, "reference.pdb")
+                    start = time.perf_counter()
+                    subprocess.run([obabel, input_pdb, "-opdb", "-h", "-p", str(pH), "-O", reference_pdb],
+                                   capture_output=True)
+                    obabel_rate = len(structure) / (time.perf_counter() - start)
+                elif reference_directory:
+                    reference_pdb = os.path.join(reference_directory, f"{os.path.splitext(filename)[0]}_protonated.pdb")
+                if reference_pdb and os.path.isfile(reference_pdb):
+                    reference_hydrogens = int(np.sum(read_pdb_arrays(reference_pdb).element == "H"))
+
+            results.append({
+                "structure": structure.name,
+                "hydrogens": int(np.sum(protonated.element == "H")),
+                "reference_hydrogens": reference_hydrogens,
+                "native_atoms_per_s": len(structure) / native_time,
+                "obabel_atoms_per_s": obabel_rate,
+            })
+            reference = f" vs {reference_hydrogens} reference" if reference_hydrogens is not None else ""
+            speedup = f", {results[-1]['native_atoms_per_s'] / obabel_rate:.0f}x obabel" if obabel_rate else ""
+            print(f"{filename}: {results[-1]['hydrogens']} hydrogens{reference}, "
+                  f"{results[-1]['native_atoms_per_s']:,.0f} atoms/s{speedup}")
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+    return results
+
+
+if __name__ == "__main__":
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    benchmark_protonation(os.path.join(current_directory, "output_pdb_files"),
+                          reference_directory=os.path.join(current_directory, "output_files"))
@@ -0,0 +1,143 @@
+import os
+import string
+
+import numpy as np
+
+from structure.filters import protein_mask
+from structure.pdb_arrays import concatenate_structures, parse_pdb_arrays, write_pdb
+
+# Chain identifiers given to the copies of an assembly, after the ones already used
+CHAIN_IDS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+
+
+def parse_biomt(pdb_bytes):
+    """
+    Read the biological assemblies of the REMARK 350 records.
+
+    Returns:
+    - dict: {biomolecule number: list of (chains, operators)}, where operators
+            is a (K, 3, 4) array of rotation + translation matrices.
+    """
+    assemblies = {}
+    biomolecule, chains, rows = None, [], []
+
+    def flush():
+        if biomolecule is not None and chains and rows:
+            operators = np.array(rows, dtype=float).reshape(-1, 3, 4)
+            assemblies.setdefault(biomolecule, []).append((list(chains), operators))
+
+    for line in pdb_bytes.splitlines():
+        if not line.startswith(b"REMARK 350"):
+            continue
+        text = line[10:].decode(errors="replace").strip()
+        if text.startswith("BIOMOLECULE:"):
+            flush()
+            biomolecule, chains, rows = int(text.split(":")[1]), [], []
+        elif "APPLY THE FOLLOWING TO CHAINS:" in text or text.startswith("AND CHAINS:"):
+            if rows:
+                flush()
+                chains, rows = [], []
+            chains += [chain.strip() for chain in text.split(":")[1].split(",") if chain.strip()]
+        elif text.startswith("BIOMT"):
+            rows.append([float(value) for value in text.split()[2:6]])
+    flush()
+    return assemblies
+
+
+def build_assembly(structure, assembly):
+    """
+    Apply the BIOMT operators of one assembly to its chains. The first copy of a chain
+    keeps its identifier, the other copies get unused ones (see CHAIN_IDS).
+
+    Args:
+    - structure (Structure): parsed asymmetric unit.
+    - assembly (list): (chains, operators) pairs of one biomolecule, see parse_biomt.
+
+    Returns:
+    - Structure: all atoms of the assembly.
+    """
+    used = set(structure.chain.tolist())
+    free = [chain for chain in CHAIN_IDS if chain not in used]
+    copies, seen = [], set()
+    for chains, operators in assembly:
+        selected = np.isin(structure.chain, chains)
+        for operator in operators:
+            copy = structure.subset(selected)
+            copy.coords = copy.coords @ operator[:, :3].T + operator[:, 3]
+            identity = np.allclose(operator[:, :3], np.eye(3)) and np.allclose(operator[:, 3], 0)
+            renamed = copy.chain.copy()
+            for chain in chains:
+                if chain in seen or not identity:
+                    if not free:
+                        raise ValueError(f"No chain identifier left for the assembly of {structure.name}")
+                    renamed[copy.chain == chain] = free.pop(0)
+                else:
+                    seen.add(chain)
+            copy.chain = renamed
+            copies.append(copy)
+    return concatenate_structures(copies, name=structure.name)
+
+
+def protein_chains(structure):
+    """
+    Chains containing protein atoms, in file order.
+    """
+    chains = structure.chain[protein_mask(structure)]
+    return list(dict.fromkeys(chains.tolist()))
+
+
+def write_assembly_pdb(pdb_path, output_pdb=None, biomolecule=1):
+    """
+    Write the biological assembly of a PDB file, e.g. 1fvv.pdb -> 1fvv_assembly1.pdb.
+
+    Returns:
+    - str: path of the assembly PDB file, pdb_path itself when it has no REMARK 350.
+    """
+    with open(pdb_path, "rb") as pdb_file:
+        pdb_bytes = pdb_file.read()
+    assemblies = parse_biomt(pdb_bytes)
+    if biomolecule not in assemblies:
+        print(f"No biological assembly {biomolecule} in {pdb_path}, the asymmetric unit is used.")
+        return pdb_path
+    name = os.path.splitext(os.path.basename(pdb_path))[0]
+    structure = build_assembly(parse_pdb_arrays(pdb_bytes, name=name), assemblies[biomolecule])
+    output_pdb = output_pdb or os.path.join(os.path.dirname(pdb_path), f"{name}_assembly{biomolecule}.pdb")
+    return write_pdb(structure, output_pdb)
+
+
+def resolve_target_chains(pdb_path, target_chain=""):
+    """
+    Turn the chain argument of run_af2bind into the PDB file and the chain list
+    to score in one prediction:
+    - "" keeps the former default, chain A;
+    - "A,B" scores the listed chains;
+    - "all" scores every protein chain of the file;
+    - "assembly" (or "assembly2", ...) builds the biological assembly and scores all of its chains.
+
+    Returns:
+    - (str, str): PDB file to predict on and comma-separated chains, e.g. "A,B".
+    """
+    target_chain = target_chain.replace(" ", "")
+    if target_chain == "":
+        return pdb_path, "A"
+    if target_chain.lower().startswith("assembly"):
+        biomolecule = int(target_chain[len("assembly"):] or 1)
+        pdb_path = write_assembly_pdb(pdb_path, biomolecule=biomolecule)
+        target_chain = "all"
+    if target_chain.lower() == "all":
+        with open(pdb_path, "rb") as pdb_file:
+            structure = parse_pdb_arrays(pdb_file.read())
+        return pdb_path, ",".join(protein_chains(structure))
+    return pdb_path, target_chain
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            with open(os.path.join(input_path, filename), "rb") as pdb_file:
+                pdb_bytes = pdb_file.read()
+            structure = parse_pdb_arrays(pdb_bytes, name=filename)
+            for biomolecule, assembly in parse_biomt(pdb_bytes).items():
+                built = build_assembly(structure, assembly)
+                print(f"{filename} assembly {biomolecule}: chains {protein_chains(built)}, {len(built)} atoms")
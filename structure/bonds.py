@@ -0,0 +1,61 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+
+from structure.pdb_arrays import covalent_radii
+
+
+def perceive_bonds(coords, radii, bond_tolerance=0.45):
+    """
+    Perceive covalent bonds from coordinates in one vectorized pass: two atoms are
+    bonded when their distance is below the sum of their covalent radii plus
+    `bond_tolerance`.
+
+    Args:
+    - coords (np.ndarray): (N, 3) atom coordinates.
+    - radii (np.ndarray): (N,) covalent radii.
+    - bond_tolerance (float): tolerance added to the radii sum, 0.45 A by default.
+
+    Returns:
+    - np.ndarray: (M, 2) bonded atom index pairs with i < j.
+    """
+    if len(coords) < 2:
+        return np.empty((0, 2), dtype=int)
+    pairs = cKDTree(coords).query_pairs(r=2 * radii.max() + bond_tolerance, output_type="ndarray")
+    if len(pairs) == 0:
+        return pairs.reshape(0, 2)
+    distances = np.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis=1)
+    return pairs[distances < radii[pairs[:, 0]] + radii[pairs[:, 1]] + bond_tolerance]
+
+
+def bond_graph(structure, bond_tolerance=0.45):
+    """
+    Bonds of a whole structure, cached on it. Alternate locations of the same atom
+    are never bonded to each other.
+
+    Returns:
+    - np.ndarray: (M, 2) bonded atom index pairs with i < j.
+    """
+    key = ("bonds", bond_tolerance)
+    if key not in structure.cache:
+        bonds = perceive_bonds(structure.coords, covalent_radii(structure), bond_tolerance)
+        altloc_a, altloc_b = structure.altloc[bonds[:, 0]], structure.altloc[bonds[:, 1]]
+        keep = (altloc_a == "") | (altloc_b == "") | (altloc_a == altloc_b)
+        structure.cache[key] = bonds[keep]
+    return structure.cache[key]
+
+
+def neighbor_counts(n_atoms, bonds):
+    """
+    Number of bonded neighbors of every atom.
+    """
+    return np.bincount(bonds.ravel(), minlength=n_atoms)
+
+
+def adjacency(n_atoms, bonds):
+    """
+    Symmetric sparse adjacency matrix (CSR) of the bond graph.
+    """
+    rows = np.concatenate([bonds[:, 0], bonds[:, 1]])
+    cols = np.concatenate([bonds[:, 1], bonds[:, 0]])
+    return coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_atoms, n_atoms)).tocsr()
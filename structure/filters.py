@@ -0,0 +1,360 @@
+import os
+import time
+
+import numpy as np
+
+from structure.pdb_arrays import model_lines, record_block, residue_index, structure_from_block
+
+# Amino acid residue names, standard and common modified ones
+AMINO_ACIDS = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE", "LEU", "LYS", "MET",
+               "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL", "MSE", "SEC", "PYL", "SEP", "TPO", "PTR",
+               "HYP", "CSO", "MLY", "HID", "HIE", "HIP", "CYX", "ASH", "GLH", "LYN"]
+
+WATER_RESN = ["HOH", "WAT", "H2O", "DOD", "TIP", "TIP3", "SOL"]
+
+# Elements of the monoatomic ions found in crystal structures
+ION_ELEMENTS = ["LI", "NA", "K", "RB", "CS", "MG", "CA", "SR", "BA", "MN", "FE", "CO", "NI", "CU", "ZN",
+                "CD", "HG", "F", "CL", "BR", "I"]
+
+# Formal charges PyMOL assigns to standard residues when saving, unless the input has one
+PYMOL_FORMAL_CHARGES = {
+    ("ARG", "NH1"): "1+",
+    ("LYS", "NZ"): "1+",
+    ("ASP", "OD2"): "1-",
+    ("GLU", "OE2"): "1-",
+}
+
+# PyMOL orders the atoms of a residue: backbone first, then by remoteness
+# (B, G, D, E, Z, H) and name, other atoms (OXT, ...) last
+BACKBONE_ORDER = {"N": 0, "CA": 1, "C": 2, "O": 3}
+REMOTENESS = "ABGDEZH"
+
+# CRYST1 record as written by PyMOL (Z is always 1)
+CRYST1_FORMAT = "CRYST1{:9.3f}{:9.3f}{:9.3f}{:7.2f}{:7.2f}{:7.2f} {:<11}{:4d}\n"
+
+
+def _residue_has(structure, rid, names):
+    # For every atom, whether its residue contains all the atom names in `names`
+    n_residues = rid[-1] + 1
+    has = np.ones(n_residues, dtype=bool)
+    for name in names:
+        present = np.zeros(n_residues, dtype=bool)
+        present[rid[structure.atom_name == name]] = True
+        has &= present
+    return has[rid]
+
+
+def protein_mask(structure):
+    """
+    Atoms of polymer.protein: amino acid ATOM records (even truncated to a single atom),
+    and residues with an N-CA-C backbone peptide-bonded to a neighbor residue
+    (modified residues such as MSE written as HETATM).
+    """
+    rid = residue_index(structure)
+    backbone = _residue_has(structure, rid, ("N", "CA", "C"))
+    linked = np.zeros(rid[-1] + 1, dtype=bool)
+    n_atoms = np.where(structure.atom_name == "N")[0]
+    c_atoms = np.where(structure.atom_name == "C")[0]
+    if len(n_atoms) and len(c_atoms):
+        # Peptide bond between the C of one residue and the N of the next one
+        c_of = np.full(rid[-1] + 1, -1)
+        c_of[rid[c_atoms]] = c_atoms
+        previous_c = c_of[rid[n_atoms] - 1]
+        valid = (rid[n_atoms] > 0) & (previous_c >= 0)
+        bonded = np.zeros(len(n_atoms), dtype=bool)
+        bonded[valid] = np.linalg.norm(structure.coords[n_atoms[valid]] - structure.coords[previous_c[valid]],
+                                       axis=1) < 2.0
+        linked[rid[n_atoms][bonded]] = True
+        linked[rid[n_atoms][bonded] - 1] = True
+    amino_acid = (structure.record == "ATOM") & np.isin(structure.resn, AMINO_ACIDS)
+    return amino_acid | (backbone & ((structure.record == "ATOM") | linked[rid]))
+
+
+def water_mask(structure):
+    """
+    Atoms of water molecules.
+    """
+    return np.isin(structure.resn, WATER_RESN)
+
+
+def ion_mask(structure):
+    """
+    Monoatomic ions: single-atom hetero residues of an ion element.
+    """
+    rid = residue_index(structure)
+    single = np.bincount(rid)[rid] == 1
+    return structure.is_het & single & np.isin(structure.element, ION_ELEMENTS)
+
+
+def ligand_mask(structure, names):
+    """
+    Hetero atoms of the named ligands, e.g. ["107", "ATP"].
+    """
+    return structure.is_het & np.isin(structure.resn, list(names))
+
+
+def organic_mask(structure):
+    """
+    Organic small molecules, as PyMOL's "organic": carbon-containing hetero residues
+    that are neither polymer.protein nor water.
+    """
+    rid = residue_index(structure)
+    has_carbon = np.zeros(rid[-1] + 1, dtype=bool)
+    has_carbon[rid[structure.element == "C"]] = True
+    return structure.is_het & has_carbon[rid] & ~water_mask(structure) & ~protein_mask(structure)
+
+
+def chain_mask(structure, chains):
+    """
+    Atoms of the given chains, e.g. ["A", "B"].
+    """
+    return np.isin(structure.chain, list(chains))
+
+
+def hydrogen_mask(structure):
+    """
+    Hydrogen and deuterium atoms.
+    """
+    return np.isin(structure.element, ["H", "D"])
+
+
+def altloc_mask(structure):
+    """
+    Resolve alternate locations: keep atoms without altloc and, for every residue,
+    the altloc with the highest mean occupancy (the first one on ties).
+    """
+    has_altloc = structure.altloc != ""
+    keep = ~has_altloc
+    if not has_altloc.any():
+        return keep
+    rid = residue_index(structure)
+    # Mean occupancy of each (residue, altloc) group
+    keys = np.char.add(rid[has_altloc].astype(str), np.char.add(":", structure.altloc[has_altloc]))
+    groups, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    occupancy = np.bincount(inverse, structure.occupancy[has_altloc]) / np.bincount(inverse)
+    group_rid = rid[has_altloc][first]
+    # Highest occupancy first, then file order, and keep the first group per residue
+    order = np.lexsort((first, -occupancy, group_rid))
+    best = order[np.unique(group_rid[order], return_index=True)[1]]
+    chosen = np.zeros(len(groups), dtype=bool)
+    chosen[best] = True
+    keep[np.where(has_altloc)[0][chosen[inverse]]] = True
+    return keep
+
+
+def select_atoms(structure, protein=True, waters=False, ions=False, organic=False, ligands=None, chains=None,
+                 resolve_altlocs=False, hydrogens=True):
+    """
+    Combine the filters into one boolean mask.
+
+    Args:
+    - structure (Structure): parsed atoms, see structure.pdb_arrays.
+    - protein (bool): keep polymer.protein atoms.
+    - waters (bool): keep waters.
+    - ions (bool): keep monoatomic ions.
+    - organic (bool): keep all organic small molecules.
+    - ligands (list of str, optional): residue names of the ligands to keep.
+    - chains (list of str, optional): restrict the selection to these chains.
+    - resolve_altlocs (bool): keep only the highest occupancy alternate location.
+    - hydrogens (bool): keep hydrogens, False strips them.
+
+    Returns:
+    - np.ndarray: boolean mask of the selected atoms.
+    """
+    mask = np.zeros(len(structure), dtype=bool)
+    if protein:
+        mask |= protein_mask(structure)
+    if waters:
+        mask |= water_mask(structure)
+    if ions:
+        mask |= ion_mask(structure)
+    if organic:
+        mask |= organic_mask(structure)
+    if ligands:
+        mask |= ligand_mask(structure, ligands)
+    if chains:
+        mask &= chain_mask(structure, chains)
+    if resolve_altlocs:
+        mask &= altloc_mask(structure)
+    if not hydrogens:
+        mask &= ~hydrogen_mask(structure)
+    return mask
+
+
+def pymol_atom_order(structure):
+    """
+    Atom order of a PyMOL save: residues in file order, and inside each residue
+    the backbone first, then the side chain by remoteness and atom name.
+
+    Returns:
+    - np.ndarray: index array sorting the atoms.
+    """
+    # Rank each distinct (atom name, element) pair once
+    keys = np.char.add(np.char.add(structure.atom_name, ":"), structure.element)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_rank = np.full(len(unique_keys), 4 + len(REMOTENESS))
+    for k, key in enumerate(unique_keys):
+        name, element = key.split(":")
+        if name in BACKBONE_ORDER:
+            unique_rank[k] = BACKBONE_ORDER[name]
+        elif len(name) > len(element) and name[len(element)] in REMOTENESS:
+            unique_rank[k] = 4 + REMOTENESS.index(name[len(element)])
+    rank = unique_rank[inverse]
+    return np.lexsort((structure.altloc, structure.atom_name, rank, residue_index(structure)))
+
+
+def _cryst1(lines):
+    # CRYST1 record in the PyMOL layout, or None
+    for line in lines:
+        if line.startswith(b"CRYST1"):
+            line = line.decode().ljust(70)
+            cell = [float(line[start:end]) for start, end in ((6, 15), (15, 24), (24, 33), (33, 40), (40, 47), (47, 54))]
+            # PyMOL reads the Z value from columns 67-69 instead of 67-70,
+            # so a one-digit Z is lost and written as 1
+            z = line[66:69].strip()
+            return CRYST1_FORMAT.format(*cell, line[55:66].strip(), int(z) if z.isdigit() else 1)
+    return None
+
+
+def filter_pdb_bytes(pdb_bytes, name="structure", model_index=1, assign_charges=True, **selection):
+    """
+    Filter the atoms of PDB text and render the result in the layout PyMOL saves:
+    CRYST1, renumbered ATOM/HETATM records followed by their ANISOU records,
+    TER after every chain and END.
+
+    Args:
+    - pdb_bytes (bytes): Content of a PDB file.
+    - name (str): Name of the structure.
+    - model_index (int): Model to extract for multi-model files, 1 by default.
+    - assign_charges (bool): add the formal charges PyMOL assigns (PYMOL_FORMAL_CHARGES, OXT).
+    - selection: filters passed to select_atoms.
+
+    Returns:
+    - str: PDB text of the selected atoms.
+    """
+    lines = pdb_bytes.splitlines()
+    atom_lines = model_lines(lines, model_index)
+    if not atom_lines:
+        raise ValueError(f"No atoms found for model {model_index} in {name}")
+    block = record_block(atom_lines)
+    structure = structure_from_block(block, name=name)
+    mask = select_atoms(structure, **selection)
+    altloc = np.where(mask, "", structure.altloc) if selection.get("resolve_altlocs") else structure.altloc
+
+    charge = structure.charge.astype("U2")
+    if assign_charges:
+        missing = charge == ""
+        for (resn, atom_name), value in PYMOL_FORMAL_CHARGES.items():
+            charge[missing & (structure.resn == resn) & (structure.atom_name == atom_name)] = value
+        charge[missing & (structure.atom_name == "OXT")] = "1-"
+
+    order = pymol_atom_order(structure)
+    selected = order[mask[order]]
+    n_atoms = len(selected)
+
+    # ANISOU record of each selected atom, matched by serial number
+    anisou = {}
+    for line in lines:
+        if line.startswith(b"ANISOU"):
+            anisou.setdefault(line[6:11], line)
+    anisou_lines = [anisou.get(atom_lines[i][6:11]) for i in selected] if anisou else [None] * n_atoms
+    has_anisou = np.array([line is not None for line in anisou_lines], dtype=bool)
+
+    # Columns rewritten in both records: serial, altloc and charge
+    serial = np.char.rjust(np.arange(1, n_atoms + 1).astype("S5"), 5).view("S1").reshape(n_atoms, 5)
+    altloc = np.char.encode(np.where(altloc[selected] == "", " ", altloc[selected])).astype("S1")
+    charge = np.char.ljust(np.char.encode(charge[selected]).astype("S2"), 2).view("S1").reshape(n_atoms, 2)
+
+    # Every atom row is followed by its ANISOU row when it has one
+    position = np.arange(n_atoms) + np.cumsum(has_anisou) - has_anisou
+    rows = np.full((n_atoms + has_anisou.sum(), 81), b"\n", dtype="S1")
+    rows[position, :80] = block[selected]
+    if has_anisou.any():
+        rows[position[has_anisou] + 1, :80] = record_block([line for line in anisou_lines if line is not None])
+    for target, source in ((position, slice(None)), (position[has_anisou] + 1, has_anisou)):
+        rows[target, 6:11] = serial[source]
+        rows[target, 16] = altloc[source]
+        rows[target, 78:80] = charge[source]
+
+    # TER after the last atom (and ANISOU) of every chain
+    chain = structure.chain[selected]
+    chain_end = np.append(np.where(chain[1:] != chain[:-1])[0], n_atoms - 1) if n_atoms else np.array([], dtype=int)
+    row_end = position[chain_end] + has_anisou[chain_end] + 1
+
+    output = []
+    cryst1 = _cryst1(lines)
+    if cryst1:
+        output.append(cryst1.encode())
+    start = 0
+    for end in row_end:
+        output.append(rows[start:end].tobytes())
+        output.append(b"TER   \n")
+        start = end
+    output.append(b"END\n")
+    return b"".join(output).decode()
+
+
+def filter_pdb(input_pdb, output_pdb, **selection):
+    """
+    Filter a PDB file and save the selected atoms, see filter_pdb_bytes.
+
+    Returns:
+    - str: output_pdb
+    """
+    with open(input_pdb, "rb") as pdb_file:
+        pdb_bytes = pdb_file.read()
+    name = os.path.splitext(os.path.basename(input_pdb))[0]
+    text = filter_pdb_bytes(pdb_bytes, name=name, **selection)
+    with open(output_pdb, "w") as output_file:
+        output_file.write(text)
+    return output_pdb
+
+
+def compare_with_pymol(input_path, pymol_directory, repeats=20):
+    """
+    Check that filter_pdb reproduces the `remove("not polymer.protein")` output of
+    PyMOL byte for byte, and measure the throughput in files per second.
+
+    Args:
+    - input_path (str): Path to the directory containing the input PDB files.
+    - pymol_directory (str): Directory with the `*_rmnpn.pdb` files saved by PyMOL.
+    - repeats (int): number of timed passes over the input files.
+
+    Returns:
+    - dict: identical and compared file counts and files/second.
+    """
+    inputs = {}
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            with open(os.path.join(input_path, filename), "rb") as pdb_file:
+                inputs[filename] = pdb_file.read()
+
+    identical, compared = 0, 0
+    for filename, pdb_bytes in inputs.items():
+        reference_pdb = os.path.join(pymol_directory, os.path.splitext(filename)[0] + "_rmnpn.pdb")
+        if not os.path.isfile(reference_pdb):
+            continue
+        with open(reference_pdb) as reference_file:
+            reference = reference_file.read()
+        native = filter_pdb_bytes(pdb_bytes, name=filename)
+        compared += 1
+        identical += native == reference
+        if native != reference:
+            differing = sum(a != b for a, b in zip(native.splitlines(), reference.splitlines()))
+            print(f"{filename}: {differing} lines differ from the PyMOL output")
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for filename, pdb_bytes in inputs.items():
+            filter_pdb_bytes(pdb_bytes, name=filename)
+    files_per_s = repeats * len(inputs) / (time.perf_counter() - start)
+    print(f"{identical}/{compared} files identical to PyMOL, {files_per_s:,.0f} files/s")
+    return {"identical": identical, "compared": compared, "files_per_s": files_per_s}
+
+
+if __name__ == "__main__":
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    compare_with_pymol(os.path.join(current_directory, "input_pdb_files"),
+                       os.path.join(current_directory, "output_pdb_files"))
@@ -0,0 +1,207 @@
+import os
+import time
+
+import numpy as np
+from scipy.spatial import ConvexHull, QhullError
+
+from structure.pdb_arrays import atom_masses, read_pdb_arrays, residue_index
+from structure.selection import select
+
+
+class Geometry:
+    """
+    Geometric reductions over the atoms of one structure: centers of mass,
+    centroids, radii of gyration, bounding extents and diameters.
+
+    Every quantity is computed for an arbitrary selection in one vectorized
+    reduction and memoized per (quantity, selection), so asking again for the
+    center of mass of the same binding residues is a dictionary lookup.
+    Build it through geometry(structure) so it is cached with the structure.
+    """
+
+    def __init__(self, structure):
+        self.structure = structure
+        self.coords = structure.coords
+        self.masses = atom_masses(structure)
+        self.results = {}
+
+    def mask(self, selection=None):
+        """
+        Boolean mask of a selection: None (all atoms), a PyMOL selection string,
+        a boolean mask or an index array.
+        """
+        if selection is None:
+            return np.ones(len(self.structure), dtype=bool)
+        if isinstance(selection, str):
+            return select(self.structure, selection)
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return selection
+        mask = np.zeros(len(self.structure), dtype=bool)
+        mask[selection] = True
+        return mask
+
+    def _key(self, quantity, selection):
+        # Memoization key: selection strings as they are, masks by their packed bits
+        if selection is None or isinstance(selection, str):
+            return quantity, selection
+        return quantity, np.packbits(self.mask(selection)).tobytes()
+
+    def _memoized(self, quantity, selection, compute):
+        key = self._key(quantity, selection)
+        if key not in self.results:
+            mask = self.mask(selection)
+            if not mask.any():
+                raise ValueError(f"Empty selection {selection!r}")
+            self.results[key] = compute(mask)
+        return self.results[key]
+
+    def weights(self, mask, occupancy=True):
+        """
+        Per-atom weights of the center of mass: atomic mass, times the occupancy
+        like PyMOL's centerofmass when `occupancy` is True.
+        """
+        weights = self.masses[mask]
+        if occupancy:
+            weights = weights * self.structure.occupancy[mask]
+            if not weights.any():
+                weights = self.masses[mask]
+        return weights
+
+    def center_of_mass(self, selection=None, occupancy=True):
+        """
+        Mass-weighted center of a selection, as pymol.cmd.centerofmass.
+
+        Returns:
+        - np.ndarray: (3,) center of mass.
+        """
+        return self._memoized(("center_of_mass", occupancy), selection,
+                              lambda mask: np.average(self.coords[mask], axis=0,
+                                                      weights=self.weights(mask, occupancy)))
+
+    def centroid(self, selection=None):
+        """
+        Unweighted geometric center of a selection.
+        """
+        return self._memoized("centroid", selection, lambda mask: self.coords[mask].mean(axis=0))
+
+    def radius_of_gyration(self, selection=None, weighted=True):
+        """
+        Radius of gyration around the center of mass (or the centroid if not `weighted`).
+        """
+        def compute(mask):
+            weights = self.masses[mask] if weighted else np.ones(np.count_nonzero(mask))
+            center = self.center_of_mass(selection, occupancy=False) if weighted else self.centroid(selection)
+            squared = np.sum((self.coords[mask] - center) ** 2, axis=1)
+            return float(np.sqrt(np.average(squared, weights=weights)))
+        return self._memoized(("radius_of_gyration", weighted), selection, compute)
+
+    def extents(self, selection=None):
+        """
+        Axis-aligned bounding box of a selection.
+
+        Returns:
+        - (np.ndarray, np.ndarray): (3,) minimum and maximum corners.
+        """
+        return self._memoized("extents", selection,
+                              lambda mask: (self.coords[mask].min(axis=0), self.coords[mask].max(axis=0)))
+
+    def diameter(self, selection=None):
+        """
+        Largest interatomic distance of a selection. The farthest pair is always on the
+        convex hull, so only the hull vertices are compared instead of all atom pairs.
+        """
+        def compute(mask):
+            coords = self.coords[mask]
+            if len(coords) > 16:
+                try:
+                    coords = coords[ConvexHull(coords).vertices]
+                except QhullError:
+                    pass
+            return float(np.max(np.linalg.norm(coords[:, None] - coords, axis=-1)))
+        return self._memoized("diameter", selection, compute)
+
+    def residue_centers(self, selection=None, occupancy=True):
+        """
+        Center of mass of every residue with atoms in the selection, in one bincount pass.
+
+        Returns:
+        - (np.ndarray, np.ndarray): residue indices and their (R, 3) centers of mass.
+        """
+        def compute(mask):
+            rid = residue_index(self.structure)[mask]
+            weights = self.weights(mask, occupancy)
+            residues, local = np.unique(rid, return_inverse=True)
+            total = np.bincount(local, weights)
+            total[total == 0] = 1.0
+            centers = np.stack([np.bincount(local, weights * self.coords[mask][:, axis]) for axis in range(3)], axis=1)
+            return residues, centers / total[:, None]
+        return self._memoized(("residue_centers", occupancy), selection, compute)
+
+
+def geometry(structure):
+    """
+    Return the Geometry of a structure, building it on first use.
+    """
+    if "geometry" not in structure.cache:
+        structure.cache["geometry"] = Geometry(structure)
+    return structure.cache["geometry"]
+
+
+def center_of_mass(structure, selection=None):
+    """
+    Center of mass of a selection (string, mask or indices), memoized on the structure.
+
+    Returns:
+    - tuple: (x, y, z) as returned by pymol.cmd.centerofmass.
+    """
+    return tuple(float(c) for c in geometry(structure).center_of_mass(selection))
+
+
+def benchmark_geometry(pdb_path, selection="polymer.protein", repeats=100):
+    """
+    Time the first and the memoized evaluation of the geometric reductions, and
+    the hull diameter against the all-pairs distance matrix used before.
+
+    Args:
+    - pdb_path (str): Path to a PDB file.
+    - selection (str): selection to reduce, "polymer.protein" by default.
+    - repeats (int): number of memoized queries to time.
+
+    Returns:
+    - dict: timings in milliseconds and the diameters of both methods.
+    """
+    structure = read_pdb_arrays(pdb_path)
+    start = time.perf_counter()
+    summary = geometry(structure)
+    center = summary.center_of_mass(selection)
+    summary.radius_of_gyration(selection)
+    summary.extents(selection)
+    diameter = summary.diameter(selection)
+    first_ms = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        summary.center_of_mass(selection)
+        summary.radius_of_gyration(selection)
+        summary.extents(selection)
+        summary.diameter(selection)
+    memoized_ms = (time.perf_counter() - start) * 1e3 / repeats
+
+    start = time.perf_counter()
+    coords = structure.coords[select(structure, selection)]
+    pairwise = float(np.max(np.linalg.norm(coords[:, None] - coords, axis=-1)))
+    pairwise_ms = (time.perf_counter() - start) * 1e3
+
+    print(f"{structure.name}: center of mass {np.round(center, 3)}, diameter {diameter:.2f} A "
+          f"(all pairs {pairwise:.2f} A in {pairwise_ms:.0f} ms), first query {first_ms:.1f} ms, "
+          f"memoized {memoized_ms * 1e3:.1f} us")
+    return {"first_ms": first_ms, "memoized_ms": memoized_ms, "pairwise_ms": pairwise_ms,
+            "diameter": diameter, "pairwise_diameter": pairwise}
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            benchmark_geometry(os.path.join(input_path, filename))
@@ -0,0 +1,326 @@
+import itertools
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Standard atomic weights (g/mol) for the elements found in PDB entries
+ELEMENT_MASS = {
+    "H": 1.008, "D": 2.014, "C": 12.011, "N": 14.007, "O": 15.999, "F": 18.998,
+    "NA": 22.990, "MG": 24.305, "AL": 26.982, "SI": 28.086, "P": 30.974,
+    "S": 32.06, "CL": 35.45, "K": 39.098, "CA": 40.078, "MN": 54.938,
+    "FE": 55.845, "CO": 58.933, "NI": 58.693, "CU": 63.546, "ZN": 65.38,
+    "SE": 78.971, "BR": 79.904, "CD": 112.414, "I": 126.904, "HG": 200.592,
+}
+
+# Single-bond covalent radii (Angstrom), used to perceive bonds from coordinates
+COVALENT_RADIUS = {
+    "H": 0.31, "D": 0.31, "C": 0.76, "N": 0.71, "O": 0.66, "F": 0.57,
+    "NA": 1.66, "MG": 1.41, "AL": 1.21, "SI": 1.11, "P": 1.07, "S": 1.05,
+    "CL": 1.02, "K": 2.03, "CA": 1.76, "MN": 1.39, "FE": 1.32, "CO": 1.26,
+    "NI": 1.24, "CU": 1.32, "ZN": 1.22, "SE": 1.20, "BR": 1.20, "CD": 1.44,
+    "I": 1.39, "HG": 1.32,
+}
+
+# Fixed-width column ranges of the ATOM/HETATM records
+_COLUMNS = {
+    "record": (0, 6),
+    "serial": (6, 11),
+    "atom_name": (12, 16),
+    "altloc": (16, 17),
+    "resn": (17, 20),
+    "chain": (21, 22),
+    "resi": (22, 26),
+    "icode": (26, 27),
+    "x": (30, 38),
+    "y": (38, 46),
+    "z": (46, 54),
+    "occupancy": (54, 60),
+    "bfactor": (60, 66),
+    "element": (76, 78),
+    "charge": (78, 80),
+}
+
+# ATOM/HETATM record layout used when writing PDB files
+PDB_ATOM = "{:<6}{:>5} {:<4}{:1}{:>3} {:1}{:>4}{:1}   {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}          {:>2}{:<2}\n"
+
+
+@dataclass
+class Structure:
+    """
+    Struct-of-arrays view of the ATOM/HETATM records of one PDB model.
+
+    Every per-atom field is a NumPy array of the same length, so selections are
+    boolean masks and geometry is computed on the (N, 3) coordinate array.
+    Derived data (spatial index, masses, ...) is memoized in `cache`.
+    """
+    name: str
+    record: np.ndarray
+    serial: np.ndarray
+    atom_name: np.ndarray
+    altloc: np.ndarray
+    resn: np.ndarray
+    chain: np.ndarray
+    resi: np.ndarray
+    icode: np.ndarray
+    coords: np.ndarray
+    occupancy: np.ndarray
+    bfactor: np.ndarray
+    element: np.ndarray
+    charge: np.ndarray
+    cache: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def __len__(self):
+        return len(self.coords)
+
+    @property
+    def is_het(self):
+        return self.record == "HETATM"
+
+    def subset(self, mask):
+        """
+        Return a new Structure containing only the atoms selected by `mask`
+        (boolean mask or index array). The cache is not carried over.
+        """
+        return Structure(
+            name=self.name,
+            **{key: getattr(self, key)[mask] for key in _ARRAY_FIELDS},
+        )
+
+
+_ARRAY_FIELDS = ("record", "serial", "atom_name", "altloc", "resn", "chain", "resi",
+                 "icode", "coords", "occupancy", "bfactor", "element", "charge")
+
+
+def _column(block, start, end):
+    # View a column range of the (N, 80) byte matrix as one fixed-width string per row
+    return block[:, start:end].copy().view(f"S{end - start}").ravel()
+
+
+def _text_column(block, start, end):
+    return np.char.strip(_column(block, start, end)).astype(f"U{end - start}")
+
+
+def _numeric_column(block, start, end, dtype, default):
+    values = np.char.strip(_column(block, start, end))
+    values[values == b""] = default
+    try:
+        return values.astype(dtype)
+    except ValueError:
+        # Hybrid-36 serials or corrupt fields: fall back to the default value
+        parsed = np.empty(len(values), dtype=dtype)
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = dtype(value)
+            except ValueError:
+                parsed[i] = dtype(default)
+        return parsed
+
+
+def _element_from_name(atom_names):
+    # PDB convention: element symbol is the leading letters of the atom name
+    return np.array([name.lstrip("0123456789")[:1].upper() for name in atom_names], dtype="U2")
+
+
+def model_lines(lines, model_index):
+    """
+    Keep the ATOM/HETATM lines of the `model_index`-th MODEL (1-based),
+    or all of them if the file has no MODEL records. The lines are bytes,
+    e.g. for record_block.
+    """
+    atom_lines = []
+    model = 0
+    has_models = False
+    for line in lines:
+        if line.startswith(b"MODEL"):
+            has_models = True
+            model += 1
+        elif line.startswith((b"ATOM  ", b"HETATM")):
+            if not has_models or model == model_index:
+                atom_lines.append(line)
+        elif line.startswith(b"ENDMDL") and model == model_index:
+            break
+    return atom_lines
+
+
+def parse_pdb_arrays(pdb_bytes, name="structure", model_index=1):
+    """
+    Parse the ATOM/HETATM records of PDB text into a Structure in one pass.
+
+    Args:
+    - pdb_bytes (bytes): Content of a PDB file.
+    - name (str): Name of the structure, usually the file stem, e.g. 6o0k.
+    - model_index (int): Model to extract for multi-model files, 1 by default.
+
+    Returns:
+    - Structure: per-atom arrays of the selected model.
+    """
+    lines = model_lines(pdb_bytes.splitlines(), model_index)
+    if not lines:
+        raise ValueError(f"No atoms found for model {model_index} in {name}")
+    return structure_from_block(record_block(lines), name=name)
+
+
+def record_block(lines):
+    """
+    Pad every record to 80 columns and view them as a (N, 80) byte matrix.
+    """
+    block = np.frombuffer(b"".join(line[:80].ljust(80) for line in lines), dtype="S1")
+    return block.reshape(len(lines), 80)
+
+
+def structure_from_block(block, name="structure"):
+    """
+    Build a Structure from the (N, 80) byte matrix of ATOM/HETATM records.
+    """
+    atom_name = _text_column(block, *_COLUMNS["atom_name"])
+    element = np.char.upper(_text_column(block, *_COLUMNS["element"]))
+    missing = element == ""
+    if missing.any():
+        element[missing] = _element_from_name(atom_name[missing])
+
+    coords = np.stack([_numeric_column(block, *_COLUMNS[axis], float, b"0") for axis in "xyz"], axis=1)
+
+    return Structure(
+        name=name,
+        record=_text_column(block, *_COLUMNS["record"]),
+        serial=_numeric_column(block, *_COLUMNS["serial"], int, b"0"),
+        atom_name=atom_name,
+        altloc=_text_column(block, *_COLUMNS["altloc"]),
+        resn=_text_column(block, *_COLUMNS["resn"]),
+        chain=_text_column(block, *_COLUMNS["chain"]),
+        resi=_numeric_column(block, *_COLUMNS["resi"], int, b"0"),
+        icode=_text_column(block, *_COLUMNS["icode"]),
+        coords=coords,
+        occupancy=_numeric_column(block, *_COLUMNS["occupancy"], float, b"1"),
+        bfactor=_numeric_column(block, *_COLUMNS["bfactor"], float, b"0"),
+        element=element,
+        charge=_text_column(block, *_COLUMNS["charge"]),
+    )
+
+
+def read_pdb_arrays(pdb_path, model_index=1):
+    """
+    Read a PDB file into a Structure.
+
+    Args:
+    - pdb_path (str): Path to a local PDB file.
+    - model_index (int): Model to extract for multi-model files, 1 by default.
+
+    Returns:
+    - Structure: per-atom arrays, named after the file stem.
+    """
+    with open(pdb_path, "rb") as pdb_file:
+        pdb_bytes = pdb_file.read()
+    name = os.path.splitext(os.path.basename(pdb_path))[0]
+    return parse_pdb_arrays(pdb_bytes, name=name, model_index=model_index)
+
+
+def pdb_atom_name(atom_name, element):
+    """
+    Format an atom name in the 4 columns of the PDB convention:
+    one-letter elements start in the second column (" CA "), longer names and
+    two-letter elements start in the first one ("HD21", "CL  ").
+    """
+    if len(atom_name) >= 4 or (len(element) == 2 and atom_name.upper().startswith(element)):
+        return atom_name[:4].ljust(4)
+    return f" {atom_name}".ljust(4)
+
+
+def concatenate_structures(structures, name=None):
+    """
+    Join several structures into one, keeping the atom order of the inputs.
+    """
+    return Structure(
+        name=name or structures[0].name,
+        **{key: np.concatenate([getattr(structure, key) for structure in structures]) for key in _ARRAY_FIELDS},
+    )
+
+
+def _atom_records(structure, renumber=True):
+    # ATOM/HETATM lines of a structure, formatted atom by atom
+    serial = np.arange(1, len(structure) + 1) if renumber else structure.serial
+    names = [pdb_atom_name(atom_name, element) for atom_name, element in zip(structure.atom_name, structure.element)]
+    x, y, z = structure.coords[:, 0].tolist(), structure.coords[:, 1].tolist(), structure.coords[:, 2].tolist()
+    for i in range(len(structure)):
+        yield PDB_ATOM.format(
+            structure.record[i], serial[i], names[i], structure.altloc[i], structure.resn[i],
+            structure.chain[i], structure.resi[i], structure.icode[i], x[i], y[i], z[i],
+            structure.occupancy[i], structure.bfactor[i], structure.element[i], structure.charge[i],
+        )
+
+
+def format_pdb(structure, renumber=True):
+    """
+    PDB text of a Structure (ATOM/HETATM records and END), e.g. to send it to a viewer.
+    """
+    return "".join(_atom_records(structure, renumber)) + "END\n"
+
+
+def write_pdb(structure, pdb_path, renumber=True, chunk_size=50000):
+    """
+    Write a Structure as ATOM/HETATM records, one buffered write per chunk of atoms.
+
+    Args:
+    - structure (Structure): atoms to write.
+    - pdb_path (str): Path of the output PDB file.
+    - renumber (bool): renumber the atom serials from 1, True by default.
+    - chunk_size (int): atoms formatted per write call.
+
+    Returns:
+    - str: pdb_path
+    """
+    records = _atom_records(structure, renumber)
+    with open(pdb_path, "w", buffering=1 << 20) as pdb_file:
+        for _ in range(0, len(structure), chunk_size):
+            pdb_file.write("".join(itertools.islice(records, chunk_size)))
+        pdb_file.write("END\n")
+    return pdb_path
+
+
+def atom_masses(structure):
+    """
+    Per-atom mass vector from the element column (carbon mass for unknown elements).
+    The vector is cached on the structure.
+    """
+    if "masses" not in structure.cache:
+        structure.cache["masses"] = np.array(
+            [ELEMENT_MASS.get(element, ELEMENT_MASS["C"]) for element in structure.element]
+        )
+    return structure.cache["masses"]
+
+
+def covalent_radii(structure):
+    """
+    Per-atom covalent radius vector from the element column (cached on the structure).
+    """
+    if "covalent_radii" not in structure.cache:
+        structure.cache["covalent_radii"] = np.array(
+            [COVALENT_RADIUS.get(element, 1.5) for element in structure.element]
+        )
+    return structure.cache["covalent_radii"]
+
+
+def residue_index(structure):
+    """
+    Assign a residue number (0..n_residues-1) to every atom, based on
+    consecutive (chain, resi, icode, resn) keys as in the file order.
+
+    Returns:
+    - np.ndarray: residue index per atom (cached on the structure).
+    """
+    if "residue_index" not in structure.cache:
+        changed = np.ones(len(structure), dtype=bool)
+        changed[1:] = (
+            (structure.chain[1:] != structure.chain[:-1])
+            | (structure.resi[1:] != structure.resi[:-1])
+            | (structure.icode[1:] != structure.icode[:-1])
+            | (structure.resn[1:] != structure.resn[:-1])
+        )
+        structure.cache["residue_index"] = np.cumsum(changed) - 1
+    return structure.cache["residue_index"]
+
+
+if __name__ == "__main__":
+    structure = read_pdb_arrays(os.path.join(os.getcwd(), "input_pdb_files", "1d3g.pdb"))
+    print(f"{structure.name}: {len(structure)} atoms, {residue_index(structure)[-1] + 1} residues")
@@ -0,0 +1,217 @@
+import datetime
+import os
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+# First records of the coordinate section: the header ends there
+_COORDINATE_RECORDS = (b"ATOM  ", b"HETATM", b"MODEL ")
+
+TABLE_COLUMNS = ["target", "idcode", "classification", "deposition_date", "release_date", "revision_date",
+                 "title", "method", "resolution", "models", "chains", "molecules", "ligands", "ligand_names"]
+
+
+@dataclass
+class PDBHeader:
+    """
+    Metadata of a PDB entry from its header records, the coordinates are not read.
+
+    ligands holds the HET groups (ions and modified residues included, water excluded
+    as in the HET records): {resn: {"name": HETNAM, "instances": HET records, "chains": chains}}.
+    chains maps every chain to the molecule name of its COMPND entity, seqres to its SEQRES length.
+    """
+    idcode: str = None
+    classification: str = None
+    deposition_date: datetime.date = None
+    release_date: datetime.date = None
+    revision_date: datetime.date = None
+    title: str = None
+    method: str = None
+    resolution: float = None
+    models: int = None
+    chains: dict = field(default_factory=dict)
+    seqres: dict = field(default_factory=dict)
+    ligands: dict = field(default_factory=dict)
+
+    def row(self):
+        """
+        Flat, JSON-serializable fields of the header (dates as ISO strings), one row of header_table.
+        """
+        return {
+            "idcode": self.idcode,
+            "classification": self.classification,
+            "deposition_date": self.deposition_date.isoformat() if self.deposition_date else None,
+            "release_date": self.release_date.isoformat() if self.release_date else None,
+            "revision_date": self.revision_date.isoformat() if self.revision_date else None,
+            "title": self.title,
+            "method": self.method,
+            "resolution": self.resolution,
+            "models": self.models,
+            "chains": "".join(self.seqres) or "".join(self.chains),
+            "molecules": "; ".join(dict.fromkeys(name for name in self.chains.values() if name)),
+            "ligands": " ".join(f"{resn}x{ligand['instances']}" for resn, ligand in self.ligands.items()),
+            "ligand_names": "; ".join(f"{resn}: {ligand['name']}" for resn, ligand in self.ligands.items()
+                                      if ligand["name"]),
+        }
+
+
+def _date(text):
+    # PDB dates are DD-MON-YY, e.g. 29-SEP-99
+    try:
+        return datetime.datetime.strptime(text.strip().title(), "%d-%b-%y").date()
+    except ValueError:
+        return None
+
+
+def _continued(text, more):
+    # Join the continuation lines of a record, without a space after a hyphenated line break
+    if not text:
+        return more
+    return text + more if text.endswith("-") else f"{text} {more}"
+
+
+def _compound_chains(compound):
+    # {chain: molecule name} of the MOL_ID / MOLECULE / CHAIN tokens of the COMPND records
+    chains, molecule = {}, None
+    for token in compound.split(";"):
+        key, _, value = token.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "MOL_ID":
+            molecule = None
+        elif key == "MOLECULE":
+            molecule = value
+        elif key == "CHAIN":
+            for chain in value.split(","):
+                if chain.strip() and chain.strip() != "NULL":
+                    chains[chain.strip()] = molecule
+    return chains
+
+
+def parse_pdb_header(lines):
+    """
+    Read the header records of PDB lines up to the first ATOM/HETATM/MODEL record.
+
+    Args:
+    - lines (iterable of bytes): lines of a PDB file, e.g. an open binary file.
+
+    Returns:
+    - PDBHeader: fields found in the header, None (or empty) for the missing ones.
+    """
+    header = PDBHeader()
+    title = compound = ""
+    ligand_names = {}
+    for line in lines:
+        record = line[:6]
+        if record in _COORDINATE_RECORDS:
+            break
+        line = line.rstrip(b"\r\n").decode(errors="replace")
+        if record == b"HEADER":
+            header.classification = line[10:50].strip() or None
+            header.deposition_date = _date(line[50:59])
+            header.idcode = line[62:66].strip() or None
+        elif record == b"TITLE ":
+            title = _continued(title, line[10:80].strip())
+        elif record == b"COMPND":
+            compound = _continued(compound, line[10:80].strip())
+        elif record == b"EXPDTA":
+            header.method = _continued(header.method, line[10:79].strip())
+        elif record == b"NUMMDL":
+            header.models = int(line[10:14])
+        elif record == b"REVDAT":
+            # Latest revision first, the initial release has the modification type 0
+            revision_date = _date(line[13:22])
+            header.revision_date = header.revision_date or revision_date
+            if line[31:32] == "0":
+                header.release_date = revision_date
+        elif record == b"REMARK" and line[7:10] == "  2" and line[11:22] == "RESOLUTION.":
+            try:
+                header.resolution = float(line[22:30])
+            except ValueError:
+                header.resolution = None
+        elif record == b"SEQRES":
+            header.seqres[line[11:12].strip()] = int(line[13:17])
+        elif record == b"HET   ":
+            resn = line[7:10].strip()
+            ligand = header.ligands.setdefault(resn, {"name": None, "instances": 0, "chains": ""})
+            ligand["instances"] += 1
+            if line[12:13].strip() not in ligand["chains"]:
+                ligand["chains"] += line[12:13].strip()
+        elif record == b"HETNAM":
+            resn = line[11:14].strip()
+            ligand_names[resn] = _continued(ligand_names.get(resn, ""), line[15:70].strip())
+
+    header.title = title or None
+    header.chains = _compound_chains(compound)
+    for resn, name in ligand_names.items():
+        header.ligands.setdefault(resn, {"name": None, "instances": 0, "chains": ""})["name"] = name
+    return header
+
+
+def read_pdb_header(pdb_path):
+    """
+    Header of a PDB file, reading it only up to the first ATOM/HETATM/MODEL record.
+
+    Args:
+    - pdb_path (str): Path to a local PDB file.
+
+    Returns:
+    - PDBHeader: see parse_pdb_header.
+    """
+    with open(pdb_path, "rb") as pdb_file:
+        return parse_pdb_header(pdb_file)
+
+
+def header_table(input_path, report_path=None):
+    """
+    Metadata table of the PDB files of a directory, from their headers only.
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - report_path (str, optional): CSV file of the table.
+
+    Returns:
+    - pd.DataFrame: one row per file with the columns TABLE_COLUMNS.
+    """
+    rows = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                header = read_pdb_header(os.path.join(input_path, filename))
+                rows.append({"target": os.path.splitext(filename)[0], **header.row()})
+            except Exception as e:
+                print(f"Error reading the header of {filename}: {e}")
+    table = pd.DataFrame(rows, columns=TABLE_COLUMNS)
+    if report_path:
+        table.to_csv(report_path, index=False)
+    return table
+
+
+def benchmark_header(input_path, repeats=20):
+    """
+    Time of the header-only read against the streaming scan of the whole file (structure/triage.py)
+    and the full parse of the atoms, per pass over the directory.
+
+    Returns:
+    - dict: seconds per pass of every way.
+    """
+    from structure.pdb_arrays import read_pdb_arrays
+    from structure.triage import scan_pdb
+
+    pdb_paths = [os.path.join(input_path, filename) for filename in sorted(os.listdir(input_path))
+                 if filename.endswith(".pdb")]
+    timings = {}
+    for name, step in [("header", read_pdb_header), ("scan", scan_pdb), ("parse", read_pdb_arrays)]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for pdb_path in pdb_paths:
+                step(pdb_path)
+        timings[name] = (time.perf_counter() - start) / repeats
+        print(f"{name}: {timings[name] * 1e3:.2f} ms for {len(pdb_paths)} file(s)")
+    return timings
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    print(header_table(input_path).to_string(index=False))
+    benchmark_header(input_path)
@@ -0,0 +1,537 @@
+import os
+import re
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from structure.filters import hydrogen_mask, ion_mask, organic_mask, protein_mask, water_mask
+from structure.pdb_arrays import read_pdb_arrays, residue_index
+from structure.spatial_index import spatial_index
+
+# Tokens of the selection language: comparison and logical operators, parentheses,
+# quoted values and bare words (keywords, values, numbers, ranges such as 10-20)
+TOKEN = re.compile(r"""\s*(?:(>=|<=|==|[()<>=,+&|!])|"([^"]*)"|'([^']*)'|([^\s()<>=,+&|!"']+))""")
+
+# Keywords selecting a fixed set of atoms, with their PyMOL short forms
+CONSTANT_KEYWORDS = {
+    "all": "all", "*": "all",
+    "none": "none",
+    "hetatm": "hetatm",
+    "polymer": "protein", "polymer.protein": "protein", "protein": "protein", "pol.": "protein",
+    "organic": "organic", "org.": "organic",
+    "solvent": "solvent", "sol.": "solvent", "water": "solvent",
+    "inorganic": "inorganic", "ino.": "inorganic",
+    "hydrogens": "hydrogens", "hydro": "hydrogens", "h.": "hydrogens",
+    "backbone": "backbone", "bb.": "backbone",
+    "sidechain": "sidechain", "sc.": "sidechain",
+}
+
+# Keywords followed by a "+"-separated value list, e.g. resi 112+137 or resn ATP
+PROPERTY_KEYWORDS = {
+    "name": "name", "n.": "name",
+    "resn": "resn", "r.": "resn",
+    "resi": "resi", "i.": "resi",
+    "chain": "chain", "c.": "chain",
+    "alt": "alt",
+    "elem": "elem", "e.": "elem",
+    "id": "id",
+}
+
+# Keywords compared to a number, e.g. x >= 12.5 or b < 40
+NUMERIC_KEYWORDS = {"x": "x", "y": "y", "z": "z", "b": "b", "q": "q"}
+
+COMPARISONS = {
+    "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal, "=": np.equal, "==": np.equal,
+}
+
+# Modifiers applied to the selection that follows them (up to the next "or")
+PREFIX_KEYWORDS = {"byres": "byres", "br.": "byres", "byresidue": "byres", "bychain": "bychain", "bc.": "bychain"}
+
+# Proximity operators: "S1 within D of S2" and "S1 around D"
+INFIX_KEYWORDS = {"within": "within", "w.": "within", "around": "around", "a.": "around"}
+
+LOGICAL_KEYWORDS = {"and", "or", "not", "of"}
+
+KEYWORDS = (set(CONSTANT_KEYWORDS) | set(PROPERTY_KEYWORDS) | set(NUMERIC_KEYWORDS) | set(PREFIX_KEYWORDS)
+            | set(INFIX_KEYWORDS) | LOGICAL_KEYWORDS)
+
+# Leading "select name," of a PyMOL command, as printed by af2bind_cl.py
+SELECT_COMMAND = re.compile(r"^\s*select\s+[^,]*,")
+
+# "100", "100A", "-5", "10-20" or "10:20"
+RESI_VALUE = re.compile(r"^(-?\d+)([A-Za-z]?)(?:[-:](-?\d+)[A-Za-z]?)?$")
+
+
+def tokenize(text):
+    """
+    Split a selection string into tokens. Quoted values are returned as ("value", text)
+    so that an empty quoted value (alt '') stays a token.
+    """
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Cannot parse selection at {text[position:]!r}")
+        operator, double_quoted, single_quoted, word = match.groups()
+        if operator is not None:
+            tokens.append(operator)
+        elif word is not None:
+            tokens.append(word)
+        else:
+            tokens.append(("value", double_quoted if double_quoted is not None else single_quoted))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser of the PyMOL selection subset used by the project.
+
+    Precedence, from the loosest: "or" (also "|" and "+" between selections),
+    "and" ("&"), the proximity operators "within D of" and "around D", then
+    "not" ("!"). "byres" and "bychain" apply to everything up to the next "or",
+    so "byres (x >= 1) and (y >= 2)" expands the whole box to residues.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of selection")
+        self.position += 1
+        return token
+
+    @staticmethod
+    def word(token):
+        return token.lower() if isinstance(token, str) else None
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty selection")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected token {self.peek()!r} in selection")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.word(self.peek()) in ("or", "|", "+"):
+            self.take()
+            node = ("or", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_proximity()
+        while self.word(self.peek()) in ("and", "&"):
+            self.take()
+            node = ("and", node, self.parse_proximity())
+        return node
+
+    def parse_proximity(self):
+        node = self.parse_unary()
+        while self.word(self.peek()) in INFIX_KEYWORDS:
+            operator = INFIX_KEYWORDS[self.word(self.take())]
+            distance = self.number()
+            if operator == "within":
+                if self.word(self.take()) != "of":
+                    raise ValueError("Expected 'of' after 'within <distance>'")
+                node = ("within", node, distance, self.parse_unary())
+            else:
+                node = ("around", node, distance)
+        return node
+
+    def parse_unary(self):
+        token = self.word(self.peek())
+        if token in ("not", "!"):
+            self.take()
+            return ("not", self.parse_unary())
+        if token in PREFIX_KEYWORDS:
+            self.take()
+            return (PREFIX_KEYWORDS[token], self.parse_and())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.take()
+        word = self.word(token)
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise ValueError("Missing closing parenthesis in selection")
+            return node
+        if word in CONSTANT_KEYWORDS:
+            return ("keyword", CONSTANT_KEYWORDS[word])
+        if word in PROPERTY_KEYWORDS:
+            return ("property", PROPERTY_KEYWORDS[word], self.values())
+        if word in NUMERIC_KEYWORDS:
+            operator = self.take()
+            if operator not in COMPARISONS:
+                raise ValueError(f"Expected a comparison after {token!r}, got {operator!r}")
+            return ("compare", NUMERIC_KEYWORDS[word], operator, self.number())
+        raise ValueError(f"Unknown selection keyword {token!r}")
+
+    def value(self):
+        token = self.take()
+        if isinstance(token, tuple):
+            return token[1]
+        if token in ("(", ")", "<", "<=", ">", ">=", "=", "==", ",", "+", "&", "|", "!"):
+            raise ValueError(f"Expected a value, got {token!r}")
+        return token
+
+    def values(self):
+        # Value list "a+b+c"; a "+" followed by a keyword is an "or" between selections
+        values = [self.value()]
+        while self.peek() == "+" and self.peek(1) is not None and self.peek(1) != "(" and not self.starts_selection(1):
+            self.take()
+            values.append(self.value())
+        return tuple(values)
+
+    def starts_selection(self, offset):
+        # Whether the token at `offset` starts a new selection rather than being a value:
+        # "x", "y", "z", "b" and "q" are keywords only when a comparison follows (chain B+C)
+        word = self.word(self.peek(offset))
+        if word in NUMERIC_KEYWORDS:
+            return self.peek(offset + 1) in COMPARISONS
+        return word in KEYWORDS
+
+    def number(self):
+        token = self.take()
+        try:
+            return float(token)
+        except (TypeError, ValueError):
+            raise ValueError(f"Expected a number, got {token!r}")
+
+
+@lru_cache(maxsize=4096)
+def compile_selection(text):
+    """
+    Compile a PyMOL selection string into a hashable expression tree.
+    A leading "select name," command is ignored. Compiled trees are cached,
+    so the strings built in loops (resi lists, boxes) are parsed once.
+
+    Args:
+    - text (str): selection, e.g. "resi 112 + resi 137" or "not polymer.protein".
+
+    Returns:
+    - tuple: expression tree evaluated by evaluate_selection.
+    """
+    text = SELECT_COMMAND.sub("", text)
+    return _Parser(tokenize(text)).parse()
+
+
+def _residue_values(structure, values):
+    # Mask of the atoms matching resi values: numbers, insertion codes and ranges
+    mask = np.zeros(len(structure), dtype=bool)
+    for value in values:
+        match = RESI_VALUE.match(value)
+        if not match:
+            raise ValueError(f"Invalid resi value {value!r}")
+        start, icode, end = match.groups()
+        if end is not None:
+            mask |= (structure.resi >= int(start)) & (structure.resi <= int(end))
+        else:
+            mask |= (structure.resi == int(start)) & (structure.icode == icode.upper())
+    return mask
+
+
+def _text_values(structure, field, values, ignore_case=True):
+    # Mask of the atoms whose column matches one of the values; "C*" matches by prefix
+    column = getattr(structure, field)
+    if ignore_case:
+        # Upper case column, cached on the structure
+        if ("upper", field) not in structure.cache:
+            structure.cache[("upper", field)] = np.char.upper(column)
+        column = structure.cache[("upper", field)]
+        values = [value.upper() for value in values]
+    exact = [value for value in values if not value.endswith("*")]
+    mask = np.isin(column, exact)
+    for value in values:
+        if value.endswith("*"):
+            mask |= np.char.startswith(column, value[:-1])
+    return mask
+
+
+def _keyword_mask(structure, keyword):
+    if keyword == "all":
+        return np.ones(len(structure), dtype=bool)
+    if keyword == "none":
+        return np.zeros(len(structure), dtype=bool)
+    if keyword == "hetatm":
+        return structure.is_het
+    if keyword == "protein":
+        return protein_mask(structure)
+    if keyword == "organic":
+        return organic_mask(structure)
+    if keyword == "solvent":
+        return water_mask(structure)
+    if keyword == "inorganic":
+        return ion_mask(structure)
+    if keyword == "hydrogens":
+        return hydrogen_mask(structure)
+    backbone = protein_mask(structure) & np.isin(structure.atom_name, ["N", "CA", "C", "O", "OXT"])
+    if keyword == "backbone":
+        return backbone
+    return protein_mask(structure) & ~backbone & ~hydrogen_mask(structure)
+
+
+def _evaluate(structure, node):
+    kind = node[0]
+    if kind == "or":
+        return evaluate_selection(structure, node[1]) | evaluate_selection(structure, node[2])
+    if kind == "and":
+        return evaluate_selection(structure, node[1]) & evaluate_selection(structure, node[2])
+    if kind == "not":
+        return ~evaluate_selection(structure, node[1])
+    if kind == "keyword":
+        return _keyword_mask(structure, node[1])
+    if kind == "compare":
+        _, field, operator, value = node
+        column = {"x": structure.coords[:, 0], "y": structure.coords[:, 1], "z": structure.coords[:, 2],
+                  "b": structure.bfactor, "q": structure.occupancy}[field]
+        return COMPARISONS[operator](column, value)
+    if kind == "property":
+        _, field, values = node
+        if field == "resi":
+            return _residue_values(structure, values)
+        if field == "id":
+            return np.isin(structure.serial, [int(value) for value in values])
+        if field == "chain":
+            return _text_values(structure, "chain", values, ignore_case=False)
+        if field == "alt":
+            return np.isin(structure.altloc, values)
+        return _text_values(structure, {"name": "atom_name", "resn": "resn", "elem": "element"}[field], values)
+    if kind == "byres":
+        rid = residue_index(structure)
+        hit = np.zeros(rid[-1] + 1 if len(rid) else 0, dtype=bool)
+        hit[rid[evaluate_selection(structure, node[1])]] = True
+        return hit[rid]
+    if kind == "bychain":
+        return np.isin(structure.chain, np.unique(structure.chain[evaluate_selection(structure, node[1])]))
+    if kind in ("within", "around"):
+        center = evaluate_selection(structure, node[3] if kind == "within" else node[1])
+        mask = np.zeros(len(structure), dtype=bool)
+        if center.any():
+            mask[spatial_index(structure).atoms_within(structure.coords[center], node[2])] = True
+        if kind == "within":
+            return mask & evaluate_selection(structure, node[1])
+        return mask & ~center
+    raise ValueError(f"Unknown selection node {kind!r}")
+
+
+def evaluate_selection(structure, node):
+    """
+    Evaluate a compiled expression tree on a structure. The mask of every
+    sub-expression is memoized in the structure cache, so selections sharing
+    terms ("polymer.protein", the same resi list, ...) are computed once.
+
+    Returns:
+    - np.ndarray: read-only boolean mask over the atoms.
+    """
+    key = ("selection", node)
+    if key not in structure.cache:
+        mask = np.asarray(_evaluate(structure, node), dtype=bool)
+        mask.flags.writeable = False
+        structure.cache[key] = mask
+    return structure.cache[key]
+
+
+def select(structure, selection):
+    """
+    Atoms of a structure matching a PyMOL selection string.
+
+    Args:
+    - structure (Structure): parsed atoms, see structure.pdb_arrays.
+    - selection (str): PyMOL selection, e.g. "organic", "resn 107", "resi 112 + resi 137"
+                       or "byres ((x >= 1) and (x <= 35)) and ...".
+
+    Returns:
+    - np.ndarray: read-only boolean mask of the selected atoms (copy it before editing in place).
+    """
+    return evaluate_selection(structure, compile_selection(selection))
+
+
+def count_atoms(structure, selection):
+    """
+    Number of atoms matching a selection, as PyMOL's cmd.count_atoms.
+    """
+    return int(np.count_nonzero(select(structure, selection)))
+
+
+def residue_selection(residues):
+    """
+    Chain-aware selection string of residues, grouped per chain in first-seen order,
+    e.g. [("A", 112), ("A", 137), ("B", 40)] -> "(chain A and resi 112+137) or (chain B and resi 40)".
+    Plain resi numbers (no chain) are matched in every chain.
+
+    Args:
+    - residues (list): (chain, resi) tuples and/or resi numbers.
+
+    Returns:
+    - str: PyMOL selection string, also understood by select.
+    """
+    groups = {}
+    for key in residues:
+        chain, resi = key if isinstance(key, tuple) else ("", key)
+        groups.setdefault(chain, []).append(str(resi))
+    terms = []
+    for chain, resis in groups.items():
+        resis = "+".join(dict.fromkeys(resis))
+        terms.append(f"(chain {chain} and resi {resis})" if chain else f"(resi {resis})")
+    if not terms:
+        return "none"
+    return " or ".join(terms)
+
+
+def _atom_keys(structure, mask=None):
+    # Identity of atoms independent of serial numbers and atom order
+    structure = structure if mask is None else structure.subset(mask)
+    return sorted(zip(structure.chain, structure.resi.tolist(), structure.icode, structure.resn,
+                      structure.atom_name, structure.altloc))
+
+
+def conformance_cases(structure, top_n=15, box_size=34):
+    """
+    Selection strings of the shapes the project sends to PyMOL, instantiated on
+    one structure: keyword selections, the ligand by residue name, an af2bind
+    top-N resi list (printed with the "select" command) and a byres box around
+    the ligand or the protein center.
+
+    Returns:
+    - list of str: selection strings.
+    """
+    cases = ["polymer.protein", "not polymer.protein", "organic", "hetatm", "solvent", "hydrogens",
+             "polymer.protein and not hydrogens", "bychain organic", "byres (polymer.protein within 5 of organic)",
+             "solvent around 3.5", "name CA and b < 30", "elem C+N+O and not hetatm"]
+    ligands = np.unique(structure.resn[organic_mask(structure)])
+    if len(ligands):
+        cases.append(f"resn {ligands[0]}")
+        cases.append(f"polymer.protein and byres (resn {ligands[0]} around 5)")
+    protein = protein_mask(structure)
+    residues = np.unique(structure.resi[protein & (structure.atom_name == "CA")])
+    if len(residues):
+        picked = residues[np.linspace(0, len(residues) - 1, min(top_n, len(residues))).astype(int)]
+        cases.append("select chA, " + " +".join(f" resi {resi}" for resi in picked).strip())
+        cases.append("resi " + "+".join(map(str, picked)))
+        cases.append(f"resi {picked[0]}-{picked[-1]} and name CA")
+        center = structure.coords[organic_mask(structure)].mean(axis=0) if len(ligands) else \
+            structure.coords[protein].mean(axis=0)
+        low, high = center - box_size / 2, center + box_size / 2
+        cases.append("byres ((x >= {}) and (x <= {})) and ((y >= {}) and (y <= {})) and ((z >= {}) and (z <= {}))"
+                     .format(low[0], high[0], low[1], high[1], low[2], high[2]))
+    return cases
+
+
+def _pymol_serials(pdb_path, cases):
+    # Atom ids selected by PyMOL for every case, or None when PyMOL is not installed
+    try:
+        from pymol import cmd
+    except ImportError:
+        return None
+    cmd.reinitialize()
+    cmd.load(pdb_path, "target")
+    serials = {}
+    for case in cases:
+        try:
+            serials[case] = sorted(cmd.identify(f"target and ({SELECT_COMMAND.sub('', case)})"))
+        except Exception as e:
+            serials[case] = e
+    return serials
+
+
+def conformance_suite(input_directory, reference_directory=None, repeats=100):
+    """
+    Conformance of the compiled selections on a directory of PDB files.
+
+    Every case of conformance_cases is checked against:
+    - PyMOL itself (cmd.identify) when PyMOL is importable;
+    - the PyMOL files of reference_directory (`*_rmnpn.pdb`, saved after
+      remove("not polymer.protein")) for "polymer.protein";
+    - masks built without the compiler for the resi lists and the box.
+    The keywords are compiled to the masks of structure.filters, so they have no
+    reference here without PyMOL: tests/test_selection.py checks them against counts
+    taken by hand from the PDB records and against a hand-built structure.
+    The evaluation time of an uncached selection is measured as well.
+
+    Args:
+    - input_directory (str): Path to the directory containing PDB files, e.g. input_pdb_files.
+    - reference_directory (str, optional): directory with the PyMOL `*_rmnpn.pdb` files.
+    - repeats (int): number of timed evaluations per selection.
+
+    Returns:
+    - pd.DataFrame: one row per structure, selection and reference, with the atom
+                    counts, whether they agree and the evaluation time in microseconds.
+    """
+    rows = []
+    for filename in sorted(os.listdir(input_directory)):
+        if not filename.endswith(".pdb"):
+            continue
+        try:
+            pdb_path = os.path.join(input_directory, filename)
+            structure = read_pdb_arrays(pdb_path)
+            cases = conformance_cases(structure)
+            pymol_serials = _pymol_serials(pdb_path, cases)
+
+            # Masks built without the compiler for the resi lists and the box
+            index = spatial_index(structure)
+            equivalents = {}
+            for case in cases:
+                if case.startswith("resi ") and "+" in case:
+                    values = [int(value) for value in case[5:].split("+")]
+                    equivalents[case] = np.isin(structure.resi, values) & (structure.icode == "")
+                elif case.startswith("byres ((x"):
+                    bounds = [float(value) for value in re.findall(r"[<>]= (-?[\d.]+)", case)]
+                    low, high = np.array(bounds[0::2]), np.array(bounds[1::2])
+                    inside = index.residues_in_box((low + high) / 2, high - low)
+                    equivalents[case] = np.isin(residue_index(structure), inside)
+
+            for case in cases:
+                mask = select(structure, case)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    structure.cache = {key: value for key, value in structure.cache.items() if key[0] != "selection"}
+                    select(structure, case)
+                microseconds = (time.perf_counter() - start) / repeats * 1e6
+                references = {}
+                if case in equivalents:
+                    references["arrays"] = _atom_keys(structure, equivalents[case])
+                if pymol_serials is not None:
+                    serials = pymol_serials[case]
+                    if not isinstance(serials, Exception):
+                        references["pymol"] = _atom_keys(structure, np.isin(structure.serial, serials))
+                if case == "polymer.protein" and reference_directory:
+                    reference_pdb = os.path.join(reference_directory, os.path.splitext(filename)[0] + "_rmnpn.pdb")
+                    if os.path.isfile(reference_pdb):
+                        references["pymol_file"] = _atom_keys(read_pdb_arrays(reference_pdb))
+                selected = _atom_keys(structure, mask)
+                for reference, keys in references.items():
+                    rows.append({"structure": filename, "selection": case, "reference": reference,
+                                 "atoms": len(selected), "expected": len(keys), "agree": selected == keys,
+                                 "microseconds": microseconds})
+                if not references:
+                    rows.append({"structure": filename, "selection": case, "reference": None,
+                                 "atoms": len(selected), "expected": None, "agree": None,
+                                 "microseconds": microseconds})
+            report = [row for row in rows if row["structure"] == filename and row["agree"] is not None]
+            print(f"{filename}: {sum(row['agree'] for row in report)}/{len(report)} checks agree")
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    report = conformance_suite(os.path.join(current_directory, "input_pdb_files"),
+                               os.path.join(current_directory, "output_pdb_files"))
+    print(report.groupby("structure")[["agree", "microseconds"]].agg({"agree": "mean", "microseconds": "median"}))
+    print(report[report["agree"] == False].to_string(index=False))
@@ -0,0 +1,177 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from structure.pdb_arrays import read_pdb_arrays, residue_index
+
+# Masked KD-trees kept per SpatialIndex, see SpatialIndex.nearest
+MASKED_TREES = 8
+
+
+class SpatialIndex:
+    """
+    KD-tree over the atom coordinates of one structure, answering radius, box
+    and k-nearest queries at atom or residue level.
+
+    Build it through spatial_index(structure) so it is built once and cached
+    with the structure.
+    """
+
+    def __init__(self, structure):
+        self.structure = structure
+        self.tree = cKDTree(structure.coords)
+        self.residue_of_atom = residue_index(structure)
+        # Trees over the atoms of a mask for nearest(mask=...), least recently used first
+        self.masked_trees = OrderedDict()
+
+    def _atom_mask(self, atoms, mask):
+        # Restrict atom indices to an optional boolean mask over the structure
+        if mask is None:
+            return atoms
+        return atoms[mask[atoms]]
+
+    def atoms_within(self, points, radius, mask=None):
+        """
+        Atoms within `radius` of any of the query points.
+
+        Args:
+        - points (np.ndarray): (3,) or (M, 3) query coordinates, e.g. ligand atoms.
+        - radius (float): distance cutoff in Angstrom.
+        - mask (np.ndarray, optional): boolean mask restricting the returned atoms.
+
+        Returns:
+        - np.ndarray: sorted unique atom indices.
+        """
+        points = np.atleast_2d(points)
+        hits = self.tree.query_ball_point(points, r=radius, return_sorted=False)
+        if len(hits) == 0:
+            return np.empty(0, dtype=int)
+        atoms = np.unique(np.concatenate([np.asarray(hit, dtype=int) for hit in hits]))
+        return self._atom_mask(atoms, mask)
+
+    def atoms_in_box(self, center, size, mask=None):
+        """
+        Atoms inside an axis-aligned box.
+
+        Args:
+        - center (tuple): box center (x, y, z).
+        - size (float or tuple): edge length, or (size_x, size_y, size_z).
+        - mask (np.ndarray, optional): boolean mask restricting the returned atoms.
+
+        Returns:
+        - np.ndarray: sorted atom indices.
+        """
+        center = np.asarray(center, dtype=float)
+        half = np.broadcast_to(np.asarray(size, dtype=float) / 2, (3,))
+        # Chebyshev ball of the largest half edge, then clip the other axes
+        atoms = np.asarray(self.tree.query_ball_point(center, r=half.max(), p=np.inf), dtype=int)
+        inside = np.all(np.abs(self.structure.coords[atoms] - center) <= half, axis=1)
+        return self._atom_mask(np.sort(atoms[inside]), mask)
+
+    def nearest(self, points, k=1, mask=None):
+        """
+        The k nearest atoms of every query point. k is clamped to the number of
+        atoms (in the mask), so every returned neighbor is a real atom.
+
+        Returns:
+        - (np.ndarray, np.ndarray): distances and atom indices, shape (M, k).
+        """
+        points = np.atleast_2d(points)
+        if mask is None:
+            candidates, tree = None, self.tree
+        else:
+            # Query a tree over the masked atoms only, the last MASKED_TREES masks are kept
+            candidates = np.flatnonzero(mask)
+            key = candidates.tobytes()
+            if key in self.masked_trees:
+                self.masked_trees.move_to_end(key)
+            else:
+                self.masked_trees[key] = cKDTree(self.structure.coords[candidates])
+                if len(self.masked_trees) > MASKED_TREES:
+                    self.masked_trees.popitem(last=False)
+            tree = self.masked_trees[key]
+        k = min(k, tree.n)
+        if k == 0:
+            return np.empty((len(points), 0)), np.empty((len(points), 0), dtype=int)
+        distances, atoms = tree.query(points, k=k)
+        if candidates is not None:
+            atoms = candidates[atoms]
+        return distances.reshape(len(points), k), atoms.reshape(len(points), k)
+
+    def residues_of(self, atoms):
+        """
+        Collapse atom indices to the sorted unique residue indices they belong to.
+        """
+        return np.unique(self.residue_of_atom[atoms])
+
+    def residues_within(self, points, radius, mask=None):
+        """
+        Residues with at least one atom within `radius` of the query points.
+        """
+        return self.residues_of(self.atoms_within(points, radius, mask=mask))
+
+    def residues_in_box(self, center, size, mask=None):
+        """
+        Residues with at least one atom inside the box (PyMOL "byres" box selection).
+        """
+        return self.residues_of(self.atoms_in_box(center, size, mask=mask))
+
+    def nearest_residues(self, points, k=1, mask=None):
+        """
+        Residues of the k nearest atoms of the query points.
+        """
+        _, atoms = self.nearest(points, k=k, mask=mask)
+        return self.residues_of(atoms.ravel())
+
+    def residue_atoms(self, residues):
+        """
+        Expand residue indices to all of their atom indices.
+        """
+        return np.flatnonzero(np.isin(self.residue_of_atom, residues))
+
+    def residue_keys(self, residues):
+        """
+        Residue-level table for residue indices: list of (chain, resi, icode, resn).
+        """
+        first_atom = np.searchsorted(self.residue_of_atom, residues)
+        structure = self.structure
+        return [
+            (str(structure.chain[i]), int(structure.resi[i]), str(structure.icode[i]), str(structure.resn[i]))
+            for i in first_atom
+        ]
+
+
+def spatial_index(structure):
+    """
+    Return the SpatialIndex of a structure, building it on first use.
+    """
+    if "spatial_index" not in structure.cache:
+        structure.cache["spatial_index"] = SpatialIndex(structure)
+    return structure.cache["spatial_index"]
+
+
+def pocket_residues(structure, ligand_atoms, radius=5.0):
+    """
+    Pocket-lining protein residues around a ligand.
+
+    Args:
+    - structure (Structure): parsed structure, see structure.pdb_arrays.
+    - ligand_atoms (np.ndarray): atom indices of the ligand, e.g. from perceive_ligands.
+    - radius (float): distance cutoff in Angstrom, 5 A by default.
+
+    Returns:
+    - list of tuple: (chain, resi, icode, resn) of every lining residue.
+    """
+    index = spatial_index(structure)
+    residues = index.residues_within(structure.coords[ligand_atoms], radius, mask=~structure.is_het)
+    return index.residue_keys(residues)
+
+
+if __name__ == "__main__":
+    structure = read_pdb_arrays(os.path.join(os.getcwd(), "input_pdb_files", "1sqt.pdb"))
+    index = spatial_index(structure)
+    ligand = np.flatnonzero(structure.resn == "UI3")
+    print("Residues within 5 A of UI3:", pocket_residues(structure, ligand))
+    print("Residues in the 24 A box:", len(index.residues_in_box(structure.coords[ligand].mean(axis=0), 24)))
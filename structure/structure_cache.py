@@ -0,0 +1,280 @@
+import hashlib
+import io
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from structure.pdb_arrays import _ARRAY_FIELDS, Structure, parse_pdb_arrays, read_pdb_arrays, residue_index
+from structure.pdb_header import parse_pdb_header
+
+# Binary structure file: MAGIC, FORMAT_VERSION and the length of the JSON header (little-endian),
+# then the JSON header and the raw arrays, every block starting on an ALIGNMENT boundary
+MAGIC = b"PPSTRUCT"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sIQ")
+
+# Extension of the cached structures
+EXTENSION = ".struct"
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def residue_tables(structure):
+    """
+    Residue and chain index tables of a Structure, for slicing without scanning the atoms.
+
+    Returns:
+    - dict: residue_start (n_residues + 1 atom offsets), chain_start (atom offsets of the
+            runs of consecutive atoms of one chain, and the end) and chain_id (chain of every run).
+    """
+    rid = residue_index(structure)
+    residue_start = np.flatnonzero(np.r_[True, rid[1:] != rid[:-1]])
+    chain_start = np.flatnonzero(np.r_[True, structure.chain[1:] != structure.chain[:-1]])
+    return {
+        "residue_start": np.r_[residue_start, len(structure)].astype("<i8"),
+        "chain_start": np.r_[chain_start, len(structure)].astype("<i8"),
+        "chain_id": structure.chain[chain_start],
+    }
+
+
+def write_structure_cache(structure, cache_path, metadata=None):
+    """
+    Write a Structure, its residue/chain tables and metadata as one binary file.
+
+    The arrays keep the dtypes of the Structure (fixed-width unicode text, int64 and
+    float64 numbers), so load_structure_cache maps them back without any conversion.
+    The file is written next to cache_path and renamed, readers never see a partial file.
+
+    Args:
+    - structure (Structure): atoms to write.
+    - cache_path (str): Path of the binary file.
+    - metadata (dict, optional): JSON-serializable data stored with the arrays, e.g. header fields.
+
+    Returns:
+    - str: cache_path
+    """
+    arrays = {key: getattr(structure, key) for key in _ARRAY_FIELDS}
+    arrays["residue_index"] = residue_index(structure)
+    arrays.update(residue_tables(structure))
+
+    # Lay out the arrays after the JSON header, which holds their dtype, shape and offset
+    layout, offset = {}, 0
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder("<"))
+        arrays[key] = array
+        layout[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        "name": structure.name,
+        "atoms": len(structure),
+        "residues": len(arrays["residue_start"]) - 1,
+        "metadata": metadata or {},
+        "arrays": layout,
+    }).encode()
+    data_offset = _aligned(_PREFIX.size + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.uname().nodename}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as cache_file:
+        cache_file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        cache_file.write(header)
+        for key, array in arrays.items():
+            cache_file.seek(data_offset + layout[key]["offset"])
+            cache_file.write(array.tobytes())
+        cache_file.truncate(data_offset + offset)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def load_structure_cache(cache_path):
+    """
+    Memory-map a binary structure file: the arrays of the Structure are read-only views
+    of the file, the pages are read when the stage touches them.
+
+    The residue index, the residue/chain tables and the metadata are put in the cache of
+    the Structure (residue_index, residue_start, chain_start, chain_id, metadata).
+
+    Args:
+    - cache_path (str): file written by write_structure_cache.
+
+    Returns:
+    - Structure: per-atom arrays mapped from the file.
+    """
+    with open(cache_path, "rb") as cache_file:
+        buffer = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_length = _PREFIX.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{cache_path} is not a structure cache file of version {FORMAT_VERSION}")
+    header = json.loads(buffer[_PREFIX.size:_PREFIX.size + header_length])
+    data_offset = _aligned(_PREFIX.size + header_length)
+
+    arrays = {}
+    for key, layout in header["arrays"].items():
+        dtype = np.dtype(layout["dtype"])
+        arrays[key] = np.frombuffer(buffer, dtype=dtype, count=math.prod(layout["shape"]),
+                                    offset=data_offset + layout["offset"]).reshape(layout["shape"])
+
+    structure = Structure(name=header["name"], **{key: arrays[key] for key in _ARRAY_FIELDS})
+    for key in ("residue_index", "residue_start", "chain_start", "chain_id"):
+        structure.cache[key] = arrays[key]
+    structure.cache["metadata"] = header["metadata"]
+    return structure
+
+
+def residue_slice(structure, start, stop):
+    """
+    Residues start..stop-1 (in file order, see residue_index) of a mapped Structure,
+    as views of its arrays (no copy).
+    """
+    residue_start = structure.cache["residue_start"]
+    return structure.subset(slice(residue_start[start], residue_start[stop]))
+
+
+def chain_slice(structure, chain):
+    """
+    Atoms of one chain of a mapped Structure: views of its arrays when the chain is one
+    run of consecutive atoms (the usual layout), a copy when its atoms are split,
+    e.g. by HETATM records written after the other chains.
+    """
+    chain_start, chain_id = structure.cache["chain_start"], structure.cache["chain_id"]
+    runs = np.flatnonzero(chain_id == chain)
+    if len(runs) == 0:
+        raise ValueError(f"Chain {chain} not found in {structure.name}")
+    if len(runs) == 1:
+        return structure.subset(slice(chain_start[runs[0]], chain_start[runs[0] + 1]))
+    return structure.subset(np.concatenate([np.arange(chain_start[run], chain_start[run + 1]) for run in runs]))
+
+
+def cache_path_for(pdb_path, cache_directory, model_index=1):
+    """
+    File of a PDB file in the cache directory: its stem, and a digest of its absolute
+    path and model so files of the same name in different directories do not collide.
+    """
+    pdb_path = os.path.abspath(pdb_path)
+    digest = hashlib.sha1(f"{pdb_path}:{model_index}".encode()).hexdigest()[:10]
+    name = os.path.splitext(os.path.basename(pdb_path))[0]
+    return os.path.join(cache_directory, f"{name}-{digest}{EXTENSION}")
+
+
+def _source_stamp(pdb_path):
+    # Size and modification time of the PDB file, to detect a changed source
+    stat = os.stat(pdb_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def load_structure(pdb_path, cache_directory=None, model_index=1):
+    """
+    Structure of a PDB file, parsed once and then memory-mapped from the cache directory.
+
+    The cached file is used while the PDB file keeps its size and modification time,
+    otherwise the PDB file is parsed again and the cached file replaced.
+    Without cache directory, the PDB file is parsed (read_pdb_arrays).
+
+    Args:
+    - pdb_path (str): Path to a local PDB file.
+    - cache_directory (str, optional): directory of the binary structure files.
+    - model_index (int): Model to extract for multi-model files, 1 by default.
+
+    Returns:
+    - Structure: per-atom arrays, named after the file stem.
+    """
+    if cache_directory is None:
+        return read_pdb_arrays(pdb_path, model_index)
+    cache_path = cache_path_for(pdb_path, cache_directory, model_index)
+    stamp = _source_stamp(pdb_path)
+    if os.path.isfile(cache_path):
+        try:
+            structure = load_structure_cache(cache_path)
+            metadata = structure.cache["metadata"]
+            if all(metadata.get(key) == value for key, value in stamp.items()):
+                return structure
+        except Exception as e:
+            print(f"Unreadable structure cache {cache_path}, parsing {pdb_path} again: {e}")
+
+    # Parse the PDB text once, and keep the header fields (see pdb_header.py) with the arrays
+    with open(pdb_path, "rb") as pdb_file:
+        pdb_bytes = pdb_file.read()
+    name = os.path.splitext(os.path.basename(pdb_path))[0]
+    structure = parse_pdb_arrays(pdb_bytes, name=name, model_index=model_index)
+    metadata = {**parse_pdb_header(io.BytesIO(pdb_bytes)).row(), **stamp, "source": os.path.abspath(pdb_path),
+                "model_index": model_index}
+    write_structure_cache(structure, cache_path, metadata)
+    structure.cache["metadata"] = metadata
+    return structure
+
+
+def build_cache(input_path, cache_directory, model_index=1):
+    """
+    Write the binary structure file of every PDB file in a directory (up-to-date ones are kept).
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - cache_directory (str): directory of the binary structure files.
+    - model_index (int): Model to extract for multi-model files, 1 by default.
+
+    Returns:
+    - list of str: the binary structure files.
+    """
+    cache_paths = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            try:
+                pdb_path = os.path.join(input_path, filename)
+                load_structure(pdb_path, cache_directory, model_index)
+                cache_paths.append(cache_path_for(pdb_path, cache_directory, model_index))
+            except Exception as e:
+                print(f"Error caching {filename}: {e}")
+    print(f"{len(cache_paths)} structure(s) cached in {cache_directory}")
+    return cache_paths
+
+
+def benchmark_cache(input_path, cache_directory, repeats=20):
+    """
+    Time to get the Structure of every PDB file of a directory: parsing the text,
+    parsing and writing the cached file (first load), and mapping the cached file,
+    and the size of the cached files against the PDB files.
+
+    Returns:
+    - dict: seconds per structure of every way, and the size ratio.
+    """
+    pdb_paths = [os.path.join(input_path, filename) for filename in sorted(os.listdir(input_path))
+                 if filename.endswith(".pdb")]
+    # First load: parse and write the cached files
+    for pdb_path in pdb_paths:
+        cache_path = cache_path_for(pdb_path, cache_directory)
+        if os.path.isfile(cache_path):
+            os.remove(cache_path)
+    start = time.perf_counter()
+    for pdb_path in pdb_paths:
+        load_structure(pdb_path, cache_directory)
+    timings = {"first_load": (time.perf_counter() - start) / len(pdb_paths)}
+
+    for name, step in [("parse", read_pdb_arrays), ("cached", lambda path: load_structure(path, cache_directory))]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for pdb_path in pdb_paths:
+                step(pdb_path)
+        timings[name] = (time.perf_counter() - start) / (repeats * len(pdb_paths))
+
+    text_size = sum(os.path.getsize(pdb_path) for pdb_path in pdb_paths)
+    cache_size = sum(os.path.getsize(cache_path_for(pdb_path, cache_directory)) for pdb_path in pdb_paths)
+    timings["size_ratio"] = cache_size / text_size
+    print(f"{len(pdb_paths)} file(s): parse {timings['parse'] * 1e3:.2f} ms, "
+          f"parse and cache {timings['first_load'] * 1e3:.2f} ms, "
+          f"cached {timings['cached'] * 1e6:.0f} us per structure; "
+          f"cache files {timings['size_ratio']:.2f}x the PDB size")
+    return timings
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    cache_directory = os.path.join(os.getcwd(), "structure_cache")
+    benchmark_cache(input_path, cache_directory)
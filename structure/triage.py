@@ -0,0 +1,221 @@
+import os
+import time
+
+import pandas as pd
+
+from structure.filters import AMINO_ACIDS, WATER_RESN
+
+# Largest structure sent to the preparation stages, in atoms of the first model
+MAX_ATOMS = 100000
+
+# Routes of a scanned file:
+# - "holo": protein with at least one ligand, for the ligand-based stages (pockets, ligand files)
+# - "apo": protein without ligand (or without the requested one), for af2bind-based grid boxes
+# - "skip": nothing to prepare (no atoms, no protein) or over max_atoms
+ROUTES = ("holo", "apo", "skip")
+
+REPORT_COLUMNS = ["target", "route", "reason", "atoms", "hetatm", "models", "chains", "protein_residues",
+                  "ligands", "het_resn", "assembly_copies", "resolution", "bytes"]
+
+
+def scan_pdb(pdb_path):
+    """
+    Stream the records of a PDB file once and count what the stages need to know,
+    without parsing coordinates or building arrays.
+
+    Residue names, chains and residue numbers are sliced from the fixed columns of the
+    ATOM/HETATM records of the first model, the other models are only counted.
+    HETATM residues count as ligand instances like in ligand_sites.perceive_ligands
+    (organic: not water, at least 2 atoms, carbon), unless SEQRES/MODRES list them as
+    polymer residues, which stands for the peptide bonds checked by filters.protein_mask.
+
+    The CA records also give the observed residues of every chain, in file order, for
+    the sequence clustering of protein_preprocessing/dedup.py.
+
+    Args:
+    - pdb_path (str): PDB file.
+
+    Returns:
+    - dict: atoms, hetatm, models, chains, protein_residues, ligands {resn: instances},
+            het_resn (all HETATM residue names), assembly_copies, bytes, resolution (or None),
+            residues {chain: [(resi with insertion code, resn)]} and seqres {chain: length}.
+    """
+    atoms = hetatm = models = 0
+    chains, protein_residues, polymer_resn = {}, {}, set(AMINO_ACIDS)
+    seqres, resolution = {}, None
+    het_residues = {}
+    assembly_copies, biomolecule = 0, None
+    first_model = True
+    with open(pdb_path, "rb") as pdb_file:
+        for line in pdb_file:
+            record = line[:6]
+            if record == b"ATOM  " or record == b"HETATM":
+                if not first_model:
+                    continue
+                atoms += 1
+                chain = line[21:22]
+                if record == b"ATOM  ":
+                    chains[chain] = True
+                    if line[12:16] == b" CA ":
+                        protein_residues.setdefault((chain, line[22:27]), line[17:20])
+                else:
+                    hetatm += 1
+                    key = (chain, line[22:27], line[17:20].strip())
+                    counts = het_residues.setdefault(key, [0, False])
+                    counts[0] += 1
+                    element = line[76:78].strip() or line[12:14].strip().lstrip(b"0123456789")[:1]
+                    counts[1] |= element == b"C"
+            elif record == b"MODEL ":
+                models += 1
+            elif record == b"ENDMDL":
+                first_model = False
+            elif record == b"SEQRES":
+                polymer_resn.update(resn.decode() for resn in line[19:70].split())
+                seqres[line[11:12].decode().strip()] = int(line[13:17])
+            elif record == b"REMARK" and line[7:10] == b"  2" and line[11:22] == b"RESOLUTION.":
+                try:
+                    resolution = float(line[22:30])
+                except ValueError:
+                    resolution = None
+            elif record == b"MODRES":
+                polymer_resn.add(line[12:15].strip().decode())
+            elif record == b"REMARK" and line[7:10] == b"350":
+                # Operators of the first biological assembly
+                text = line[10:].strip()
+                if text.startswith(b"BIOMOLECULE:"):
+                    biomolecule = biomolecule or int(text.split(b":")[1])
+                    if int(text.split(b":")[1]) != biomolecule:
+                        biomolecule = -1
+                elif text.startswith(b"BIOMT1") and biomolecule not in (None, -1):
+                    assembly_copies += 1
+
+    ligands, het_resn = {}, set()
+    water = set(WATER_RESN)
+    for (chain, resi, resn), (n_atoms, has_carbon) in het_residues.items():
+        resn = resn.decode()
+        het_resn.add(resn)
+        if resn in water or resn in polymer_resn or n_atoms < 2 or not has_carbon:
+            continue
+        ligands[resn] = ligands.get(resn, 0) + 1
+
+    residues = {}
+    for (chain, resi), resn in protein_residues.items():
+        residues.setdefault(chain.decode().strip(), []).append((resi.decode().strip(), resn.decode().strip()))
+
+    return {
+        "atoms": atoms,
+        "hetatm": hetatm,
+        "models": max(models, 1 if atoms else 0),
+        "chains": "".join(chain.decode().strip() or "_" for chain in chains),
+        "protein_residues": len(protein_residues),
+        "ligands": ligands,
+        "het_resn": sorted(het_resn - water),
+        "assembly_copies": assembly_copies,
+        "bytes": os.path.getsize(pdb_path),
+        "resolution": resolution,
+        "residues": residues,
+        "seqres": seqres,
+    }
+
+
+def classify(scan, resn=None, max_atoms=MAX_ATOMS):
+    """
+    Route of a scanned file, see ROUTES.
+
+    Args:
+    - scan (dict): counts from scan_pdb.
+    - resn (str, optional): ligand the target must contain, e.g. from fetch_ligand_name.
+    - max_atoms (int): larger structures are skipped.
+
+    Returns:
+    - (str, str): route and reason.
+    """
+    if scan["atoms"] == 0:
+        return "skip", "no atoms"
+    if scan["protein_residues"] == 0:
+        return "skip", "no protein"
+    if scan["atoms"] > max_atoms:
+        return "skip", f"{scan['atoms']} atoms > {max_atoms}"
+    if resn is not None:
+        if resn not in scan["ligands"]:
+            return "apo", f"ligand {resn} not found"
+        return "holo", f"{scan['ligands'][resn]} {resn} instance(s)"
+    if not scan["ligands"]:
+        return "apo", "no ligand"
+    return "holo", f"{sum(scan['ligands'].values())} ligand instance(s)"
+
+
+def triage_directory(input_path, resn=None, max_atoms=MAX_ATOMS, report_path=None):
+    """
+    Pre-flight pass over the PDB files of a directory: scan and route every file
+    before any expensive stage runs, and print a summary.
+
+    Args:
+    - input_path (str): Path to the directory containing PDB files.
+    - resn (str or dict, optional): required ligand, for all the files or {target: resn}.
+    - max_atoms (int): larger structures are skipped.
+    - report_path (str, optional): CSV file of the report.
+
+    Returns:
+    - pd.DataFrame: one row per file with the columns REPORT_COLUMNS.
+    """
+    start = time.perf_counter()
+    rows = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename.endswith(".pdb"):
+            target = os.path.splitext(filename)[0]
+            try:
+                scan = scan_pdb(os.path.join(input_path, filename))
+                required = resn.get(target) if isinstance(resn, dict) else resn
+                route, reason = classify(scan, required, max_atoms)
+            except Exception as e:
+                scan, route, reason = {}, "skip", f"unreadable: {e}"
+            rows.append({**scan, "target": target, "route": route, "reason": reason,
+                         "ligands": " ".join(f"{name}x{count}" for name, count in scan.get("ligands", {}).items()),
+                         "het_resn": " ".join(scan.get("het_resn", []))})
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+    counts = report["route"].value_counts()
+    print(f"Triage of {len(report)} file(s) in {time.perf_counter() - start:.2f} s: "
+          + ", ".join(f"{counts.get(route, 0)} {route}" for route in ROUTES))
+    for _, row in report[report["route"] != "holo"].iterrows():
+        print(f"  {row['target']}: {row['route']} ({row['reason']})")
+    if report_path:
+        report.to_csv(report_path, index=False)
+    return report
+
+
+def routed_files(report, input_path, routes=("holo",)):
+    """
+    Paths of the files of a triage report on the given routes, in report order.
+    """
+    return [os.path.join(input_path, f"{target}.pdb") for target in report.loc[report["route"].isin(routes), "target"]]
+
+
+def benchmark_triage(input_path, repeats=3):
+    """
+    Time of the scan against the full parse and ligand perception it saves on the skipped files.
+
+    Returns:
+    - dict: seconds per pass over the directory for the scan and for the full parse.
+    """
+    from grid_box.ligand_sites import perceive_ligands
+    from structure.pdb_arrays import read_pdb_arrays
+
+    pdb_paths = [os.path.join(input_path, filename) for filename in sorted(os.listdir(input_path))
+                 if filename.endswith(".pdb")]
+    timings = {}
+    for name, step in [("scan", scan_pdb), ("parse_and_ligands", lambda path: perceive_ligands(read_pdb_arrays(path)))]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for pdb_path in pdb_paths:
+                step(pdb_path)
+        timings[name] = (time.perf_counter() - start) / repeats
+        print(f"{name}: {timings[name] * 1e3:.1f} ms for {len(pdb_paths)} file(s)")
+    return timings
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(os.getcwd(), "input_pdb_files")
+    print(triage_directory(input_path).to_string(index=False))
+    benchmark_triage(input_path)
@@ -0,0 +1,26 @@
+import os
+import stat
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def stub_obabel(tmp_path, monkeypatch):
+    """
+    Install a stand-in for obabel: a Python script with the given body, found first
+    on the PATH (shutil.which and the shell-outs) for the duration of the test.
+
+    Returns:
+    - function: script body -> path of the stub.
+    """
+    def install(script):
+        bin_directory = tmp_path / "bin"
+        bin_directory.mkdir(exist_ok=True)
+        obabel = bin_directory / "obabel"
+        obabel.write_text(f"#!{sys.executable}\n{script}")
+        obabel.chmod(obabel.stat().st_mode | stat.S_IEXEC)
+        monkeypatch.setenv("PATH", f"{bin_directory}{os.pathsep}{os.environ['PATH']}")
+        return obabel
+
+    return install
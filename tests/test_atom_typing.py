@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from protein_preprocessing.atom_typing import autodock_types, gasteiger_charges, merge_nonpolar_hydrogens
+from protein_preprocessing.pdbqt_writer import read_pdbqt
+from structure.bonds import bond_graph
+from structure.pdb_arrays import read_pdb_arrays
+
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "output_files")
+
+# Atoms typed differently from the obabel PDBQT: residues left distorted by the obabel
+# minimization (N-CB "bonds" of 1.86 A, alternate locations of a peptide bond)
+DISTORTED = {"1d3g": 7, "1sqt": 0, "1udt": 0, "1uyg": 0, "6o0k": 2}
+
+
+def _typed(name):
+    # Native types of the minimized receptor and obabel's types of the same atoms
+    structure = read_pdb_arrays(os.path.join(OUTPUT_PATH, f"{name}_rmnpn_minimized.pdb"))
+    types = autodock_types(structure, bond_graph(structure))
+    reference, reference_types, _ = read_pdbqt(os.path.join(OUTPUT_PATH, f"{name}_rmnpn_protein.pdbqt"))
+    distances, native = cKDTree(structure.coords).query(reference.coords)
+    assert np.all(distances < 0.01)
+    return structure.subset(native), types[native], reference_types
+
+
+@pytest.mark.parametrize("name", sorted(DISTORTED))
+def test_types_match_obabel(name):
+    _, types, reference_types = _typed(name)
+    assert np.count_nonzero(types != reference_types) == DISTORTED[name]
+
+
+def test_aromatic_rings_and_nitrogens_of_6o0k():
+    structure, types, _ = _typed("6o0k")
+
+    def typed(resn, resi, name):
+        return types[(structure.resn == resn) & (structure.resi == resi) & (structure.atom_name == name)][0]
+
+    # Phenyl ring and the TRP benzene ring are aromatic, the TRP pyrrole ring has no N-H here
+    assert typed("TYR", 9, "CG") == "A" and typed("TRP", 144, "CZ2") == "A"
+    assert typed("TRP", 144, "CD1") == "C"
+    # A ring carbon with an extra hydrogen breaks the aromaticity of its ring
+    assert typed("TRP", 30, "CZ2") == "C" and typed("TYR", 180, "CZ") == "C"
+    # Peptide N, amine N of a chain break, ammonium and guanidinium nitrogens
+    assert typed("TYR", 18, "N") == "N" and typed("SER", 24, "N") == "NA"
+    assert set(types[structure.atom_name == "NZ"]) == {"N"}
+    assert set(types[structure.atom_name == "NH1"]) == {"NA"}
+    assert set(types[structure.element == "S"]) == {"S"}
+
+
+def _molecule(tmp_path, atoms):
+    # One HETATM residue from (name, element, (x, y, z)) tuples
+    pdb_path = tmp_path / "molecule.pdb"
+    with open(pdb_path, "w") as pdb_file:
+        for serial, (name, element, (x, y, z)) in enumerate(atoms, 1):
+            pdb_file.write(f"HETATM{serial:5d} {name:<4} LIG A   1    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00"
+                           f"          {element:>2}\n")
+    return read_pdb_arrays(str(pdb_path))
+
+
+def test_gasteiger_charges_of_small_molecules(tmp_path):
+    # Gasteiger-Marsili charges of Open Babel and RDKit: methane C -0.0776, H 0.0194; water O -0.4105, H 0.2052
+    d = 0.629
+    methane = _molecule(tmp_path, [("C", "C", (0, 0, 0)), ("H1", "H", (d, d, d)), ("H2", "H", (-d, -d, d)),
+                                   ("H3", "H", (-d, d, -d)), ("H4", "H", (d, -d, -d))])
+    assert np.allclose(gasteiger_charges(methane), [-0.0776, 0.0194, 0.0194, 0.0194, 0.0194], atol=1e-4)
+    water = _molecule(tmp_path, [("O", "O", (0, 0, 0)), ("H1", "H", (0.757, 0.586, 0)), ("H2", "H", (-0.757, 0.586, 0))])
+    assert np.allclose(gasteiger_charges(water), [-0.4105, 0.2052, 0.2052], atol=1e-4)
+
+
+@pytest.mark.parametrize("name", sorted(DISTORTED))
+def test_charges_keep_the_formal_charge(name):
+    structure = read_pdb_arrays(os.path.join(OUTPUT_PATH, f"{name}_rmnpn_minimized.pdb"))
+    bonds = bond_graph(structure)
+    charges = gasteiger_charges(structure, bonds)
+    formal = np.char.count(structure.charge, "+") - np.char.count(structure.charge, "-")
+    assert charges.sum() == pytest.approx(formal.sum(), abs=1e-6)
+
+    # Per residue (the hydrogens are written after the heavy atoms, so grouped by chain and number),
+    # but for the distorted residues whose bogus bonds move charge across residues
+    if not DISTORTED[name]:
+        _, residue = np.unique(np.char.add(structure.chain, structure.resi.astype(str)), return_inverse=True)
+        assert np.allclose(np.bincount(residue, charges), np.bincount(residue, formal), atol=0.06)
+
+    # The united-atom receptor keeps the net charge
+    receptor, _, merged = merge_nonpolar_hydrogens(structure, autodock_types(structure, bonds), charges, bonds)
+    assert merged.sum() == pytest.approx(charges.sum(), abs=1e-6)
+    assert len(receptor) == len(read_pdbqt(os.path.join(OUTPUT_PATH, f"{name}_rmnpn_protein.pdbqt"))[0])
+
+
+def test_charges_of_known_residues_of_1sqt():
+    structure = read_pdb_arrays(os.path.join(OUTPUT_PATH, "1sqt_rmnpn_minimized.pdb"))
+    charges = gasteiger_charges(structure)
+
+    def residue_charge(resi):
+        return charges[(structure.chain == "A") & (structure.resi == resi)].sum()
+
+    # LYS 101 (NZ 1+), GLU 10 (1-), ALA 110 and SER 104 neutral
+    assert residue_charge(101) == pytest.approx(1.0, abs=0.01)
+    assert residue_charge(10) == pytest.approx(-1.0, abs=0.01)
+    assert residue_charge(110) == pytest.approx(0.0, abs=0.01)
+    assert residue_charge(104) == pytest.approx(0.0, abs=0.01)
+
+
+def test_hydrogen_bonded_to_two_carbons_is_folded_once(tmp_path):
+    # H3 sits 1.05 A from C1 and 1.15 A from C2: both bonds are perceived, C1 is its parent
+    ethane = _molecule(tmp_path, [("C1", "C", (0, 0, 0)), ("C2", "C", (1.54, 0, 0)), ("H1", "H", (-0.6, 0.9, 0)),
+                                  ("H2", "H", (2.1, 0.9, 0)), ("H3", "H", (0.54, -0.3, 0.87))])
+    charges = np.array([-0.1, -0.1, 0.05, 0.05, 0.1])
+    receptor, _, merged = merge_nonpolar_hydrogens(ethane, np.array(["C", "C", "H", "H", "H"]), charges)
+    assert list(receptor.atom_name) == ["C1", "C2"]
+    assert merged.tolist() == pytest.approx([0.05, -0.05])
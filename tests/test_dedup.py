@@ -0,0 +1,38 @@
+import os
+
+from protein_preprocessing import dedup
+from protein_preprocessing.dedup import dedup_directory, reuse_predictions
+from structure.triage import scan_pdb
+
+INPUT_PDB = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files", "1sqt.pdb")
+
+
+def test_homodimer_is_not_grouped_with_its_monomer(tmp_path):
+    with open(INPUT_PDB) as pdb_file:
+        atoms = [line for line in pdb_file if line.startswith("ATOM")]
+    chain_b = [line[:21] + "B" + line[22:] for line in atoms]
+    (tmp_path / "monomer.pdb").write_text("".join(atoms) + "END\n")
+    (tmp_path / "monomer_copy.pdb").write_text("".join(atoms) + "END\n")
+    (tmp_path / "dimer.pdb").write_text("".join(atoms) + "TER\n" + "".join(chain_b) + "END\n")
+
+    report = dedup_directory(str(tmp_path)).set_index("target")
+    assert report.loc["dimer", "chain_clusters"] == "A:0 B:0"
+    assert report.loc["monomer", "group"] == report.loc["monomer_copy", "group"]
+    assert report.loc["dimer", "group"] != report.loc["monomer", "group"]
+    assert report["is_representative"].sum() == 2
+
+
+def test_every_entry_is_scanned_once(tmp_path, monkeypatch):
+    with open(INPUT_PDB) as pdb_file:
+        atoms = "".join(line for line in pdb_file if line.startswith("ATOM")) + "END\n"
+    for name in ("copy_a", "copy_b", "copy_c"):
+        (tmp_path / f"{name}.pdb").write_text(atoms)
+    report = dedup_directory(str(tmp_path))
+    assert report["representative"].nunique() == 1
+    representative = report["representative"].iloc[0]
+    (tmp_path / f"results_{representative}.csv").write_text(",chain,resi,resn,p(bind)\n0,A,101,K,0.9\n")
+
+    scanned = []
+    monkeypatch.setattr(dedup, "scan_pdb", lambda path: scanned.append(os.path.basename(path)) or scan_pdb(path))
+    assert reuse_predictions(report, str(tmp_path), str(tmp_path)) == 2
+    assert sorted(scanned) == ["copy_a.pdb", "copy_b.pdb", "copy_c.pdb"]
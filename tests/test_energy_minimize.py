@@ -0,0 +1,35 @@
+import os
+import shutil
+
+from protein_preprocessing.energy_minimize import energy_minimize_pdbqt
+
+INPUT_PDB = os.path.join(os.path.dirname(__file__), "..", "output_pdb_files", "1sqt_rmnpn.pdb")
+
+# Stand-in for obabel: records its arguments and copies the input to the -O file
+STUB_OBABEL = """import shutil, sys
+args = sys.argv[1:]
+with open(__file__ + ".log", "a") as log:
+    log.write(" ".join(args) + "\\n")
+shutil.copy(args[0], args[args.index("-O") + 1])
+"""
+
+
+def _run(tmp_path, stub_obabel, **options):
+    obabel = stub_obabel(STUB_OBABEL)
+    input_directory = tmp_path / "input"
+    input_directory.mkdir()
+    shutil.copy(INPUT_PDB, input_directory / "1sqt.pdb")
+    energy_minimize_pdbqt(str(input_directory), str(tmp_path / "output"), **options)
+    return [line.split() for line in open(f"{obabel}.log").read().splitlines()]
+
+
+def test_obabel_minimize_keeps_its_defaults(tmp_path, stub_obabel):
+    minimize, _ = _run(tmp_path, stub_obabel, max_steps=50, tolerance=0.5)
+    assert "--minimize" in minimize
+    assert "--steps" not in minimize and "--crit" not in minimize
+
+
+def test_obabel_minimize_options_are_opt_in(tmp_path, stub_obabel):
+    minimize, _ = _run(tmp_path, stub_obabel, obabel_steps=200, obabel_crit=1e-4)
+    assert minimize[minimize.index("--steps") + 1] == "200"
+    assert minimize[minimize.index("--crit") + 1] == "0.0001"
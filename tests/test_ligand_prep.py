@@ -0,0 +1,60 @@
+import os
+
+from grid_box.ligand_sites import ligand_grid_boxes, write_pocket_configs
+from protein_preprocessing import ligand_prep
+from structure.pdb_arrays import read_pdb_arrays
+
+INPUT_PDB_FILES = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files")
+
+# Stand-in for obabel: -ocan prints the residue names, -oinchikey a key that also holds the handedness
+# of the first four heavy atoms (so mirror images differ), -O copies the input as the "prepared" ligand
+STUB_OBABEL = """import shutil, sys
+args = sys.argv[1:]
+lines = [line for line in open(args[0]) if line.startswith(("ATOM", "HETATM"))]
+if "-O" in args:
+    shutil.copyfile(args[0], args[args.index("-O") + 1])
+elif "-ocan" in args:
+    print(".".join(sorted({line[17:20].strip() for line in lines})), "ligand")
+elif "-oinchikey" in args:
+    xyz = [[float(line[c:c + 8]) for c in (30, 38, 46)] for line in lines[:4]]
+    u, v, w = ([b - a for a, b in zip(xyz[0], point)] for point in xyz[1:])
+    volume = u[0] * (v[1] * w[2] - v[2] * w[1]) - u[1] * (v[0] * w[2] - v[2] * w[0]) + u[2] * (v[0] * w[1] - v[1] * w[0])
+    print(f"{lines[0][17:20].strip()}-{len(lines)}-{'R' if volume > 0 else 'S'}")
+"""
+
+
+def test_mirror_images_get_their_own_cache_entry(tmp_path, stub_obabel):
+    stub_obabel(STUB_OBABEL)
+    structure = read_pdb_arrays(os.path.join(INPUT_PDB_FILES, "1sqt.pdb"))
+    mirrored = structure.subset(slice(None))
+    mirrored.coords = structure.coords * [1, 1, -1]
+
+    cache_directory = str(tmp_path / "cache")
+    first = ligand_prep.prepare_ligands([("1sqt", structure, "UI3")], str(tmp_path / "out"), cache_directory)
+    second = ligand_prep.prepare_ligands([("mirror", mirrored, "UI3")], str(tmp_path / "out"), cache_directory)
+
+    # Same graph key, but the InChIKey decides: the mirror image is prepared, not served from the cache
+    assert first["1sqt"][0]["key"] == second["mirror"][0]["key"]
+    assert first["1sqt"][0]["inchikey"] != second["mirror"][0]["inchikey"]
+    assert sorted(name for name in os.listdir(cache_directory) if name.endswith(".pdbqt")) == \
+        sorted(f"{record['inchikey']}.pdbqt" for record in first["1sqt"] + second["mirror"])
+
+
+def test_every_pocket_config_refers_to_its_own_ligand(tmp_path, stub_obabel):
+    stub_obabel(STUB_OBABEL)
+    structure = read_pdb_arrays(os.path.join(INPUT_PDB_FILES, "1d3g.pdb"))
+    output_directory = tmp_path / "out"
+    boxes = ligand_grid_boxes(structure)
+    config_paths = write_pocket_configs(boxes, str(output_directory), "1d3g", ligand_per_pocket=True)
+    records = ligand_prep.prepare_ligands([("1d3g", structure, None)], str(output_directory),
+                                          str(tmp_path / "cache"))["1d3g"]
+    assert [record["ligand_id"] for record in records] == [box["ligand_id"] for box in boxes]
+
+    # The acetate pocket docks the acetate, the inhibitor pocket the inhibitor BRE
+    for config_path, record in zip(config_paths, records):
+        with open(config_path) as config_file:
+            ligand = dict(line.split(" = ") for line in config_file.read().splitlines() if " = " in line)["ligand"]
+        assert os.path.join(output_directory, ligand) == record["files"][0]
+        with open(record["files"][0]) as ligand_file:
+            assert {line[17:20] for line in ligand_file if line.startswith(("ATOM", "HETATM"))} == {record["resn"]}
+    assert "BRE" in [record["resn"] for record in records]
@@ -0,0 +1,33 @@
+import os
+from collections import Counter
+
+import pytest
+
+from grid_box.ligand_sites import perceive_ligands
+from structure.pdb_arrays import read_pdb_arrays
+from structure.triage import scan_pdb
+
+INPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files")
+
+
+def _ligand_counts(pdb_path):
+    # Instances per residue name, as counted by triage.scan_pdb
+    structure = read_pdb_arrays(pdb_path)
+    return Counter(resn for members in perceive_ligands(structure) for resn in dict.fromkeys(structure.resn[members]))
+
+
+@pytest.mark.parametrize("name", ["1d3g", "1fvv", "1sqt", "1udt", "1uyg", "6o0k"])
+def test_ligands_match_the_triage_counts(name):
+    pdb_path = os.path.join(INPUT_PATH, f"{name}.pdb")
+    assert _ligand_counts(pdb_path) == scan_pdb(pdb_path)["ligands"]
+
+
+def test_modified_residues_are_not_ligands(tmp_path):
+    # 1sqt with its methionines written as HETATM MSE
+    with open(os.path.join(INPUT_PATH, "1sqt.pdb")) as pdb_file:
+        lines = [f"HETATM{line[6:17]}MSE{line[20:]}" if line.startswith("ATOM") and line[17:20] == "MET" else line
+                 for line in pdb_file]
+    pdb_path = tmp_path / "1sqt_mse.pdb"
+    pdb_path.write_text("".join(lines))
+    assert sum(line.startswith("HETATM") and line[17:20] == "MSE" for line in lines) > 0
+    assert _ligand_counts(str(pdb_path)) == {"UI3": 1} == scan_pdb(str(pdb_path))["ligands"]
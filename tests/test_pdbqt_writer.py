@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from protein_preprocessing.atom_typing import prepare_receptor_pdbqt
+from protein_preprocessing.pdbqt_writer import benchmark_pdbqt_writer, compare_with_obabel
+
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "output_files")
+
+
+def test_native_receptor_is_compared_field_by_field(tmp_path):
+    native_path = prepare_receptor_pdbqt(os.path.join(OUTPUT_PATH, "1sqt_rmnpn_minimized.pdb"),
+                                         str(tmp_path / "1sqt.pdbqt"))
+    mismatches = compare_with_obabel(native_path, os.path.join(OUTPUT_PATH, "1sqt_rmnpn_protein.pdbqt"))
+    assert mismatches["atoms"] == 2369
+    assert mismatches["unmatched"] == mismatches["atom_name"] == mismatches["residue"] == mismatches["type"] == 0
+    # The bundled obabel PDBQTs carry no charges (+0.000), the native ones are Gasteiger charges
+    assert mismatches["charge"] > 2000
+
+    # A file compared with itself has no mismatch
+    assert set(compare_with_obabel(native_path, native_path).values()) == {0, 2369}
+
+
+def test_empty_and_missing_files_are_reported(tmp_path):
+    native_path = os.path.join(OUTPUT_PATH, "1sqt_rmnpn_protein.pdbqt")
+    with pytest.raises(ValueError, match="is empty"):
+        compare_with_obabel(native_path, os.path.join(OUTPUT_PATH, "1fvv_rmnpn_protein.pdbqt"))
+    with pytest.raises(ValueError, match="is missing"):
+        compare_with_obabel(native_path, str(tmp_path / "missing.pdbqt"))
+
+    results = {result["receptor"]: result for result in benchmark_pdbqt_writer(OUTPUT_PATH, repeats=1)}
+    assert "is empty" in results["1fvv_rmnpn_protein.pdbqt"]["error"]
+    assert results["1sqt_rmnpn_protein.pdbqt"]["type"] == 0
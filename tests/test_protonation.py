@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from protein_preprocessing import protonation
+from structure.pdb_arrays import read_pdb_arrays
+
+INPUT_PDB = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files", "1sqt.pdb")
+
+# Stand-in for `obabel in.pdb -opdb -h -p pH -O out.pdb`: copies the atoms and adds one hydrogen per heavy atom
+STUB_OBABEL = """import sys
+args = sys.argv[1:]
+lines = [line for line in open(args[0]) if line.startswith(("ATOM", "HETATM"))]
+with open(args[args.index("-O") + 1], "w") as out:
+    for serial, line in enumerate(lines, 1):
+        out.write(line)
+        x = float(line[30:38]) + 1.0
+        out.write(f"HETATM{serial + 90000:5d}  H   {line[17:30]}{x:8.3f}{line[38:54]}  1.00  0.00           H\\n")
+    out.write("END\\n")
+"""
+
+
+def test_obabel_fallback_protonates_nonstandard_atoms(stub_obabel):
+    stub_obabel(STUB_OBABEL)
+
+    structure = read_pdb_arrays(INPUT_PDB)
+    heavy = structure.subset(structure.element != "H")
+    nonstandard = ~((heavy.record == "ATOM") & np.isin(heavy.resn, list(protonation.SIDECHAIN_TEMPLATES)))
+    assert nonstandard.any()
+
+    with_fallback = protonation.protonate(structure, fallback=True)
+    without_fallback = protonation.protonate(structure, fallback=False)
+
+    # One stub hydrogen per non-standard heavy atom, written in the residue of its parent
+    assert len(with_fallback) - len(without_fallback) == nonstandard.sum()
+    hydrogens = with_fallback.subset(with_fallback.element == "H")
+    assert set(heavy.resn[nonstandard]) <= set(hydrogens.resn)
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+from structure.pdb_arrays import read_pdb_arrays
+from structure.selection import count_atoms, select
+
+INPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files")
+PYMOL_PATH = os.path.join(os.path.dirname(__file__), "..", "output_pdb_files")
+
+# Atom counts checked by hand against the files: HET records (atoms per HET group),
+# HETATM and HOH lines, and the CA lines with a B-factor below 30.
+# organic: every HET group but water, SO4 (1d3g) and the ZN/MG ions (1udt).
+EXPECTED_COUNTS = {
+    "1d3g": {"hetatm": 366, "solvent": 274, "organic": 4 + 27 + 31 + 11 + 14, "resn FMN": 31,
+             "name CA and b < 30": 310},
+    "1fvv": {"hetatm": 191, "solvent": 129, "organic": 31 + 31, "resn 107": 62, "name CA and b < 30": 5},
+    "1sqt": {"hetatm": 99, "solvent": 75, "organic": 24, "resn UI3": 24, "name CA and b < 30": 244},
+    "1udt": {"hetatm": 113, "solvent": 78, "organic": 33, "resn ZN+MG": 2, "name CA and b < 30": 84},
+    "1uyg": {"hetatm": 259, "solvent": 237, "organic": 22, "resn PU2": 22, "name CA and b < 30": 0},
+    "6o0k": {"hetatm": 248, "solvent": 98, "organic": 122 + 28, "resn LBM": 122, "name CA and b < 30": 145},
+}
+
+# Hand-built structure: ALA 1 and GLY 2 peptide-bonded, ALA 3 20 A away, a ligand (chain B)
+# next to GLY 2 and a water (resi 1, chain W) next to ALA 1.
+SMALL_ATOMS = [
+    ("ATOM", "N", "ALA", "A", 1, (0.0, 0.0, 0.0), 10.0, "N"),
+    ("ATOM", "CA", "ALA", "A", 1, (1.5, 0.0, 0.0), 20.0, "C"),
+    ("ATOM", "C", "ALA", "A", 1, (2.5, 1.0, 0.0), 40.0, "C"),
+    ("ATOM", "N", "GLY", "A", 2, (3.8, 1.0, 0.0), 20.0, "N"),
+    ("ATOM", "CA", "GLY", "A", 2, (4.5, 2.2, 0.0), 50.0, "C"),
+    ("ATOM", "C", "GLY", "A", 2, (6.0, 2.2, 0.0), 50.0, "C"),
+    ("ATOM", "N", "ALA", "A", 3, (20.0, 0.0, 0.0), 25.0, "N"),
+    ("ATOM", "CA", "ALA", "A", 3, (21.5, 0.0, 0.0), 25.0, "C"),
+    ("ATOM", "C", "ALA", "A", 3, (22.5, 1.0, 0.0), 25.0, "C"),
+    ("HETATM", "C1", "LIG", "B", 10, (5.0, 5.0, 0.0), 30.0, "C"),
+    ("HETATM", "O1", "LIG", "B", 10, (6.0, 5.0, 0.0), 30.0, "O"),
+    ("HETATM", "O", "HOH", "W", 1, (1.5, 3.0, 0.0), 30.0, "O"),
+]
+
+# Serials expected for every selection, worked out from the distances of SMALL_ATOMS
+SMALL_EXPECTED = {
+    "polymer.protein": [1, 2, 3, 4, 5, 6, 7, 8, 9],
+    "not polymer.protein": [10, 11, 12],
+    "organic": [10, 11],
+    "bychain organic": [10, 11],
+    "solvent around 3.5": [1, 2, 3, 4, 5],
+    "polymer.protein within 4 of organic": [5, 6],
+    "byres (polymer.protein within 4 of organic)": [4, 5, 6],
+    "polymer.protein and byres (resn LIG around 5)": [1, 2, 3, 4, 5, 6],
+    "name CA and b < 30": [2, 8],
+    "resi 1+3": [1, 2, 3, 7, 8, 9, 12],
+    "resi 1-2 and name CA": [2, 5],
+    # "and" binds tighter than "+" (or), as in PyMOL
+    "select chA, resi 1 + resi 3 and chain A": [1, 2, 3, 7, 8, 9, 12],
+    "(resi 1 + resi 3) and chain A": [1, 2, 3, 7, 8, 9],
+    "chain B or solvent": [10, 11, 12],
+    "elem C+N and not hetatm": [1, 2, 3, 4, 5, 6, 7, 8, 9],
+    "byres ((x >= 4) and (x <= 7)) and ((y >= 0) and (y <= 3))": [4, 5, 6],
+}
+
+
+def _atom_keys(structure, mask=None):
+    # Atoms of a structure as (chain, resi, icode, resn, atom_name) tuples
+    if mask is not None:
+        structure = structure.subset(mask)
+    return sorted(zip(structure.chain, structure.resi, structure.icode, structure.resn, structure.atom_name))
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED_COUNTS))
+def test_keyword_counts_match_the_pdb_records(name):
+    structure = read_pdb_arrays(os.path.join(INPUT_PATH, f"{name}.pdb"))
+    counts = {selection: count_atoms(structure, selection) for selection in EXPECTED_COUNTS[name]}
+    assert counts == EXPECTED_COUNTS[name]
+    assert count_atoms(structure, "polymer.protein") + count_atoms(structure, "not polymer.protein") == len(structure)
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED_COUNTS))
+def test_polymer_protein_matches_the_pymol_output(name):
+    # output_pdb_files/*_rmnpn.pdb were saved by PyMOL after remove("not polymer.protein")
+    structure = read_pdb_arrays(os.path.join(INPUT_PATH, f"{name}.pdb"))
+    reference = read_pdb_arrays(os.path.join(PYMOL_PATH, f"{name}_rmnpn.pdb"))
+    assert _atom_keys(structure, select(structure, "polymer.protein")) == _atom_keys(reference)
+
+
+def test_selections_on_a_hand_built_structure(tmp_path):
+    pdb_path = tmp_path / "small.pdb"
+    with open(pdb_path, "w") as pdb_file:
+        for serial, (record, name, resn, chain, resi, (x, y, z), bfactor, element) in enumerate(SMALL_ATOMS, 1):
+            pdb_file.write(f"{record:<6}{serial:5d}  {name:<3} {resn:>3} {chain}{resi:4d}    "
+                           f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00{bfactor:6.2f}          {element:>2}\n")
+        pdb_file.write("END\n")
+    structure = read_pdb_arrays(str(pdb_path))
+
+    selected = {selection: sorted(int(serial) for serial in structure.serial[select(structure, selection)])
+                for selection in SMALL_EXPECTED}
+    assert selected == SMALL_EXPECTED
+    assert not np.any(select(structure, "hydrogens"))
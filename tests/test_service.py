@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from af2bind.service import PredictionService, synthetic_forward
+
+INPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files")
+
+
+def _pdb(name):
+    return os.path.join(INPUT_PATH, f"{name}.pdb")
+
+
+def _counting(forward):
+    # Forward pass recording the targets it is called with
+    calls = []
+
+    def counted(items):
+        calls.append([item["target"] for item in items])
+        return forward(items)
+
+    return counted, calls
+
+
+def test_identical_requests_are_predicted_once():
+    forward, params = synthetic_forward(delay=0.05, per_residue=0)
+    forward, calls = _counting(forward)
+    service = PredictionService(forward, params, window=0.2)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda k: service.submit(_pdb("1sqt"), "A"), range(4)))
+
+    assert calls == [["1sqt"]]
+    assert all(result["residues"].equals(results[0]["residues"]) for result in results)
+    assert service.metrics()["predicted"] == 1
+
+    # Later requests are answered from the cache, without a forward pass
+    result = service.submit(_pdb("1sqt"), "A", target="again")
+    assert result["target"] == "again" and result["residues"].equals(results[0]["residues"])
+    assert len(calls) == 1 and service.metrics()["cache_hits"] == 1
+
+
+def test_results_are_released_as_their_target_is_predicted():
+    # 1sqt and 6o0k are in one batch only with a wide length bucket, 6o0k (shorter) runs first
+    forward, params = synthetic_forward(delay=0.5, per_residue=0)
+    forward, calls = _counting(forward)
+    service = PredictionService(forward, params, window=0.2)
+    service._bucket = lambda item: (item["mask_sidechains"], item["mask_sequence"])
+    released = {}
+
+    def request(name):
+        service.submit(_pdb(name), "A")
+        released[name] = time.perf_counter()
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ("1sqt", "6o0k")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [["6o0k", "1sqt"]]
+    assert released["1sqt"] - released["6o0k"] > 0.4
+
+
+def test_batches_hold_one_length_bucket():
+    forward, params = synthetic_forward(delay=0.05, per_residue=0)
+    forward, calls = _counting(forward)
+    service = PredictionService(forward, params, window=0.2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda name: service.submit(_pdb(name), "A"), ["1sqt", "6o0k"]))
+    assert sorted(calls) == [["1sqt"], ["6o0k"]]
+
+
+def test_forward_errors_reach_the_waiting_requests():
+    forward, params = synthetic_forward(delay=0, per_residue=0)
+
+    def failing(items):
+        # The first target is predicted, the second fails
+        outputs = forward(items)
+        yield next(outputs)
+        raise RuntimeError("out of memory")
+
+    service = PredictionService(failing, params, window=0.2)
+    service._bucket = lambda item: (item["mask_sidechains"], item["mask_sequence"])
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {name: executor.submit(service.submit, _pdb(name), "A") for name in ("1sqt", "6o0k")}
+        assert len(futures["6o0k"].result()["residues"]) == 141
+        with pytest.raises(RuntimeError, match="out of memory"):
+            futures["1sqt"].result()
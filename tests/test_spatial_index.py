@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from structure.pdb_arrays import read_pdb_arrays
+from structure.spatial_index import MASKED_TREES, spatial_index
+
+INPUT_PDB = os.path.join(os.path.dirname(__file__), "..", "input_pdb_files", "1sqt.pdb")
+
+
+def test_nearest_is_clamped_to_the_masked_atoms():
+    structure = read_pdb_arrays(INPUT_PDB)
+    index = spatial_index(structure)
+    mask = np.zeros(len(structure), dtype=bool)
+    mask[[10, 20, 30]] = True
+
+    distances, atoms = index.nearest(structure.coords[:2], k=5, mask=mask)
+    assert atoms.shape == distances.shape == (2, 3)
+    assert np.all(np.isfinite(distances))
+    assert set(atoms[0]) == {10, 20, 30}
+    assert atoms[0, 0] == 10 and distances[0, 0] == np.linalg.norm(structure.coords[0] - structure.coords[10])
+
+    _, atoms = index.nearest(structure.coords[0], k=2, mask=np.zeros(len(structure), dtype=bool))
+    assert atoms.shape == (1, 0)
+
+
+def test_masked_trees_are_bounded():
+    structure = read_pdb_arrays(INPUT_PDB)
+    index = spatial_index(structure)
+    for start in range(3 * MASKED_TREES):
+        mask = np.zeros(len(structure), dtype=bool)
+        mask[start:start + 10] = True
+        index.nearest(structure.coords[0], mask=mask)
+    assert len(index.masked_trees) == MASKED_TREES
+    assert not any(isinstance(key, tuple) and key[0] == "masked_tree" for key in structure.cache)
@@ -0,0 +1,25 @@
+import os
+
+from grid_box.vina_config import config_record, read_config, write_configs
+
+BOX = {"center": (1.0, 2.0, 3.0), "size": 20}
+
+
+def test_configs_read_back_their_target_and_box(tmp_path):
+    records = [config_record(dict(BOX, box_id=box_id), target="1d3g") for box_id in ("ACT_A401", "BRE_A397")]
+    records.append(config_record(BOX, target="1sqt_rmnpn"))
+    config_paths = write_configs(records, str(tmp_path))
+    assert [os.path.basename(path) for path in config_paths] == \
+        ["1d3g_ACT_A401_config.txt", "1d3g_BRE_A397_config.txt", "1sqt_rmnpn_config.txt"]
+    assert [read_config(path) for path in config_paths] == records
+
+
+def test_configs_without_identifiers_split_the_file_name(tmp_path):
+    # Written before the target and box_id comments: the receptor name gives the target
+    text = "receptor = 1d3g.pdbqt\ncenter_x = 1\ncenter_y = 2\ncenter_z = 3\nsize_x = 20\nsize_y = 20\nsize_z = 20\n"
+    (tmp_path / "1d3g_A401_config.txt").write_text(text)
+    (tmp_path / "1sqt_config.txt").write_text(text.replace("1d3g", "1sqt"))
+    record = read_config(str(tmp_path / "1d3g_A401_config.txt"))
+    assert (record["target"], record["box_id"]) == ("1d3g", "A401")
+    record = read_config(str(tmp_path / "1sqt_config.txt"))
+    assert (record["target"], record["box_id"]) == ("1sqt", None)
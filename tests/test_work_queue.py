@@ -0,0 +1,54 @@
+import threading
+import time
+
+from cluster.work_queue import WorkQueue, run_worker
+
+
+def _targets(tmp_path, n):
+    paths = []
+    for i in range(n):
+        path = tmp_path / f"t{i}.pdb"
+        path.write_text(f"REMARK target {i}\nEND\n")
+        paths.append(str(path))
+    return paths
+
+
+def test_batched_targets_keep_their_lease(tmp_path):
+    # The last target of a batch waits 2 x 0.6 s, longer than the lease: only heartbeats keep it owned
+    db_path = str(tmp_path / "queue.db")
+    with WorkQueue(db_path) as queue:
+        queue.submit("wait", _targets(tmp_path, 3), str(tmp_path / "out"), seconds=0.6)
+
+    # Another worker claiming meanwhile re-queues whatever looks stale
+    stop = threading.Event()
+
+    def other_worker():
+        with WorkQueue(db_path, lease=1.0) as queue:
+            while not stop.wait(0.05):
+                queue.claim("other-worker", 0)
+
+    thread = threading.Thread(target=other_worker)
+    thread.start()
+    try:
+        assert run_worker(db_path, batch=3, lease=1.0, heartbeat=0.2) == 3
+    finally:
+        stop.set()
+        thread.join()
+
+    with WorkQueue(db_path) as queue:
+        results = queue.results("wait")
+    assert list(results["status"]) == ["done"] * 3
+    assert list(results["attempts"]) == [1] * 3
+
+
+def test_requeue_stale_counts_failed_and_requeued(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    with WorkQueue(db_path, lease=0.1, max_attempts=2) as queue:
+        queue.submit("wait", _targets(tmp_path, 3), str(tmp_path / "out"))
+        queue.claim("lost-worker", 3)
+        # One target already used its last attempt
+        queue.connection.execute("UPDATE tasks SET attempts = 2 WHERE target = 't0'")
+        time.sleep(0.2)
+        assert queue.requeue_stale() == 3
+        status = dict(queue.connection.execute("SELECT target, status FROM tasks").fetchall())
+    assert status == {"t0": "failed", "t1": "queued", "t2": "queued"}